@@ -1,35 +1,113 @@
 import array
 import uctypes
 import rp_devices as devs
+import rp_dma
+from grinder_fast import dma_busy, dma_chan_addr, dma_finish_sniffed_capture
 from machine import ADC
 
+ADC_CLOCK_HZ = 48000000
+ADC_CONVERSION_CYCLES = 96  # i.e. 500kS/s at full speed
+ADC_MAX_SAMPLE_RATE = ADC_CLOCK_HZ // ADC_CONVERSION_CYCLES
+# Most samples per capture: Keeps the sniffed sum of 12 bit samples, scaled to 16 bits, below 2**30, i.e. a small int
+MAX_OVERSAMPLE_SAMPLES = 1 << 14
+# Poll and stop captures with the viper functions of grinder_fast instead of uctypes bitfields – a fraction of the cost
+# per iteration. False: uctypes only, e.g. for comparison (see grinder_benchmark.py).
+FAST_REGISTER_ACCESS = True
+
+
+# Returns the ADC DIV register value for the given sample rate in samples per second (0: full speed).
+# DIV is a 16.8 fixed point number of ADC clock cycles between the starts of two conversions, minus one.
+def adc_div_for_sample_rate(sample_rate: int) -> int:
+    if sample_rate <= 0 or sample_rate >= ADC_MAX_SAMPLE_RATE:
+        return 0
+    return (ADC_CLOCK_HZ * 256) // sample_rate - 256
+
+
+def _setup_adc_for_dma(adc, adc_channel) -> None:
+    adc.FCS.THRESH = 1  # request DMA after every value
+    adc.FCS.DREQ_EN = 1  # enable DMA requests
+    adc.FCS.ERR = adc.FCS.SHIFT = 0
+    adc.FCS.EN = 1  # enable FIFO – needed for DMA
+
+    adc.CS.RROBIN = 0
+    adc.CS.AINSEL = adc_channel
+
+    adc.DIV_REG = 0  # full speed ahead
+
+
+# The ADC draws power (about 1mW) while enabled, even without conversions. It can be powered down between captures – but
+# no capture may be started (or running) while it is, and all captures need it to be powered up again first.
+def adc_power_down() -> None:
+    devs.ADC_DEVICE.CS.EN = 0
+
+
+def adc_power_up() -> None:
+    adc = devs.ADC_DEVICE
+    adc.CS.EN = 1
+    while not adc.CS.READY:  # startup time
+        pass
+
+
+# Discard any data in ADC FIFO
+def _drain_adc_fifo(adc) -> None:
+    while not adc.CS.READY:
+        pass
+    while not adc.FCS.EMPTY:
+        _ = adc.FIFO_REG
+
+
+# int.bit_length() is not available on MicroPython
+def _log2(value: int) -> int:
+    bits = 0
+    while value > 1:
+        value >>= 1
+        bits += 1
+    return bits
+
+
+# Returns a 16-bit sample buffer (as memoryview) of the given number of samples, aligned to its size in bytes, and the
+# array backing it, which has to be kept alive. Needed for using the DMA ring feature. The number of samples must be a
+# power of two.
+def _aligned_sample_buffer(samples: int, count=1):
+    ring_bytes = samples * 2
+    if ring_bytes & (ring_bytes - 1):
+        raise ValueError('number of samples must be a power of two')
+    backing_buff = array.array('H', (0 for _ in range((count + 1) * samples)))
+    align_offset = (-uctypes.addressof(backing_buff) % ring_bytes) // 2
+    return memoryview(backing_buff)[align_offset:align_offset + count * samples], backing_buff
+
 
 # Uses DMA and sniffing to provide fast reading of averaged ADC samples – specifically for the RP2040.
+# Optionally paced and oversampled, see configure().
 # Caution: Uses uctypes to directly fiddle with DMA and ADC registers. For ADC itself, this should not be problematic.
-#          For DMA however, this might clash with other users, including the native Pico SDK, because the DMA channel is
-#          not "claimed" in SDK terms. For now – Micropython v1.17 with Pico SDK 1.3.0 – this could be problematic if
-#          SPI and/or I2S were used. See "grep -i dma_claim".
+#          DMA channels and the sniffer are claimed through rp_dma (dma_chan=None: any free channel), which refuses
+#          conflicting claims. Specific channel numbers are not claimed in SDK terms though, so they might still clash
+#          with SDK users of DMA (e.g. SPI and/or I2S) – prefer letting rp_dma choose. All classes below release their
+#          channels in deinit().
 class Rp2040AdcDmaAveraging(ADC):
-    def __init__(self, gpio_pin=26, dma_chan=0, adc_samples=32):
+    def __init__(self, gpio_pin=26, dma_chan=None, adc_samples=32, resolution_bits=12, sample_rate=0):
         super().__init__(gpio_pin)  # initializes ADC and pin/pad
+        self._buffer_samples = adc_samples
         self._adc_samples = adc_samples
+        self._capture_samples = adc_samples
+        self._adc_div = 0
         self._adc_channel = gpio_pin - 26
 
         self._adc = devs.ADC_DEVICE
+        dma_chan = rp_dma.claim_channel(dma_chan)
+        try:
+            rp_dma.claim_sniffer(dma_chan)
+        except RuntimeError:
+            rp_dma.release_channel(dma_chan)
+            raise
+        self._dma_chan_index = dma_chan
         self._dma_chan = devs.DMA_CHANS[dma_chan]
+        self._dma_chan_addr = dma_chan_addr(dma_chan)
         self._dma = devs.DMA_DEVICE
 
-        self._adc_buff = array.array('H', (0 for _ in range(self._adc_samples)))
-
-        self._adc.FCS.THRESH = 1  # request DMA after every value
-        self._adc.FCS.DREQ_EN = 1  # enable DMA requests
-        self._adc.FCS.ERR = self._adc.FCS.SHIFT = 0
-        self._adc.FCS.EN = 1  # enable FIFO – needed for DMA
+        self._adc_buff = array.array('H', (0 for _ in range(self._buffer_samples)))
 
-        self._adc.CS.RROBIN = 0
-        self._adc.CS.AINSEL = self._adc_channel
-
-        self._adc.DIV_REG = 0  # full speed ahead
+        _setup_adc_for_dma(self._adc, self._adc_channel)
 
         self._dma_chan.READ_ADDR_REG = devs.ADC_FIFO_ADDR
         self._dma_chan.CTRL_TRIG_REG = 0
@@ -45,30 +123,395 @@ class Rp2040AdcDmaAveraging(ADC):
         self._dma.SNIFF_CTRL.DMACH = dma_chan
         self._dma.SNIFF_CTRL.EN = 1
 
+        self.configure(resolution_bits, sample_rate)
+
+    # Selects the trade-off between resolution, sampling rate and capture time. Only while no capture is running.
+    # - resolution_bits: Effective resolution of 12 to 16 bits by oversampling and decimation: Each extra bit takes four
+    #   times the samples (i.e. up to 256 for 16 bits), relying on the ADC noise as dither. The extra bits are only
+    #   returned by read_average_u16() – read_average_u12() just averages over the additional samples. As at least
+    #   adc_samples are taken anyway, resolutions that would not need more samples than that are rejected.
+    # - sample_rate: Samples per second, paced by the ADC clock divider (0: full speed, 500kS/s). Lower rates spread a
+    #   capture over a longer time, averaging out interference (e.g. motor commutation ripple) instead of capturing a
+    #   snapshot of it.
+    # - adc_samples: Minimum number of samples per capture (0: unchanged), initially as given on construction.
+    # Samples beyond the size of the sample buffer are all written to its first word, only the sniffer sees all – so
+    # no reallocation is needed for any number of samples.
+    def configure(self, resolution_bits=12, sample_rate=0, adc_samples=0) -> None:
+        if not 12 <= resolution_bits <= 16:
+            raise ValueError('resolution must be 12 to 16 bits')
+        if adc_samples <= 0:
+            adc_samples = self._adc_samples
+        oversample_samples = 1 << (2 * (resolution_bits - 12))
+        if resolution_bits > 12 and oversample_samples <= adc_samples:
+            raise ValueError('{} bits take no more than the {} samples averaged anyway'.format(resolution_bits,
+                                                                                               adc_samples))
+        self._adc_samples = adc_samples
+        self._capture_samples = min(max(adc_samples, oversample_samples), MAX_OVERSAMPLE_SAMPLES)
+        self._dma_chan.CTRL_TRIG.INCR_WRITE = 1 if self._capture_samples <= self._buffer_samples else 0
+        self._adc_div = adc_div_for_sample_rate(sample_rate)
+
+    @property
+    def capture_samples(self) -> int:
+        return self._capture_samples
+
+    # Duration of one capture in microseconds
+    @property
+    def capture_time_us(self) -> int:
+        cycles_per_sample = max(ADC_CONVERSION_CYCLES, 1 + self._adc_div / 256)
+        return int(self._capture_samples * cycles_per_sample * 1000000 // ADC_CLOCK_HZ)
+
     # Discard any data in ADC FIFO
     def _drain_adc_fifo(self) -> None:
-        while not self._adc.CS.READY:
-            pass
-        while not self._adc.FCS.EMPTY:
-            _ = self._adc.FIFO_REG
+        _drain_adc_fifo(self._adc)
 
     # Capture ADC samples using DMA
     def capture_start(self) -> None:
         self._drain_adc_fifo()
         self._dma.SNIFF_DATA = 0  # reset accumulator
         self._dma_chan.WRITE_ADDR_REG = uctypes.addressof(self._adc_buff)
-        self._dma_chan.TRANS_COUNT_REG = self._adc_samples
+        self._dma_chan.TRANS_COUNT_REG = self._capture_samples
         self._dma_chan.CTRL_TRIG.EN = 1
         self._adc.CS.AINSEL = self._adc_channel  # set again because read_u16() might have changed it
+        self._adc.CS.RROBIN = 0  # and Rp2040AdcDmaMultiChannel might have enabled round-robin
+        self._adc.DIV_REG = self._adc_div  # the ADC is shared, too
         self._adc.CS.START_MANY = 1
 
+    def capture_busy(self) -> bool:
+        if FAST_REGISTER_ACCESS:
+            return dma_busy(self._dma_chan_addr)
+        return self._dma_chan.CTRL_TRIG.BUSY
+
+    # Only valid once capture_busy() returned False
+    def read_average_u12(self) -> int:
+        if FAST_REGISTER_ACCESS:
+            return dma_finish_sniffed_capture(self._dma_chan_addr) // self._capture_samples
+        self._adc.CS.START_MANY = 0
+        self._dma_chan.CTRL_TRIG.EN = 0
+        # To save power, the ADC can be powered down now and up again before the next capture, see adc_power_down()
+
+        sniffed_avg = self._dma.SNIFF_DATA // self._capture_samples
+
+        return sniffed_avg
+
     def wait_and_read_average_u12(self) -> int:
+        if not FAST_REGISTER_ACCESS:  # otherwise, reading waits anyway
+            while self._dma_chan.CTRL_TRIG.BUSY:
+                pass
+        return self.read_average_u12()
+
+    # Only valid once capture_busy() returned False. Average scaled to 16 bits (like read_u16()), with as many
+    # significant bits as configured via configure() – the lower bits of the decimated sum instead of zeros.
+    def read_average_u16(self) -> int:
+        if FAST_REGISTER_ACCESS:
+            return (dma_finish_sniffed_capture(self._dma_chan_addr) << 4) // self._capture_samples
+        self._adc.CS.START_MANY = 0
+        self._dma_chan.CTRL_TRIG.EN = 0
+        return (self._dma.SNIFF_DATA << 4) // self._capture_samples
+
+    def wait_and_read_average_u16(self) -> int:
+        if not FAST_REGISTER_ACCESS:
+            while self._dma_chan.CTRL_TRIG.BUSY:
+                pass
+        return self.read_average_u16()
+
+    # Stops any capture and releases the DMA channel and sniffer
+    def deinit(self) -> None:
+        self._adc.CS.START_MANY = 0
+        self._dma_chan.CTRL_TRIG.EN = 0
+        rp_dma.release_channel(self._dma_chan_index)
+
+
+# Captures several ADC inputs in one DMA burst, using the ADC's round-robin mode, e.g. VSYS, a motor current shunt and
+# the internal temperature sensor (ADC input 4). The ADC cycles through the enabled inputs in ascending order, starting
+# at the lowest one, so the samples in the buffer are interleaved in that order and can be demultiplexed by position.
+# No sniffing, as the sniffer can only sum up all samples of the burst regardless of their input. Instead, the samples
+# are summed up per input in software, into a preallocated array.
+# Input numbers are the ADC's (0-3: GPIO 26-29, 4: temperature sensor), not GPIO pins.
+class Rp2040AdcDmaMultiChannel:
+    def __init__(self, adc_inputs=(3, 4), dma_chan=None, samples_per_input=16):
+        self._inputs = sorted(set(adc_inputs))
+        self._input_count = len(self._inputs)
+        self._samples_per_input = samples_per_input
+        self._total_samples = self._input_count * samples_per_input
+        self._rrobin_mask = 0
+        for adc_input in self._inputs:
+            self._rrobin_mask |= 1 << adc_input
+        # Initializes ADC and pins/pads, or the temperature sensor for input 4
+        self._machine_adcs = [ADC(adc_input) for adc_input in self._inputs]
+
+        self._adc = devs.ADC_DEVICE
+        dma_chan = rp_dma.claim_channel(dma_chan)
+        self._dma_chan_index = dma_chan
+        self._dma_chan = devs.DMA_CHANS[dma_chan]
+
+        self._adc_buff = array.array('H', (0 for _ in range(self._total_samples)))
+        self._sums = array.array('l', (0 for _ in range(self._input_count)))
+
+        _setup_adc_for_dma(self._adc, self._inputs[0])
+        if ADC.CORE_TEMP in self._inputs:
+            self._adc.CS.TS_EN = 1
+
+        self._dma_chan.READ_ADDR_REG = devs.ADC_FIFO_ADDR
+        self._dma_chan.CTRL_TRIG_REG = 0
+        self._dma_chan.CTRL_TRIG.CHAIN_TO = dma_chan  # no chaining
+        self._dma_chan.CTRL_TRIG.INCR_WRITE = 1
+        self._dma_chan.CTRL_TRIG.IRQ_QUIET = 1
+        self._dma_chan.CTRL_TRIG.TREQ_SEL = devs.DREQ_ADC
+        self._dma_chan.CTRL_TRIG.DATA_SIZE = 1  # 16-bit
+
+    # ADC inputs in the order of the averages returned by read_averages_u12()
+    @property
+    def inputs(self) -> list:
+        return self._inputs
+
+    def capture_start(self) -> None:
+        _drain_adc_fifo(self._adc)
+        self._dma_chan.WRITE_ADDR_REG = uctypes.addressof(self._adc_buff)
+        self._dma_chan.TRANS_COUNT_REG = self._total_samples
+        self._dma_chan.CTRL_TRIG.EN = 1
+        # Set again because read_u16() and the other capture classes might have changed them. The first input has to
+        # be selected for the samples to be in the expected order.
+        self._adc.CS.AINSEL = self._inputs[0]
+        self._adc.CS.RROBIN = self._rrobin_mask
+        self._adc.DIV_REG = 0
+        self._adc.CS.START_MANY = 1
+
+    def capture_busy(self) -> bool:
+        return self._dma_chan.CTRL_TRIG.BUSY
+
+    # Only valid once capture_busy() returned False. Writes the average of each input into averages, in the order of
+    # inputs.
+    def read_averages_u12(self, averages) -> None:
+        self._adc.CS.START_MANY = 0
+        self._dma_chan.CTRL_TRIG.EN = 0
+
+        sums = self._sums
+        input_count = self._input_count
+        for i in range(input_count):
+            sums[i] = 0
+        index = 0
+        for value in self._adc_buff:
+            sums[index] += value
+            index += 1
+            if index == input_count:
+                index = 0
+        for i in range(input_count):
+            averages[i] = sums[i] // self._samples_per_input
+
+    def wait_and_read_averages_u12(self, averages) -> None:
         while self._dma_chan.CTRL_TRIG.BUSY:
             pass
+        self.read_averages_u12(averages)
+
+    def deinit(self) -> None:
         self._adc.CS.START_MANY = 0
         self._dma_chan.CTRL_TRIG.EN = 0
-        #  Consider CS.EN = 0 to save power – but does it need to be reconfigured after?
+        rp_dma.release_channel(self._dma_chan_index)
 
-        sniffed_avg = self._dma.SNIFF_DATA // self._adc_samples
 
-        return sniffed_avg
+# Free-running variant of the above: Two DMA channels chain to each other, each filling its own sample buffer. Once
+# started, the ADC and DMA keep running without any CPU involvement, so reading the latest average never has to wait.
+# Both buffers are placed inside one larger array such that each is aligned to its own size. This allows using the
+# write address ring feature of the DMA, so that the channels never have to be re-armed by software.
+# No sniffing here, as the sniffer can only observe one channel. Instead, the completed buffer is summed up in software,
+# which is cheap for small buffers as sum() is implemented in C.
+# Smaller buffers and a lower sample rate can be selected with configure().
+class Rp2040AdcDmaPingPong(ADC):
+    def __init__(self, gpio_pin=26, dma_chans=(None, None), adc_samples=16):
+        super().__init__(gpio_pin)  # initializes ADC and pin/pad
+        self._buffer_samples = adc_samples
+        self._adc_samples = adc_samples
+        self._adc_channel = gpio_pin - 26
+        self._ring_size = _log2(adc_samples * 2)
+        self._adc_div = 0
+
+        self._adc = devs.ADC_DEVICE
+        first = rp_dma.claim_channel(dma_chans[0])
+        try:
+            second = rp_dma.claim_channel(dma_chans[1])
+        except (RuntimeError, ValueError):
+            rp_dma.release_channel(first)
+            raise
+        dma_chans = self._dma_chan_indices = (first, second)
+        self._dma_chans = [devs.DMA_CHANS[chan] for chan in dma_chans]
+        self._second_chan_addr = dma_chan_addr(second)
+        self._dma_chan_mask = (1 << dma_chans[0]) | (1 << dma_chans[1])
+        self._dma = devs.DMA_DEVICE
+
+        # Two consecutive buffers, each aligned to its size – and therefore to any smaller power of two, too. Views of
+        # their beginnings for all smaller sizes, indexed by log2(samples), so configure() does not allocate.
+        buffs_view, self._adc_backing_buff = _aligned_sample_buffer(adc_samples, count=2)
+        self._full_buffs = (buffs_view[:adc_samples], buffs_view[adc_samples:])
+        self._buff_views = tuple((self._full_buffs[0][:1 << i], self._full_buffs[1][:1 << i])
+                                 for i in range(self._ring_size))
+        self._adc_buffs = self._full_buffs
+
+        _setup_adc_for_dma(self._adc, self._adc_channel)
+
+        for index, dma_chan in enumerate(self._dma_chans):
+            dma_chan.CTRL_TRIG_REG = 0
+            dma_chan.READ_ADDR_REG = devs.ADC_FIFO_ADDR
+            dma_chan.WRITE_ADDR_REG = uctypes.addressof(self._adc_buffs[index])
+            dma_chan.TRANS_COUNT_REG = self._adc_samples  # reloaded every time the channel is triggered
+            dma_chan.CTRL_TRIG.CHAIN_TO = dma_chans[1 - index]  # ping-pong
+            dma_chan.CTRL_TRIG.RING_SEL = 1  # wrap write address
+            dma_chan.CTRL_TRIG.RING_SIZE = self._ring_size
+            dma_chan.CTRL_TRIG.INCR_WRITE = 1
+            dma_chan.CTRL_TRIG.IRQ_QUIET = 1
+            dma_chan.CTRL_TRIG.TREQ_SEL = devs.DREQ_ADC
+            dma_chan.CTRL_TRIG.DATA_SIZE = 1  # 16-bit
+
+    # Selects the number of samples per buffer (a power of two, up to adc_samples as given on construction;
+    # 0: unchanged) and the sample rate (see Rp2040AdcDmaAveraging.configure()). Only while no capture is running.
+    def configure(self, adc_samples=0, sample_rate=0) -> None:
+        if adc_samples > 0:
+            ring_size = _log2(adc_samples * 2)
+            if adc_samples > self._buffer_samples or 1 << (ring_size - 1) != adc_samples:
+                raise ValueError('samples must be a power of two up to {}'.format(self._buffer_samples))
+            self._adc_samples = adc_samples
+            self._ring_size = ring_size
+            self._adc_buffs = self._buff_views[ring_size - 1]
+            for index, dma_chan in enumerate(self._dma_chans):
+                dma_chan.WRITE_ADDR_REG = uctypes.addressof(self._adc_buffs[index])  # might be anywhere in the ring
+                dma_chan.TRANS_COUNT_REG = adc_samples
+                dma_chan.CTRL_TRIG.RING_SIZE = ring_size  # does not trigger, as the channel is disabled
+        self._adc_div = adc_div_for_sample_rate(sample_rate)
+
+    @property
+    def adc_samples(self) -> int:
+        return self._adc_samples
+
+    # Duration of filling one buffer in microseconds, i.e. how often a new average is available
+    @property
+    def capture_time_us(self) -> int:
+        cycles_per_sample = max(ADC_CONVERSION_CYCLES, 1 + self._adc_div / 256)
+        return int(self._adc_samples * cycles_per_sample * 1000000 // ADC_CLOCK_HZ)
+
+    # Start free-running capture. Blocks once until the first buffer is filled, so that there is always something to
+    # read afterwards.
+    def capture_start(self) -> None:
+        _drain_adc_fifo(self._adc)
+        second_chan = self._dma_chans[1]
+        # Enable second channel via non-triggering alias, it will be triggered by the first one
+        second_chan.AL1_CTRL_REG = second_chan.CTRL_TRIG_REG | 1
+        self._dma_chans[0].CTRL_TRIG.EN = 1  # triggers
+        self._adc.CS.AINSEL = self._adc_channel  # set again because read_u16() might have changed it
+        self._adc.CS.RROBIN = 0  # and Rp2040AdcDmaMultiChannel might have enabled round-robin
+        self._adc.DIV_REG = self._adc_div  # the ADC is shared, too
+        self._adc.CS.START_MANY = 1
+        while self._dma_chans[0].CTRL_TRIG.BUSY:
+            pass
+
+    def capture_stop(self) -> None:
+        for dma_chan in self._dma_chans:
+            dma_chan.AL1_CTRL_REG = dma_chan.CTRL_TRIG_REG & ~1
+        self._dma.CHAN_ABORT = self._dma_chan_mask
+        while self._dma.CHAN_ABORT:
+            pass
+        self._adc.CS.START_MANY = 0
+        _drain_adc_fifo(self._adc)
+
+    def deinit(self) -> None:
+        self.capture_stop()
+        for chan in self._dma_chan_indices:
+            rp_dma.release_channel(chan)
+
+    # Returns the average of the most recently completed buffer, i.e. the one whose channel is currently not busy.
+    # The next buffer might already be written while summing up – this only mixes in some newer samples.
+    def read_latest_average_u12(self) -> int:
+        if FAST_REGISTER_ACCESS:
+            latest = 0 if dma_busy(self._second_chan_addr) else 1
+        else:
+            latest = 0 if self._dma_chans[1].CTRL_TRIG.BUSY else 1
+        return sum(self._adc_buffs[latest]) // self._adc_samples
+
+
+# Streaming variant: A single DMA channel continuously writes raw samples into a ring buffer, using the DMA write
+# address ring feature. Consumers keep their own read cursor and get new samples as memoryviews into the ring – no
+# copying. Cursors count samples modulo STREAM_CURSOR_RANGE, so they stay small ints on MicroPython. The DMA transfer
+# count is exactly that range, so the cursor can be derived from the remaining transfer count and stays continuous when
+# the channel is re-triggered after finishing (which happens lazily in write_cursor()).
+STREAM_CURSOR_RANGE = 1 << 28
+STREAM_CURSOR_MASK = STREAM_CURSOR_RANGE - 1
+
+
+class Rp2040AdcDmaRing(ADC):
+    def __init__(self, gpio_pin=26, dma_chan=None, ring_samples=1024):
+        super().__init__(gpio_pin)  # initializes ADC and pin/pad
+        if ring_samples * 2 > 1 << 15:
+            raise ValueError('ring too large for DMA')
+        self._ring_samples = ring_samples
+        self._adc_channel = gpio_pin - 26
+
+        self._adc = devs.ADC_DEVICE
+        dma_chan = rp_dma.claim_channel(dma_chan)
+        self._dma_chan_index = dma_chan
+        self._dma_chan = devs.DMA_CHANS[dma_chan]
+
+        self._ring, self._ring_backing_buff = _aligned_sample_buffer(ring_samples)
+        self._ring_address = uctypes.addressof(self._ring)
+
+        _setup_adc_for_dma(self._adc, self._adc_channel)
+
+        self._dma_chan.READ_ADDR_REG = devs.ADC_FIFO_ADDR
+        self._dma_chan.CTRL_TRIG_REG = 0
+        self._dma_chan.CTRL_TRIG.CHAIN_TO = dma_chan  # no chaining
+        self._dma_chan.CTRL_TRIG.RING_SEL = 1  # wrap write address
+        self._dma_chan.CTRL_TRIG.RING_SIZE = _log2(ring_samples * 2)
+        self._dma_chan.CTRL_TRIG.INCR_WRITE = 1
+        self._dma_chan.CTRL_TRIG.IRQ_QUIET = 1
+        self._dma_chan.CTRL_TRIG.TREQ_SEL = devs.DREQ_ADC
+        self._dma_chan.CTRL_TRIG.DATA_SIZE = 1  # 16-bit
+
+    @property
+    def ring(self) -> memoryview:
+        return self._ring
+
+    @property
+    def ring_samples(self) -> int:
+        return self._ring_samples
+
+    @staticmethod
+    def cursor_diff(cursor, older_cursor) -> int:
+        return (cursor - older_cursor) & STREAM_CURSOR_MASK
+
+    def capture_start(self) -> None:
+        _drain_adc_fifo(self._adc)
+        self._dma_chan.WRITE_ADDR_REG = self._ring_address
+        self._dma_chan.TRANS_COUNT_REG = STREAM_CURSOR_RANGE
+        self._dma_chan.CTRL_TRIG.EN = 1
+        self._adc.CS.AINSEL = self._adc_channel  # set again because read_u16() might have changed it
+        self._adc.CS.RROBIN = 0  # and Rp2040AdcDmaMultiChannel might have enabled round-robin
+        self._adc.DIV_REG = 0  # and Rp2040AdcDmaAveraging might have slowed it down
+        self._adc.CS.START_MANY = 1
+
+    def capture_stop(self) -> None:
+        self._dma_chan.CTRL_TRIG.EN = 0
+        self._adc.CS.START_MANY = 0
+        _drain_adc_fifo(self._adc)
+
+    def deinit(self) -> None:
+        self.capture_stop()
+        rp_dma.release_channel(self._dma_chan_index)
+
+    # Returns the cursor of the next sample the DMA will write, i.e. all samples before it are valid
+    def write_cursor(self) -> int:
+        if not self._dma_chan.CTRL_TRIG.BUSY:
+            self._dma_chan.CTRL_TRIG.EN = 1  # re-trigger; transfer count is reloaded, write address keeps wrapping
+        return (STREAM_CURSOR_RANGE - self._dma_chan.TRANS_COUNT_REG) & STREAM_CURSOR_MASK
+
+    # Returns the samples written between read_cursor and write_cursor as two memoryviews into the ring (the second one
+    # is only non-empty if the range wraps around), plus the number of samples which have already been overwritten and
+    # are therefore lost. Consumers should continue with write_cursor as their next read_cursor.
+    # Note that the DMA keeps writing: Samples are only guaranteed to be intact if consumed before the ring wraps.
+    def read_views(self, read_cursor: int, write_cursor: int):
+        available = self.cursor_diff(write_cursor, read_cursor)
+        lost = 0
+        if available > self._ring_samples:
+            lost = available - self._ring_samples
+            available = self._ring_samples
+        start = (write_cursor - available) & (self._ring_samples - 1)
+        end = start + available
+        if end <= self._ring_samples:
+            return self._ring[start:end], self._ring[0:0], lost
+        return self._ring[start:], self._ring[:end - self._ring_samples], lost
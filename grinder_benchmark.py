@@ -0,0 +1,203 @@
+# On-device benchmarks for the per-sample hot code. Run from the REPL:
+#   import grinder_benchmark; grinder_benchmark.main()
+# Also runs on the host with CPython (python3 grinder_benchmark.py), which is only useful to compare relative costs.
+# The code emitter and register access variants (see grinder_fast) only differ on the device; on the host, just the
+# filter and debouncer variants run, with the same results for both.
+# Caution: On the device, the register access and button benchmarks take over the ADC, DMA and button IRQ – interrupt
+# main.py first, and reset afterwards.
+import array
+import sys
+import time
+
+from grinder_debouncer import GrinderDebouncer
+from grinder_filter import GrinderFilter, EmaFilter, MedianFilter
+
+if sys.implementation.name == 'micropython':
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+else:
+    # Always use the real clock on the host, also when the simulation's virtual clock is installed
+    def _ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def _ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+
+# Returns the average duration of one call of func(arg) for each of args in nanoseconds
+def time_per_call_ns(func, args) -> int:
+    start = _ticks_us()
+    for arg in args:
+        func(arg)
+    return _ticks_diff(_ticks_us(), start) * 1000 // len(args)
+
+
+def bench_filters(samples=1000) -> dict:
+    source = array.array('H', ((i * 7919) & 0xfff for i in range(samples)))
+    output = array.array('H', source)
+    filters = (('SMA 16', GrinderFilter(2000, 16)),
+               ('SMA 10', GrinderFilter(2000, 10)),
+               ('EMA 1/8', EmaFilter(2000, 3)),
+               ('Median 3', MedianFilter(2000, 3)),
+               ('Median 5', MedianFilter(2000, 5)))
+    results = {}
+    for name, v_filter in filters:
+        per_value = time_per_call_ns(v_filter.filter_value, source)
+        start = _ticks_us()
+        v_filter.filter_block(source, output)
+        per_block_sample = _ticks_diff(_ticks_us(), start) * 1000 // samples
+        results[name] = (per_value, per_block_sample)
+    return results
+
+
+# Bytecode references for the methods compiled with @micropython.native, same code without the decorator
+class _BytecodeFilter(GrinderFilter):
+    def filter_value(self, new_val: int) -> int:
+        index = self._filter_index
+        oldest = self._filter_buff[index]
+        self._filter_buff[index] = new_val
+        index += 1
+        self._filter_index = index if index < self._filter_size else 0
+        if self._filter_shift >= 0:
+            self._value_filtered += ((new_val - oldest) << 16) >> self._filter_shift
+        else:
+            self._value_filtered += ((new_val - oldest) << 16) // self._filter_size
+
+        return int(self._value_filtered >> 16)
+
+
+class _BytecodeDebouncer(GrinderDebouncer):
+    def debounce_button(self, pin_state: int) -> int:
+        if pin_state != self._prev_button_state:
+            self._prev_button_state = pin_state
+            self._button_change_time = time.ticks_ms()
+        elif pin_state != self._debounced_button_state:
+            time_passed = time.ticks_diff(time.ticks_ms(), self._button_change_time)
+            if time_passed > self._debounce_time_ms:
+                self._debounced_button_state = pin_state
+
+        return self._debounced_button_state
+
+
+# Per-call cost of the native methods and their bytecode references, in nanoseconds: name -> (native, bytecode)
+def bench_hot_methods(samples=1000) -> dict:
+    source = array.array('H', ((i * 7919) & 0xfff for i in range(samples)))
+    # Mostly stable with some bouncing, like the button pin
+    pin_states = array.array('B', (1 if i % 100 < 50 or i % 7 == 0 else 0 for i in range(samples)))
+    results = {
+        'filter_value SMA 16': (time_per_call_ns(GrinderFilter(2000, 16).filter_value, source),
+                                time_per_call_ns(_BytecodeFilter(2000, 16).filter_value, source)),
+        'filter_value SMA 10': (time_per_call_ns(GrinderFilter(2000, 10).filter_value, source),
+                                time_per_call_ns(_BytecodeFilter(2000, 10).filter_value, source)),
+    }
+    if hasattr(time, 'ticks_ms'):  # not on CPython without the simulation
+        results['debounce_button'] = (time_per_call_ns(GrinderDebouncer(0, 20).debounce_button, pin_states),
+                                      time_per_call_ns(_BytecodeDebouncer(0, 20).debounce_button, pin_states))
+    return results
+
+
+# Stand-ins for benchmarking the controller's own bookkeeping in run(), without hardware access and state logic
+class _NullHardware:
+    def read_voltage(self) -> int:
+        return 3456
+
+    def read_button_state(self) -> int:
+        return 0
+
+    def set_sampling_profile(self, profile) -> None:
+        pass
+
+    def set_jack_state(self, state) -> None:
+        pass
+
+    def set_motor_state(self, state) -> None:
+        pass
+
+    def set_low_power(self, enabled: bool) -> None:
+        pass
+
+
+class _NullState:
+    def run(self) -> None:
+        pass
+
+
+# Per-call cost of GrinderController.run() (native) around the hardware reads and state logic, in nanoseconds.
+# Device only: the controller needs the hardware modules.
+def bench_controller_run(runs=1000) -> int:
+    from grinder_controller import GrinderController
+    controller = GrinderController(_NullHardware())
+    controller._state = _NullState()
+    return time_per_call_ns(lambda _: controller.run(), range(runs))
+
+
+# Per-call cost of the register accesses in Rp2040AdcDmaAveraging via uctypes bitfields, machine.mem32 and grinder_fast
+# (viper), in nanoseconds. Device only.
+def bench_register_access(runs=1000) -> dict:
+    import machine
+    import grinder_fast
+    import rp_dma
+    import RP2040ADC
+    rp_dma.release_all()  # claims left behind by the interrupted main.py
+    adc = RP2040ADC.Rp2040AdcDmaAveraging(gpio_pin=29, adc_samples=16)
+    chan = adc._dma_chan
+    chan_addr = grinder_fast.dma_chan_addr(adc._dma_chan_index)
+    ctrl_addr = chan_addr + grinder_fast.DMA_CTRL_TRIG_OFFSET
+    results = {
+        'busy: uctypes': time_per_call_ns(lambda _: chan.CTRL_TRIG.BUSY, range(runs)),
+        'busy: mem32': time_per_call_ns(lambda _: machine.mem32[ctrl_addr] & grinder_fast.DMA_CTRL_BUSY, range(runs)),
+        'busy: viper': time_per_call_ns(lambda _: grinder_fast.dma_busy(chan_addr), range(runs)),
+    }
+
+    def capture(_):
+        adc.capture_start()
+        adc.wait_and_read_average_u12()
+    # Including the capture itself (16 samples at 500kS/s, i.e. 32us), so only the difference is meaningful
+    try:
+        for fast in (False, True):
+            RP2040ADC.FAST_REGISTER_ACCESS = fast
+            results['capture: ' + ('viper' if fast else 'uctypes')] = time_per_call_ns(capture, range(runs))
+    finally:
+        RP2040ADC.FAST_REGISTER_ACCESS = True
+        adc.deinit()
+    return results
+
+
+# Per-call cost of reading the debounced button state by polling the pin and via the edge IRQ (without edges), in
+# nanoseconds. Device only, takes over the button pin's IRQ.
+def bench_button(runs=1000) -> dict:
+    from machine import Pin
+    from grinder_debouncer import GrinderIrqDebouncer
+    from grinder_hardware import BUTTON_PIN, DEBOUNCE_TIME_MS
+    pin = Pin(BUTTON_PIN, Pin.IN, Pin.PULL_UP)
+    polled = GrinderDebouncer(1, DEBOUNCE_TIME_MS)
+    irq = GrinderIrqDebouncer(pin, DEBOUNCE_TIME_MS)
+    try:
+        return {
+            'button: polled': time_per_call_ns(lambda _: polled.debounce_button(pin.value()), range(runs)),
+            'button: IRQ': time_per_call_ns(lambda _: irq.debounced_state(), range(runs)),
+        }
+    finally:
+        irq.deinit()
+
+
+def main() -> None:
+    print('Filter           filter_value() [ns]   filter_block() [ns/sample]')
+    for name, (per_value, per_block_sample) in bench_filters().items():
+        print('{:16} {:>21} {:>28}'.format(name, per_value, per_block_sample))
+
+    print('Method                     native [ns]   bytecode [ns]')
+    for name, (native, bytecode) in bench_hot_methods().items():
+        print('{:24} {:>13} {:>15}'.format(name, native, bytecode))
+
+    if sys.implementation.name == 'micropython':
+        print('{:24} {:>13}'.format('GrinderController.run', bench_controller_run()))
+        print('Register access            per call [ns]')
+        for name, per_call in bench_register_access().items():
+            print('{:24} {:>15}'.format(name, per_call))
+        for name, per_call in bench_button().items():
+            print('{:24} {:>15}'.format(name, per_call))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import os
+import struct
+import time
+
+import grinder_log
+from grinder_recorder import STOP_DETECTED
+
+# File with the learned statistics, loaded at boot
+CALIB_FILE = 'calib.bin'
+# Sessions needed before the derived thresholds are used instead of the configured ones
+CALIB_MIN_SESSIONS = 3
+# Automatic grinding runs needed for a session to count; at most this many runs are evaluated per session, which
+# keeps the sums small ints
+CALIB_MIN_RUNS = 100
+CALIB_MAX_RUNS = 1 << 14
+# Weight of each new session in the running statistics: 1/2**CALIB_WEIGHT_SHIFT
+CALIB_WEIGHT_SHIFT = 2
+# Voltage differences between consecutive runs are clamped to this for the noise estimate
+CALIB_MAX_DIFF = 127
+# Time after a detected stop over which the peak voltage is taken for the rise, long enough for the voltage to settle
+CALIB_SETTLE_MS = 500
+# The stop threshold is above the loaded voltage by half of the typical rise, but at least this many standard
+# deviations of the noise
+CALIB_NOISE_SIGMAS = 4
+# Minimum distance between the thresholds for starting and stopping charging
+CHARGE_HYSTERESIS = 500
+
+# Statistics with 4 fractional bits: sessions, idle voltage, loaded voltage, rise at the stop, noise variance, and a
+# checksum over the bytes before it
+CALIB_MAGIC = b'GRC1'
+CALIB_FORMAT = '<4sHIIIIH'
+FRACTION_BITS = 4
+
+
+# Integer square root (Newton's method)
+def _isqrt(value: int) -> int:
+    if value <= 0:
+        return 0
+    x = value
+    y = (x + 1) >> 1
+    while y < x:
+        x = y
+        y = (x + value // x) >> 1
+    return x
+
+
+# Learns the electrical behaviour of this particular unit – battery, motor and beans – from automatic grind sessions
+# stopped by the stop detector, and derives thresholds from it (see below). Per session, on the control loop:
+# - idle voltage: when grinding begins, before the motor is started
+# - loaded voltage: mean while grinding automatically
+# - noise variance: from the differences between consecutive values, which ignores the slow battery discharge
+# - rise: peak voltage within CALIB_SETTLE_MS after the stop minus the loaded voltage, i.e. the load dropping. Not the
+#   voltage at the stop itself: where the detector fires depends on the thresholds derived from the rise, so the rise
+#   would follow them – on a slow rise, each session would stop earlier and learn a smaller rise than the last one.
+# Only O(1) integer work per run, no allocations; the statistics of a finished session are merged into running
+# averages over sessions (EMA, fixed point), and saved to CALIB_FILE from the idle state via save_if_dirty().
+# The controller calls on_transition() and add_voltage() like for GrinderRecorder.
+class GrinderCalibration:
+    def __init__(self, path=CALIB_FILE):
+        self._path = path
+        self._sessions = 0
+        self._idle = 0  # fixed point, FRACTION_BITS
+        self._loaded = 0
+        self._rise = 0
+        self._variance = 0
+        self._dirty = False
+        # Current session
+        self._grinding = False
+        self._session_idle = 0
+        self._runs = 0
+        self._sum = 0
+        self._diff_sq_sum = 0
+        self._previous = 0
+        self._settling = False
+        self._settle_start = 0
+        self._peak = 0
+        self.load()
+
+    @property
+    def sessions(self) -> int:
+        return self._sessions
+
+    @property
+    def valid(self) -> bool:
+        return self._sessions >= CALIB_MIN_SESSIONS
+
+    @property
+    def idle_voltage(self) -> int:
+        return self._idle >> FRACTION_BITS
+
+    @property
+    def loaded_voltage(self) -> int:
+        return self._loaded >> FRACTION_BITS
+
+    @property
+    def rise(self) -> int:
+        return self._rise >> FRACTION_BITS
+
+    # Standard deviation of the noise, fixed point with FRACTION_BITS // 2 fractional bits
+    @property
+    def noise_sigma_fixed(self) -> int:
+        return _isqrt(self._variance)
+
+    # Sum of the bytes before the checksum
+    @staticmethod
+    def _checksum(data) -> int:
+        return sum(data[:-2]) & 0xffff
+
+    def load(self) -> bool:
+        try:
+            with open(self._path, 'rb') as fh:
+                data = fh.read()
+        except OSError:  # none saved yet
+            return False
+        if len(data) != struct.calcsize(CALIB_FORMAT):
+            return False
+        magic, *fields, checksum = struct.unpack(CALIB_FORMAT, data)
+        if magic != CALIB_MAGIC or checksum != self._checksum(data):
+            return False
+        self._sessions, self._idle, self._loaded, self._rise, self._variance = fields
+        return True
+
+    # Saves the statistics if they changed, replacing the file atomically. Returns True if it did.
+    def save_if_dirty(self) -> bool:
+        if not self._dirty:
+            return False
+        data = bytearray(struct.calcsize(CALIB_FORMAT))
+        struct.pack_into(CALIB_FORMAT, data, 0, CALIB_MAGIC, self._sessions, self._idle, self._loaded, self._rise,
+                         self._variance, 0)
+        struct.pack_into('<H', data, len(data) - 2, self._checksum(data))
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'wb') as fh:
+            fh.write(data)
+        os.rename(temp_path, self._path)
+        self._dirty = False
+        return True
+
+    # Called by the controller on every state transition, see GrinderRecorder.on_transition()
+    def on_transition(self, event: int, arg: int, voltage: int) -> None:
+        if self._settling:  # grinding again before the voltage settled – take the peak so far
+            self._end_settling()
+        if event == grinder_log.EVENT_GRIND_BEGIN:
+            self._session_idle = voltage
+        elif event == grinder_log.EVENT_AUTOGRIND:
+            self._grinding = True
+            self._runs = 0
+            self._sum = 0
+            self._diff_sq_sum = 0
+            self._previous = voltage
+        elif self._grinding:
+            self._grinding = False
+            if event == grinder_log.EVENT_IDLE and arg == STOP_DETECTED and self._runs >= CALIB_MIN_RUNS:
+                self._settling = True
+                self._settle_start = time.ticks_ms()
+                self._peak = voltage
+
+    def _end_settling(self) -> None:
+        self._settling = False
+        self._add_session(self._peak)
+
+    # Called by the controller on every run
+    def add_voltage(self, voltage: int) -> None:
+        if self._settling:
+            if voltage > self._peak:
+                self._peak = voltage
+            if time.ticks_diff(time.ticks_ms(), self._settle_start) >= CALIB_SETTLE_MS:
+                self._end_settling()
+            return
+        if not self._grinding or self._runs == CALIB_MAX_RUNS:
+            return
+        diff = voltage - self._previous
+        if diff > CALIB_MAX_DIFF:
+            diff = CALIB_MAX_DIFF
+        elif diff < -CALIB_MAX_DIFF:
+            diff = -CALIB_MAX_DIFF
+        self._previous = voltage
+        self._diff_sq_sum += diff * diff
+        self._sum += voltage
+        self._runs += 1
+
+    def _add_session(self, peak_voltage: int) -> None:
+        loaded = (self._sum << FRACTION_BITS) // self._runs
+        # The differences of independent noise have twice its variance
+        variance = (self._diff_sq_sum << FRACTION_BITS) // (2 * (self._runs - 1))
+        values = (self._session_idle << FRACTION_BITS, loaded, max((peak_voltage << FRACTION_BITS) - loaded, 0),
+                  variance)
+        if self._sessions == 0:
+            self._idle, self._loaded, self._rise, self._variance = values
+        else:
+            self._idle += (values[0] - self._idle) >> CALIB_WEIGHT_SHIFT
+            self._loaded += (values[1] - self._loaded) >> CALIB_WEIGHT_SHIFT
+            self._rise += (values[2] - self._rise) >> CALIB_WEIGHT_SHIFT
+            self._variance += (values[3] - self._variance) >> CALIB_WEIGHT_SHIFT
+        if self._sessions < 0xffff:
+            self._sessions += 1
+        self._dirty = True
+
+    # Voltage above the loaded voltage at which grinding should stop: half of the typical rise, but clear of the noise.
+    # None if not enough sessions were seen, or the rise cannot be told apart from the noise.
+    def stop_margin(self):
+        if not self.valid:
+            return None
+        sigma = self.noise_sigma_fixed >> (FRACTION_BITS // 2)
+        margin = max(self.rise // 2, CALIB_NOISE_SIGMAS * sigma, 1)
+        if margin > self.rise * 3 // 4:
+            return None
+        return margin
+
+    # Stop voltage factor for ThresholdStopDetector as permille of the start voltage
+    def stop_factor_permille(self, default: int) -> int:
+        margin = self.stop_margin()
+        if margin is None or self.loaded_voltage <= 0:
+            return default
+        return 1000 * (self.loaded_voltage + margin) // self.loaded_voltage
+
+    # Drift for CusumStopDetector: the deviation from the baseline that is just noise. Not the stop margin – the
+    # baseline follows a slow rise with some lag, which a drift of half the rise might never be exceeded by.
+    def cusum_drift(self, default: int) -> int:
+        if self.stop_margin() is None:
+            return default
+        return max(CALIB_NOISE_SIGMAS * (self.noise_sigma_fixed >> (FRACTION_BITS // 2)), 1)
+
+    # (start, stop) charging thresholds: Charging starts early enough that the voltage under load – lower than the idle
+    # voltage by the typical sag – does not fall below the configured low threshold while grinding. The stop threshold
+    # is deliberately kept: the sessions only see the battery discharging, so nothing learned tells when it is full,
+    # and raising it could overcharge the battery.
+    def charge_thresholds(self, default_low: int, default_high: int) -> tuple:
+        if not self.valid:
+            return default_low, default_high
+        sag = max(self.idle_voltage - self.loaded_voltage, 0)
+        low = min(default_low + sag, default_high - CHARGE_HYSTERESIS)
+        return max(low, default_low), default_high
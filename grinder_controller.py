@@ -1,8 +1,23 @@
 import grinder_controller_states as states
+import grinder_log
+from grinder_calibration import GrinderCalibration
+from grinder_fast import micropython
 from grinder_hardware import GrinderHardware
+from grinder_memory import GrinderGc
+from grinder_profiler import GrinderProfiler, STAGE_ADC, STAGE_BUTTON, STAGE_LOG, STAGE_STATE, STAGE_TRANSITION
+from grinder_recorder import GrinderRecorder
+from grinder_scheduler import GrinderScheduler
 import time
 
+# With profiling enabled, check the serial console for profiler commands every this many runs
+PROFILER_POLL_RUNS = 100
+# Number of runs after which the status is logged
+STATUS_LOG_RUNS = 1000
 
+
+# All states are allocated once on construction and re-entered via enter_state() – together with the deferred logging
+# this keeps the control loop free of heap allocations, so garbage collection can be limited to the idle and charging
+# states (see GrinderGc).
 class GrinderController:
 
     @staticmethod
@@ -10,37 +25,140 @@ class GrinderController:
         if __debug__:
             print('{} – {}'.format(time.ticks_us(), s))
 
-    def __init__(self, hw: GrinderHardware):
+    # Deferred logging for the control loop, see GrinderLog. Event ids and their formats are defined in grinder_log.
+    @staticmethod
+    def log_event(event: int, arg1=0, arg2=0, arg3=0) -> None:
+        grinder_log.LOG.log_event(event, arg1, arg2, arg3)
+
+    # scheduler: The one running the loop, if any – resynchronized after sleeping in low-power idle
+    # recorder: Records grind sessions to flash, if given
+    # calibration: Learns the stop and charging thresholds from the grind sessions, if given; applied right away
+    def __init__(self, hw: GrinderHardware, profiler: GrinderProfiler = None, scheduler: GrinderScheduler = None,
+                 recorder: GrinderRecorder = None, calibration: GrinderCalibration = None):
         self._hw = hw
+        self._profiler = profiler
+        self._scheduler = scheduler
+        self._recorder = recorder
+        self._calibration = calibration
+        if calibration is not None:
+            hw.apply_calibration(calibration)
         self._voltage = 0
         self._button_state = GrinderHardware.ButtonState.RELEASED
-        self._state = states.IdleState()  # init only
+        self._gc = GrinderGc()
+        self._idle_state = states.IdleState()
+        self._grind_begin_state = states.GrindBeginState()
+        self._auto_grind_state = states.AutoGrindState()
+        self._manual_grind_state = states.ManualGrindState()
+        self._charging_state = states.ChargingState()
+        self._state = self._idle_state  # init only
         self.state = self._state  # call setter
         self._run_count = 0
         self._last_run_time = time.ticks_us()
 
     @property
-    def state(self) -> states.State:
+    def state(self) -> 'states.State':
         return self._state
 
     @state.setter
-    def state(self, state: states.State):
+    def state(self, state: 'states.State'):
+        self.enter_state(state)
+
+    # Changes to the given state, passing arg to its on_enter()
+    def enter_state(self, state: 'states.State', arg=0) -> None:
+        profiler = self._profiler
+        if profiler is not None:
+            start = profiler.nested_start()
         self._state = state
         self._state.context = self
-        self._state.on_enter()
+        self._hw.set_sampling_profile(state.sampling_profile)
+        if self._recorder is not None:
+            self._recorder.on_transition(state.event, arg, self._voltage)
+        if self._calibration is not None:
+            self._calibration.on_transition(state.event, arg, self._voltage)
+        self._state.on_enter(arg)
+        if profiler is not None:
+            profiler.nested_end(STAGE_TRANSITION, start)
+
+    @property
+    def idle_state(self) -> 'states.IdleState':
+        return self._idle_state
+
+    @property
+    def grind_begin_state(self) -> 'states.GrindBeginState':
+        return self._grind_begin_state
+
+    @property
+    def auto_grind_state(self) -> 'states.AutoGrindState':
+        return self._auto_grind_state
+
+    @property
+    def manual_grind_state(self) -> 'states.ManualGrindState':
+        return self._manual_grind_state
 
+    @property
+    def charging_state(self) -> 'states.ChargingState':
+        return self._charging_state
+
+    @property
+    def gc(self) -> GrinderGc:
+        return self._gc
+
+    @property
+    def profiler(self) -> GrinderProfiler:
+        return self._profiler
+
+    @micropython.native  # the loop's own bookkeeping, see grinder_benchmark.py
     def run(self):
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.start()
         self._run_count += 1
         # Always read HW values to allow filtering/debouncing to work better
         self._voltage = self._hw.read_voltage()
+        if self._recorder is not None:
+            self._recorder.add_voltage(self._voltage)
+        if self._calibration is not None:
+            self._calibration.add_voltage(self._voltage)
+        if profiler is not None:
+            profiler.lap(STAGE_ADC)
         self._button_state = self._hw.read_button_state()
-        if self._run_count % 1000 == 0:
+        if profiler is not None:
+            profiler.lap(STAGE_BUTTON)
+        # Wraps around instead of growing into a long int, which would allocate
+        if self._run_count == STATUS_LOG_RUNS:
+            self._run_count = 0
             current_time = time.ticks_us()
             time_passed = time.ticks_diff(current_time, self._last_run_time)
             self._last_run_time = current_time
-            self.log("Battery voltage: {}; Button state: {}; Time for 1000 runs: {}us".format(
-                self._voltage, self._button_state, time_passed))
+            self.log_event(grinder_log.EVENT_STATUS, self._voltage, self._button_state, time_passed)
+        if profiler is not None:
+            profiler.lap(STAGE_LOG)
         self._state.run()
+        if profiler is not None:
+            profiler.lap(STAGE_STATE)
+            if self._run_count % PROFILER_POLL_RUNS == 0:
+                profiler.poll_serial()
+
+    @property
+    def recorder(self) -> GrinderRecorder:
+        return self._recorder
+
+    @property
+    def calibration(self) -> GrinderCalibration:
+        return self._calibration
+
+    # Writes a chunk of the recorded sessions and updated calibration to flash, if any, and applies the updated
+    # calibration – only to be called from states with time to spare
+    def flush_storage(self) -> None:
+        if self._recorder is not None:
+            self._recorder.flush_one()
+        if self._calibration is not None and self._calibration.save_if_dirty():
+            self._hw.apply_calibration(self._calibration)
+
+    # Sleeps until the next run in low-power idle, see GrinderHardware.idle_sleep()
+    def idle_sleep(self) -> None:
+        if self._hw.idle_sleep() and self._scheduler is not None:
+            self._scheduler.resync()
 
     @property
     def button_pressed(self):
@@ -0,0 +1,147 @@
+try:
+    import uasyncio as asyncio
+except ImportError:  # CPython
+    import asyncio
+
+import grinder_hardware as hardware
+import grinder_log
+from grinder_controller import GrinderController
+from grinder_hardware import GrinderHardware, IDLE_SLEEP_MS
+from grinder_calibration import GrinderCalibration
+from grinder_profiler import GrinderProfiler, STAGE_BUTTON, STAGE_STATE
+from grinder_recorder import GrinderRecorder
+
+BUTTON_POLL_MS = 2
+TELEMETRY_INTERVAL_MS = 2000
+PROFILER_POLL_MS = 100
+LOG_FLUSH_MS = 20
+
+
+async def _sleep_ms(ms: int) -> None:
+    if hasattr(asyncio, 'sleep_ms'):
+        await asyncio.sleep_ms(ms)
+    else:
+        await asyncio.sleep(ms / 1000)
+
+
+# Hardware access for AsyncGrinderController: Waiting for an ADC capture yields to other tasks instead of busy waiting.
+class AsyncGrinderHardware(GrinderHardware):
+    # Time in ms until the free-running capture (or core 1) has a new value, at least the 1ms resolution of the
+    # uasyncio timers
+    def _value_period_ms(self) -> int:
+        period_us = hardware.CORE1_PERIOD_US if self._core1 is not None else self._avg_adc.capture_time_us
+        return max(1, (period_us + 999) // 1000)
+
+    async def read_voltage_async(self) -> int:
+        if self._low_power:
+            # Single captures in low-power idle are short enough to just wait for them
+            await _sleep_ms(0)
+            return self.read_voltage()
+        if self._core1 is not None or hardware.ADC_CONTINUOUS_CAPTURE:
+            # Free-running capture (or core 1) never has to wait, but only has a new value once per period
+            await _sleep_ms(self._value_period_ms())
+            return self.read_voltage()
+
+        while self._avg_adc.capture_busy():
+            await _sleep_ms(0)
+        if self._low_power:  # entered while waiting, which ended the capture
+            return self.read_voltage()
+        value = self._avg_adc.read_average_u12()
+        self._avg_adc.capture_start()
+        return self._filter_voltage(value)
+
+    # lightsleep() would stop all tasks – only tells whether to sleep, AsyncGrinderController does it asynchronously
+    def idle_sleep(self) -> bool:
+        return self._low_power and self._button.value() != 0
+
+
+# Cooperative variant of GrinderController: Instead of reading all inputs, running the state machine and logging in one
+# monolithic run(), each of these is a separate task. The state machine runs whenever a new voltage value is available.
+# Additional features (e.g. serial command handling) can be added as further tasks via add_task().
+# In low-power idle, the ADC task sleeps for IDLE_SLEEP_MS between captures instead of the whole loop in lightsleep(),
+# so the other tasks keep running; it wakes up early when the button task sees the button pressed.
+# With a profiler, the button read, state run and transitions are timed; waiting for ADC values yields to the other
+# tasks, so there is no ADC stage.
+class AsyncGrinderController(GrinderController):
+    def __init__(self, hw: AsyncGrinderHardware, profiler: GrinderProfiler = None, recorder: GrinderRecorder = None,
+                 calibration: GrinderCalibration = None):
+        super().__init__(hw, profiler, recorder=recorder, calibration=calibration)
+        self._voltage_event = asyncio.Event()
+        self._sleep_requested = False
+        self._extra_tasks = []
+
+    def add_task(self, coro) -> None:
+        self._extra_tasks.append(coro)
+
+    # Called by the idle states, see GrinderController.idle_sleep()
+    def idle_sleep(self) -> None:
+        self._sleep_requested = self._hw.idle_sleep()
+
+    async def _adc_task(self) -> None:
+        while True:
+            self._voltage = await self._hw.read_voltage_async()
+            if self._recorder is not None:
+                self._recorder.add_voltage(self._voltage)
+            if self._calibration is not None:
+                self._calibration.add_voltage(self._voltage)
+            self._voltage_event.set()
+            if self._hw.low_power:
+                await _sleep_ms(0)  # lets the state machine run on the value, which might request sleeping
+                if self._sleep_requested:
+                    self._sleep_requested = False
+                    await self._idle_sleep()
+
+    async def _idle_sleep(self) -> None:
+        for _ in range(IDLE_SLEEP_MS // BUTTON_POLL_MS):
+            await _sleep_ms(BUTTON_POLL_MS)
+            if self._button_state != GrinderHardware.ButtonState.RELEASED:
+                return
+
+    async def _button_task(self) -> None:
+        profiler = self._profiler
+        while True:
+            if profiler is not None:
+                profiler.start()
+            self._button_state = self._hw.read_button_state()
+            if profiler is not None:
+                profiler.lap(STAGE_BUTTON)
+            await _sleep_ms(BUTTON_POLL_MS)
+
+    async def _state_task(self) -> None:
+        while True:
+            await self._voltage_event.wait()
+            self._voltage_event.clear()
+            self._run_count += 1
+            if self._profiler is not None:
+                self._profiler.start()
+            self._state.run()
+            if self._profiler is not None:
+                self._profiler.lap(STAGE_STATE)
+
+    async def _telemetry_task(self) -> None:
+        while True:
+            await _sleep_ms(TELEMETRY_INTERVAL_MS)
+            self.log_event(grinder_log.EVENT_STATUS_ASYNC, self._voltage, self._button_state, self._run_count)
+            self._run_count = 0
+
+    # Writes one log record at a time, so other tasks can run in between
+    async def _log_task(self) -> None:
+        while True:
+            await _sleep_ms(LOG_FLUSH_MS)
+            while grinder_log.LOG.flush_one():
+                await _sleep_ms(0)
+
+    async def _profiler_task(self) -> None:
+        while True:
+            await _sleep_ms(PROFILER_POLL_MS)
+            self._profiler.poll_serial()
+
+    async def _main(self) -> None:
+        tasks = [self._adc_task(), self._button_task(), self._state_task(), self._telemetry_task(), self._log_task()]
+        if self._profiler is not None:
+            tasks.append(self._profiler_task())
+        tasks.extend(self._extra_tasks)
+        await asyncio.gather(*tasks)
+
+    def run_forever(self) -> None:
+        asyncio.run(self._main())
@@ -2,19 +2,28 @@
 import time
 
 import grinder_controller as ctrl
-from grinder_hardware import GrinderHardware, AUTOGRIND_TIMEOUT_MS, AUTOGRIND_SAFETY_STOP_MS
+import grinder_log
+from grinder_recorder import STOP_DETECTED, STOP_MANUAL, STOP_TIMEOUT
+from grinder_hardware import GrinderHardware, AUTOGRIND_TIMEOUT_MS, AUTOGRIND_SAFETY_STOP_MS, SAMPLING_PROFILE_COARSE, \
+    SAMPLING_PROFILE_DENSE
 
 
 # Should be an ABC
+# States are singletons owned by the controller (see GrinderController), so they must not rely on __init__() for
+# per-visit initialization – everything is reset in on_enter(), which gets an optional argument from the previous state.
+# Each state declares how the voltage is to be sampled while it is active (see GrinderHardware.set_sampling_profile()),
+# and the grinder_log event id identifying it in logs and session records.
 class State:
     _context = None
+    sampling_profile = SAMPLING_PROFILE_COARSE
+    event = 0
 
     @property
-    def context(self) -> ctrl.GrinderController:
+    def context(self) -> 'ctrl.GrinderController':
         return self._context
 
     @context.setter
-    def context(self, c: ctrl.GrinderController):
+    def context(self, c: 'ctrl.GrinderController'):
         self._context = c
 
     # Should be an @abstractmethod
@@ -22,79 +31,101 @@ class State:
         pass
 
     # Should be an @abstractmethod
-    def on_enter(self) -> None:
+    def on_enter(self, arg=0) -> None:
         pass
 
 
 class IdleState(State):
+    event = grinder_log.EVENT_IDLE
+
     def run(self):
         if self._context.button_pressed:
-            self._context.state = GrindBeginState()
-        elif GrinderHardware.should_start_charging(self._context.voltage):
-            self._context.state = ChargingState()
+            self._context.state = self._context.grind_begin_state
+        elif self._context.hw.should_start_charging(self._context.voltage):
+            self._context.state = self._context.charging_state
+        else:
+            self._context.gc.collect_if_due()
+            self._context.flush_storage()
+            self._context.idle_sleep()
 
-    def on_enter(self):
-        ctrl.GrinderController.log("Entering idle state")
+    # stop_reason: Why grinding was stopped (see grinder_recorder), if it was
+    def on_enter(self, stop_reason=0):
+        ctrl.GrinderController.log_event(grinder_log.EVENT_IDLE)
         self._context.hw.set_jack_state(GrinderHardware.JackState.DISABLED)
         self._context.hw.set_motor_state(GrinderHardware.MotorState.STOPPED)
+        self._context.hw.set_low_power(True)
 
 
 class GrindBeginState(State):
     _grind_start_time = 0
+    event = grinder_log.EVENT_GRIND_BEGIN
+    sampling_profile = SAMPLING_PROFILE_DENSE  # for the start voltage of automatic grinding
 
     def run(self):
         time_passed = time.ticks_diff(time.ticks_ms(), self._grind_start_time)
         if time_passed < AUTOGRIND_TIMEOUT_MS and not self._context.button_pressed:
-            self._context.state = AutoGrindState(self._grind_start_time)
+            self._context.enter_state(self._context.auto_grind_state, self._grind_start_time)
         elif time_passed >= AUTOGRIND_TIMEOUT_MS:
-            self._context.state = ManualGrindState()
+            self._context.state = self._context.manual_grind_state
 
-    def on_enter(self):
-        ctrl.GrinderController.log("Entering grind begin state")
+    def on_enter(self, arg=0):
+        ctrl.GrinderController.log_event(grinder_log.EVENT_GRIND_BEGIN)
         self._grind_start_time = time.ticks_ms()
+        self._context.hw.set_low_power(False)  # full rate while grinding
         self._context.hw.set_jack_state(GrinderHardware.JackState.DISABLED)
         self._context.hw.set_motor_state(GrinderHardware.MotorState.RUNNING)
 
 
 class AutoGrindState(State):
-    _grind_start_time = None
-    _autogrind_start_voltage = None
-
-    def __init__(self, start_time):
-        self._grind_start_time = start_time
+    _grind_start_time = 0
+    _autogrind_start_voltage = 0
+    sampling_profile = SAMPLING_PROFILE_DENSE
+    event = grinder_log.EVENT_AUTOGRIND
 
     def run(self):
         if self._context.button_pressed:
-            self._context.state = ManualGrindState()
-        elif GrinderHardware.should_stop_grinding(self._context.voltage, self._autogrind_start_voltage):
-            self._context.state = IdleState()
+            self._context.state = self._context.manual_grind_state
+        elif self._context.hw.stop_detector.update(self._context.voltage):
+            self._context.enter_state(self._context.idle_state, STOP_DETECTED)
         else:
             time_passed = time.ticks_diff(time.ticks_ms(), self._grind_start_time)
             if time_passed > AUTOGRIND_SAFETY_STOP_MS:
-                self._context.state = IdleState()
+                self._context.enter_state(self._context.idle_state, STOP_TIMEOUT)
 
-    def on_enter(self):
+    # start_time: Time at which the motor was started [ms]
+    def on_enter(self, start_time=0):
+        self._grind_start_time = start_time
         self._autogrind_start_voltage = self._context.voltage
-        ctrl.GrinderController.log("Entering automatic grinding state; Vstart={}".format(self._autogrind_start_voltage))
+        self._context.hw.stop_detector.reset(self._autogrind_start_voltage)
+        ctrl.GrinderController.log_event(grinder_log.EVENT_AUTOGRIND, self._autogrind_start_voltage)
 
 
 class ManualGrindState(State):
+    event = grinder_log.EVENT_MANUAL_GRIND
+
     def run(self):
         if not self._context.button_pressed:
-            self._context.state = IdleState()
+            self._context.enter_state(self._context.idle_state, STOP_MANUAL)
 
-    def on_enter(self):
-        ctrl.GrinderController.log("Entering manual grinding state")
+    def on_enter(self, arg=0):
+        ctrl.GrinderController.log_event(grinder_log.EVENT_MANUAL_GRIND)
 
 
 class ChargingState(State):
+    event = grinder_log.EVENT_CHARGING
+
     def run(self):
         if self._context.button_pressed:
-            self._context.state = GrindBeginState()
+            self._context.state = self._context.grind_begin_state
         elif self._context.hw.should_stop_charging(self._context.voltage):
-            self._context.state = IdleState()
+            self._context.state = self._context.idle_state
+        else:
+            self._context.gc.collect_if_due()
+            self._context.flush_storage()
+            self._context.idle_sleep()
 
-    def on_enter(self):
-        ctrl.GrinderController.log("Entering charging state")
+    def on_enter(self, arg=0):
+        ctrl.GrinderController.log_event(grinder_log.EVENT_CHARGING)
         self._context.hw.set_motor_state(GrinderHardware.MotorState.STOPPED)
         self._context.hw.set_jack_state(GrinderHardware.JackState.ENABLED)
+        self._context.hw.set_low_power(True)
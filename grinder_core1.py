@@ -0,0 +1,152 @@
+import array
+
+import _thread
+
+from grinder_detector import StopDetector
+from grinder_scheduler import GrinderScheduler
+
+# Sequence numbers wrap around before becoming long ints; 2**30 is even, so odd/even is kept across the wrap
+_SEQ_MASK = 0x3fffffff
+
+# Indices into the words of VoltageSlot
+SLOT_VOLTAGE = 1
+SLOT_GENERATION = 2
+SLOT_STOPPED = 3
+SLOT_WORDS = 4
+
+
+# Lock-free single-writer slot (a seqlock) for passing the acquisition results from core 1 to core 0.
+# The writer makes the sequence number odd while updating the values and even again afterwards; readers retry until they
+# saw the same even sequence number before and after copying the values, so they always get a consistent snapshot
+# without ever blocking the writer. Word 0 is the sequence number.
+class VoltageSlot:
+    def __init__(self):
+        self._data = array.array('l', (0 for _ in range(SLOT_WORDS)))
+
+    def publish(self, voltage: int, generation: int, stopped: int) -> None:
+        data = self._data
+        data[0] = (data[0] + 1) & _SEQ_MASK
+        data[SLOT_VOLTAGE] = voltage
+        data[SLOT_GENERATION] = generation
+        data[SLOT_STOPPED] = stopped
+        data[0] = (data[0] + 1) & _SEQ_MASK
+
+    # Copies a consistent snapshot of the slot into out (at least SLOT_WORDS long)
+    def read(self, out) -> None:
+        data = self._data
+        while True:
+            seq = data[0]
+            if seq & 1:
+                continue
+            for i in range(1, SLOT_WORDS):
+                out[i] = data[i]
+            if data[0] == seq:
+                out[0] = seq
+                return
+
+    # A single word is always consistent on its own
+    @property
+    def voltage(self) -> int:
+        return self._data[SLOT_VOLTAGE]
+
+
+# Proxy for the stop detector running on core 1 – to be used by the state machine on core 0 like a local detector.
+# reset() is forwarded to core 1 as a request with a new generation number; update() ignores the given value (core 1
+# feeds the detector itself) and reports a stop only once core 1 has processed the current generation.
+class Core1StopDetector(StopDetector):
+    def __init__(self, acquisition: 'Core1Acquisition'):
+        self._acquisition = acquisition
+        self._snapshot = array.array('l', (0 for _ in range(SLOT_WORDS)))
+
+    def reset(self, start_value: int) -> None:
+        self._acquisition.request_reset(start_value)
+
+    def update(self, value: int) -> bool:
+        acquisition = self._acquisition
+        acquisition.slot.read(self._snapshot)
+        return self._snapshot[SLOT_GENERATION] == acquisition.generation and self._snapshot[SLOT_STOPPED] != 0
+
+
+# Runs ADC acquisition, filtering and stop detection on the RP2040's second core, while core 0 only runs the state
+# machine and I/O. All objects handed over are owned by core 1 once start() has been called.
+# Core 1 runs at a fixed period (like the main loop, so detector parameters tuned per value keep their meaning) and
+# publishes the latest voltage and detector result through a VoltageSlot. Requests from core 0 (detector resets) are
+# passed the other way in two words: The start value is written before the generation number, which core 1 polls.
+# The core 1 loop does not allocate, so it never triggers garbage collection.
+class Core1Acquisition:
+    def __init__(self, adc, voltage_filter, detector: StopDetector, period_us: int):
+        self._adc = adc
+        self._filter = voltage_filter
+        self._detector = detector
+        self._scheduler = GrinderScheduler(period_us)
+        self._slot = VoltageSlot()
+        self._stop_detector = Core1StopDetector(self)
+        self._request = array.array('l', (0, 0))  # generation, start value; written by core 0 only
+        self._generation = 0  # last generation handled by core 1
+        self._stopped = 0
+        self._running = False
+        self._finished = True
+        self._step_bound = self.step  # bound methods are allocated on each access on MicroPython
+        # Start first ADC DMA capture, so that the first step() will have something to read
+        self._adc.capture_start()
+
+    @property
+    def slot(self) -> VoltageSlot:
+        return self._slot
+
+    @property
+    def voltage(self) -> int:
+        return self._slot.voltage
+
+    @property
+    def stop_detector(self) -> Core1StopDetector:
+        return self._stop_detector
+
+    @property
+    def scheduler(self) -> GrinderScheduler:
+        return self._scheduler
+
+    # Generation of the latest reset request from core 0
+    @property
+    def generation(self) -> int:
+        return self._request[0]
+
+    # Core 0 only
+    def request_reset(self, start_value: int) -> None:
+        self._request[1] = start_value
+        self._request[0] = (self._request[0] + 1) & _SEQ_MASK
+
+    # One acquisition cycle; called by the core 1 loop, or directly for testing
+    def step(self) -> None:
+        value = self._adc.wait_and_read_average_u12()
+        self._adc.capture_start()
+        if self._filter is not None:
+            value = self._filter.filter_value(value)
+
+        generation = self._request[0]
+        if generation != self._generation:
+            self._detector.reset(self._request[1])
+            self._generation = generation
+            self._stopped = 0
+        if not self._stopped and self._detector.update(value):
+            self._stopped = 1
+        self._slot.publish(value, generation, self._stopped)
+
+    def _core1_main(self) -> None:
+        try:
+            while self._running:
+                self._scheduler.run_once(self._step_bound)
+        finally:
+            self._finished = True
+
+    def start(self) -> None:
+        self.step()  # so that core 0 has a value right away
+        self._running = True
+        self._finished = False
+        _thread.start_new_thread(self._core1_main, ())
+
+    # Stops the core 1 loop and waits for it to finish
+    def stop(self) -> None:
+        self._running = False
+        while not self._finished:
+            pass
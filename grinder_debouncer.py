@@ -1,5 +1,8 @@
+import array
 import time
 
+from grinder_fast import micropython
+
 
 class GrinderDebouncer:
     def __init__(self, initial_value: int, debounce_time_ms: int):
@@ -8,6 +11,7 @@ class GrinderDebouncer:
         self._debounced_button_state = initial_value
         self._debounce_time_ms = debounce_time_ms
 
+    @micropython.native  # called every loop iteration
     def debounce_button(self, pin_state: int) -> int:
         if pin_state != self._prev_button_state:
             self._prev_button_state = pin_state
@@ -18,3 +22,75 @@ class GrinderDebouncer:
                 self._debounced_button_state = pin_state
 
         return self._debounced_button_state
+
+
+# Number of button edges buffered between two reads, see GrinderIrqDebouncer
+EDGE_QUEUE_SIZE = 16
+EDGE_COUNT_MASK = (1 << 30) - 1
+
+
+# Interrupt-driven variant of the above: A pin IRQ on both edges records each edge's time and the pin level afterwards
+# into a preallocated ring, so nothing is allocated in the (hard) IRQ handler. Reading the debounced state evaluates
+# the edges since the last read – the state changes once the pin has been stable for the debounce time after the last
+# edge, as in GrinderDebouncer. Without edges, that is just returning the state: no pin read and no ticks_ms() per
+# call, which is needed only while an edge has not settled yet. And as the timestamps are taken on the edges, debouncing
+# starts right away instead of at the next (polling) call, so the latency does not depend on the loop period.
+# If more than EDGE_QUEUE_SIZE edges happen between two reads, the oldest ones are dropped (see lost_edges) – the last
+# one still decides. The pin's IRQ is taken over, its handler also ends lightsleep().
+class GrinderIrqDebouncer:
+    def __init__(self, pin, debounce_time_ms: int, queue_size=EDGE_QUEUE_SIZE):
+        if queue_size & (queue_size - 1):
+            raise ValueError('queue size must be a power of two')
+        self._pin = pin
+        self._debounce_time_ms = debounce_time_ms
+        self._edge_times = array.array('l', (0 for _ in range(queue_size)))
+        self._edge_levels = bytearray(queue_size)
+        self._queue_mask = queue_size - 1
+        # Edge counters, wrapping around to stay small ints
+        self._write_count = 0
+        self._read_count = 0
+        self._lost_edges = 0
+        self._level = pin.value()
+        self._change_time = time.ticks_ms()
+        self._debounced_button_state = self._level
+        self._on_edge_ref = self._on_edge  # bound once, so the IRQ does not allocate it
+        pin.irq(self._on_edge_ref, pin.IRQ_FALLING | pin.IRQ_RISING, hard=True)
+
+    def deinit(self) -> None:
+        self._pin.irq(None)
+
+    def _on_edge(self, pin) -> None:
+        index = self._write_count & self._queue_mask
+        self._edge_times[index] = time.ticks_ms()
+        self._edge_levels[index] = pin.value()
+        self._write_count = (self._write_count + 1) & EDGE_COUNT_MASK
+
+    @property
+    def lost_edges(self) -> int:
+        return self._lost_edges
+
+    # Level of the pin after the last edge, i.e. not debounced
+    @property
+    def level(self) -> int:
+        write_count = self._write_count
+        if write_count == self._read_count:
+            return self._level
+        return self._edge_levels[(write_count - 1) & self._queue_mask]
+
+    @micropython.native  # called every loop iteration
+    def debounced_state(self) -> int:
+        write_count = self._write_count  # the IRQ may add further edges meanwhile – they are read next time
+        pending = (write_count - self._read_count) & EDGE_COUNT_MASK
+        if pending:
+            if pending > self._queue_mask + 1:
+                self._lost_edges += pending - self._queue_mask - 1
+                self._read_count = (write_count - self._queue_mask - 1) & EDGE_COUNT_MASK
+            index = (write_count - 1) & self._queue_mask
+            self._level = self._edge_levels[index]
+            self._change_time = self._edge_times[index]  # every edge restarts the debounce time
+            self._read_count = write_count
+        if self._level != self._debounced_button_state:
+            if time.ticks_diff(time.ticks_ms(), self._change_time) > self._debounce_time_ms:
+                self._debounced_button_state = self._level
+
+        return self._debounced_button_state
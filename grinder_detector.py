@@ -0,0 +1,70 @@
+# Detectors deciding when to stop automatic grinding, based on the stream of voltage values.
+# All detectors are integer only and do O(1) work per value, so they can run on every control loop iteration.
+
+
+# Should be an ABC
+class StopDetector:
+    # Should be an @abstractmethod
+    # Called when automatic grinding starts, with the voltage at that time
+    def reset(self, start_value: int) -> None:
+        pass
+
+    # Should be an @abstractmethod
+    # Called with each new voltage value, returns True once grinding should be stopped
+    def update(self, value: int) -> bool:
+        return False
+
+
+# Stops as soon as the voltage has risen by a fixed factor relative to the start voltage – the original approach.
+# The factor is given as fraction to avoid floating point arithmetic.
+class ThresholdStopDetector(StopDetector):
+    def __init__(self, factor_num: int, factor_den: int):
+        self._factor_num = factor_num
+        self._factor_den = factor_den
+        self._threshold = 0
+
+    def reset(self, start_value: int) -> None:
+        self._threshold = start_value * self._factor_num
+
+    def update(self, value: int) -> bool:
+        return value * self._factor_den >= self._threshold
+
+
+# One-sided CUSUM change-point detector for an upward shift of the voltage, i.e. the motor load dropping, see
+# [https://en.wikipedia.org/w/index.php?title=CUSUM&oldid=1040409563].
+# Accumulates how far the voltage exceeds the baseline by more than the allowed drift; noise around the baseline keeps
+# the sum near zero, while a sustained rise accumulates quickly – even if it is smaller than a fixed threshold factor
+# would require. Parameters are in ADC units:
+# - drift: Deviation from the baseline which is considered noise (sensitivity, higher is less sensitive)
+# - threshold: Accumulated deviation at which a change is detected (higher is slower, but more robust)
+# - min_dwell: Number of consecutive values the sum has to stay above the threshold before stopping
+# - baseline_shift: While no change is building up, the baseline follows the voltage with an EMA of factor
+#                   1/2**baseline_shift, to track the slowly discharging battery. 0 keeps the start voltage fixed.
+class CusumStopDetector(StopDetector):
+    def __init__(self, drift: int, threshold: int, min_dwell=1, baseline_shift=0):
+        self._drift = drift
+        self._threshold = threshold
+        self._min_dwell = min_dwell
+        self._baseline_shift = baseline_shift
+        self._baseline = 0  # fixed point with 16 fractional bits
+        self._sum = 0
+        self._dwell = 0
+
+    def reset(self, start_value: int) -> None:
+        self._baseline = start_value << 16
+        self._sum = 0
+        self._dwell = 0
+
+    def update(self, value: int) -> bool:
+        cusum = self._sum + value - (self._baseline >> 16) - self._drift
+        if cusum <= 0:
+            cusum = 0
+            if self._baseline_shift:
+                self._baseline += ((value << 16) - self._baseline) >> self._baseline_shift
+        self._sum = cusum
+
+        if cusum >= self._threshold:
+            self._dwell += 1
+        else:
+            self._dwell = 0
+        return self._dwell >= self._min_dwell
@@ -0,0 +1,73 @@
+# Fast paths for code running on every loop iteration.
+#
+# Register access: Reading or writing a uctypes bitfield looks up the field descriptor, builds a new int object and, for
+# writes, does a read-modify-write through the generic uctypes code – several microseconds per access. The viper
+# functions below access the registers directly via ptr32 instead, and combine the accesses needed at the end of a
+# capture into a single call. On CPython (host simulation), the same functions are implemented on top of machine.mem32,
+# so they behave identically (on the modelled registers), just not faster.
+#
+# Code emitters: Hot methods elsewhere are compiled to machine code with @micropython.native. On CPython, the
+# simulation's fake micropython module (or the stand-in below, without the simulation) makes that a no-op. Modules
+# import micropython from here for that reason; the compiler only looks at the decorator's name, so this works on the
+# device.
+# See grinder_benchmark.py for the per-call costs of the variants.
+import sys
+
+try:
+    import micropython
+except ImportError:  # CPython without the simulation
+    class micropython:
+        @staticmethod
+        def native(func):
+            return func
+
+        viper = native
+
+# Register addresses as in rp_devices, which is not imported here: This module has to be importable without uctypes
+DMA_BASE = 0x50000000
+DMA_CHAN_WIDTH = 0x40
+DMA_CTRL_TRIG_OFFSET = 0x0c
+DMA_AL1_CTRL_OFFSET = 0x10
+DMA_SNIFF_DATA_ADDR = DMA_BASE + 0x438
+DMA_CTRL_BUSY = 1 << 24
+DMA_CTRL_EN = 1
+ADC_CS_ADDR = 0x4004c000
+ADC_CS_START_MANY = 1 << 3
+
+
+# Address of the given DMA channel's registers, to be passed to the functions below
+def dma_chan_addr(channel: int) -> int:
+    return DMA_BASE + channel * DMA_CHAN_WIDTH
+
+
+if sys.implementation.name == 'micropython':
+    # Viper: integers are machine words, ptr32 indices are in words (CTRL_TRIG: 3, AL1_CTRL: 4). Bits are cleared with
+    # | and ^, as literals like 0xfffffff7 would not be small ints (i.e. objects, not machine words).
+    @micropython.viper
+    def dma_busy(chan_addr: int) -> bool:
+        return bool(ptr32(chan_addr)[3] & 0x1000000)  # noqa: F821
+
+    # Waits for the channel to finish, stops the ADC's free-running mode and disables the channel (via the
+    # non-triggering AL1_CTRL alias). Returns the sniffed sum of the capture.
+    @micropython.viper
+    def dma_finish_sniffed_capture(chan_addr: int) -> int:
+        chan = ptr32(chan_addr)  # noqa: F821
+        while chan[3] & 0x1000000:
+            pass
+        adc_cs = ptr32(0x4004c000)  # noqa: F821
+        adc_cs[0] = (adc_cs[0] | 0x8) ^ 0x8
+        chan[4] = (chan[3] | 1) ^ 1
+        return ptr32(0x50000438)[0]  # noqa: F821
+else:
+    # machine is imported on use: the simulation (providing it) might be installed after this module was imported
+    def dma_busy(chan_addr: int) -> bool:
+        from machine import mem32
+        return bool(mem32[chan_addr + DMA_CTRL_TRIG_OFFSET] & DMA_CTRL_BUSY)
+
+    def dma_finish_sniffed_capture(chan_addr: int) -> int:
+        from machine import mem32
+        while mem32[chan_addr + DMA_CTRL_TRIG_OFFSET] & DMA_CTRL_BUSY:
+            pass
+        mem32[ADC_CS_ADDR] = mem32[ADC_CS_ADDR] & ~ADC_CS_START_MANY
+        mem32[chan_addr + DMA_AL1_CTRL_OFFSET] = mem32[chan_addr + DMA_CTRL_TRIG_OFFSET] & ~DMA_CTRL_EN
+        return mem32[DMA_SNIFF_DATA_ADDR]
@@ -1,4 +1,31 @@
-from collections import deque
+import array
+
+from grinder_fast import micropython
+
+
+# Returns n for values of 2**n, -1 otherwise. int.bit_length() is not available on MicroPython.
+def _power_of_two_shift(value: int) -> int:
+    if value <= 0 or value & (value - 1):
+        return -1
+    shift = 0
+    while value > 1:
+        value >>= 1
+        shift += 1
+    return shift
+
+
+# Common interface of all smoothing filters for ADC values. Should be an ABC.
+# All filters are integer only and allocate their memory on construction – filtering never allocates.
+class Filter:
+    # Should be an @abstractmethod
+    def filter_value(self, new_val: int) -> int:
+        pass
+
+    # Filters a whole block of values (e.g. a DMA buffer as array or memoryview) into dst, which needs to be at least as
+    # long as src. Same results as calling filter_value() for each value. Subclasses may override this for speed.
+    def filter_block(self, src, dst) -> None:
+        for i in range(len(src)):
+            dst[i] = self.filter_value(src[i])
 
 
 # Smoothing filter for ADC values to try and get rid of some noise.
@@ -7,18 +34,163 @@ from collections import deque
 #
 # Tries to optimize for microcontrollers by not using floating point arithmetic.
 # Best suited for values of 16 bit and less -- internally shifts left by 16 bits to avoid rounding/truncation issues.
-class GrinderFilter:
+# The filter history is kept in a preallocated array used as ring buffer. For filter sizes which are a power of two, the
+# division is replaced by a shift (with identical results, as both round towards negative infinity).
+# The size can be changed with resize(), up to the size given on construction (the capacity), without reallocating.
+class GrinderFilter(Filter):
     def __init__(self, initial_value: int, filter_size):
-        self._filter_deque = deque(tuple(), filter_size)
-        for _ in range(filter_size):
-            self._filter_deque.append(initial_value)
+        self._filter_buff = array.array('l', (initial_value for _ in range(filter_size)))
+        self._filter_index = 0
         self._value_filtered = initial_value << 16
         self._filter_size = filter_size
+        self._filter_shift = _power_of_two_shift(filter_size)
+
+    @property
+    def filter_size(self) -> int:
+        return self._filter_size
 
+    @property
+    def capacity(self) -> int:
+        return len(self._filter_buff)
+
+    # Changes the filter size. The history is refilled with the given value – the current reading, as the output might
+    # be stale if the filter was not used for a while – or else with the current output.
+    def resize(self, filter_size: int, value=None) -> None:
+        if not 1 <= filter_size <= len(self._filter_buff):
+            raise ValueError('filter size must be 1 to {}'.format(len(self._filter_buff)))
+        if value is None:
+            value = self._value_filtered >> 16
+        for i in range(filter_size):
+            self._filter_buff[i] = value
+        self._value_filtered = value << 16
+        self._filter_index = 0
+        self._filter_size = filter_size
+        self._filter_shift = _power_of_two_shift(filter_size)
+
+    @micropython.native  # called every loop iteration
     def filter_value(self, new_val: int) -> int:
-        oldest = self._filter_deque.popleft()
-        self._filter_deque.append(new_val)
+        index = self._filter_index
+        oldest = self._filter_buff[index]
+        self._filter_buff[index] = new_val
+        index += 1
+        self._filter_index = index if index < self._filter_size else 0
         # Shift around a bit to avoid losing accuracy without using floating point arithmetic
-        self._value_filtered += ((new_val - oldest) << 16) // self._filter_size
+        if self._filter_shift >= 0:
+            self._value_filtered += ((new_val - oldest) << 16) >> self._filter_shift
+        else:
+            self._value_filtered += ((new_val - oldest) << 16) // self._filter_size
 
         return int(self._value_filtered >> 16)
+
+    # Without the per-call overhead of filter_value()
+    def filter_block(self, src, dst) -> None:
+        filter_buff = self._filter_buff
+        filter_size = self._filter_size
+        filter_shift = self._filter_shift
+        index = self._filter_index
+        value_filtered = self._value_filtered
+        for i in range(len(src)):
+            new_val = src[i]
+            oldest = filter_buff[index]
+            filter_buff[index] = new_val
+            index += 1
+            if index == filter_size:
+                index = 0
+            if filter_shift >= 0:
+                value_filtered += ((new_val - oldest) << 16) >> filter_shift
+            else:
+                value_filtered += ((new_val - oldest) << 16) // filter_size
+            dst[i] = value_filtered >> 16
+        self._filter_index = index
+        self._value_filtered = value_filtered
+
+    # Host only: NumPy equivalent of filter_block(), returning the filtered values as array. Same results and state
+    # update as filter_block(), see sma_fixed_numpy().
+    def filter_block_numpy(self, src):
+        import numpy as np
+        src = np.asarray(src, dtype=np.int64)
+        oldest_first = np.roll(np.asarray(self._filter_buff[:self._filter_size], dtype=np.int64), -self._filter_index)
+        filtered = sma_fixed_numpy(src, oldest_first, self._value_filtered)
+        if len(src):
+            self._value_filtered = int(filtered[-1])
+            for i, new_val in enumerate(np.concatenate([oldest_first, src])[-self._filter_size:]):
+                self._filter_buff[i] = int(new_val)
+            self._filter_index = 0
+        return filtered >> 16
+
+
+# Host only: The integer SMA of GrinderFilter with NumPy, along the last axis of values (e.g. one row per trace),
+# vectorized by summing up the per-value deltas. history holds the filter_size values before (oldest first, for all
+# rows or per row), value_filtered the internal fixed point sum of GrinderFilter (16 fractional bits) at the start.
+# Returns the fixed point sums after each value; shifted right by 16, these are the outputs of filter_value().
+def sma_fixed_numpy(values, history, value_filtered):
+    import numpy as np
+    values = np.asarray(values, dtype=np.int64)
+    history = np.asarray(history, dtype=np.int64)
+    filter_size = history.shape[-1]
+    history = np.broadcast_to(history, values.shape[:-1] + (filter_size,))
+    # The value leaving the window as each one enters it
+    leaving = np.concatenate([history, values], axis=-1)[..., :values.shape[-1]]
+    deltas = ((values - leaving) << 16) // filter_size
+    return value_filtered + np.cumsum(deltas, axis=-1)
+
+
+# Alias making the filter type explicit when choosing between filters
+SmaFilter = GrinderFilter
+
+
+# Exponential moving average with a smoothing factor of 1/2**shift, see
+# [https://en.wikipedia.org/w/index.php?title=Moving_average&oldid=1060117206#Exponential_moving_average].
+# Cheapest filter: No history at all, just one subtraction and shift per value. Fixed point with 16 fractional bits.
+# The output is rounded, as the truncating update would otherwise never quite reach a constant input from below.
+class EmaFilter(Filter):
+    def __init__(self, initial_value: int, shift: int):
+        self._value_filtered = initial_value << 16
+        self._shift = shift
+
+    def filter_value(self, new_val: int) -> int:
+        self._value_filtered += ((new_val << 16) - self._value_filtered) >> self._shift
+        return int((self._value_filtered + 0x8000) >> 16)
+
+    def filter_block(self, src, dst) -> None:
+        shift = self._shift
+        value_filtered = self._value_filtered
+        for i in range(len(src)):
+            value_filtered += ((src[i] << 16) - value_filtered) >> shift
+            dst[i] = (value_filtered + 0x8000) >> 16
+        self._value_filtered = value_filtered
+
+
+# Running median over a small window (e.g. 3 or 5 values) – rejects single spikes completely instead of smearing them
+# like the averaging filters do. Keeps the window both in arrival order (ring buffer) and sorted; each new value
+# replaces the oldest one in the sorted array by shifting the values in between. O(filter_size) per value, so only
+# suited for small windows. Odd window sizes avoid having to average the two middle values.
+class MedianFilter(Filter):
+    def __init__(self, initial_value: int, filter_size=3):
+        self._filter_buff = array.array('l', (initial_value for _ in range(filter_size)))
+        self._sorted_buff = array.array('l', (initial_value for _ in range(filter_size)))
+        self._filter_index = 0
+        self._filter_size = filter_size
+
+    def filter_value(self, new_val: int) -> int:
+        index = self._filter_index
+        oldest = self._filter_buff[index]
+        self._filter_buff[index] = new_val
+        index += 1
+        self._filter_index = index if index < self._filter_size else 0
+
+        sorted_buff = self._sorted_buff
+        pos = 0
+        while sorted_buff[pos] != oldest:
+            pos += 1
+        # Move the gap left by the oldest value towards where the new value belongs
+        while pos > 0 and sorted_buff[pos - 1] > new_val:
+            sorted_buff[pos] = sorted_buff[pos - 1]
+            pos -= 1
+        last = self._filter_size - 1
+        while pos < last and sorted_buff[pos + 1] < new_val:
+            sorted_buff[pos] = sorted_buff[pos + 1]
+            pos += 1
+        sorted_buff[pos] = new_val
+
+        return sorted_buff[self._filter_size >> 1]
@@ -1,9 +1,10 @@
-from machine import Pin
+from machine import Pin, lightsleep
 # from enum import Enum # Not supported by MicroPython!
 
-# from grinder_filter import GrinderFilter
-from grinder_debouncer import GrinderDebouncer
-from RP2040ADC import Rp2040AdcDmaAveraging
+from grinder_filter import GrinderFilter
+from grinder_debouncer import GrinderDebouncer, GrinderIrqDebouncer
+from grinder_detector import StopDetector, ThresholdStopDetector, CusumStopDetector
+from RP2040ADC import Rp2040AdcDmaAveraging, Rp2040AdcDmaPingPong, adc_power_down, adc_power_up
 
 BUTTON_PIN = 3
 MOTOR_FET_PIN = 5
@@ -14,12 +15,54 @@ VOLTAGE_THRESH_LOW = 1000
 VOLTAGE_THRESH_HIGH = 3000
 
 AUTOGRIND_STOP_VOLTAGE_FACTOR = 1.1
+# Detector for the end of automatic grinding: 'cusum' (change-point detection) or 'threshold' (stop voltage factor)
+AUTOGRIND_DETECTOR = 'cusum'
+# CUSUM parameters in ADC units, see CusumStopDetector
+CUSUM_DRIFT = 20
+CUSUM_THRESHOLD = 200
+CUSUM_MIN_DWELL = 3
+CUSUM_BASELINE_SHIFT = 8
 AUTOGRIND_TIMEOUT_MS = 1000
 AUTOGRIND_SAFETY_STOP_MS = 1000 * 60
 
+# Let ADC and DMA run freely and just pick up the latest average instead of waiting for a capture on every read
+ADC_CONTINUOUS_CAPTURE = True
+# Run ADC acquisition, voltage filtering and stop detection on core 1 (see Core1Acquisition), at the given period.
+# ADC_CONTINUOUS_CAPTURE does not apply then.
+DUAL_CORE_ACQUISITION = False
+CORE1_PERIOD_US = 2000
+# Oversampling of the averaging capture, i.e. without continuous capture or on core 1: 4**(bits - 12) samples per
+# reading for 13-16 bits (see Rp2040AdcDmaAveraging.configure()), which must be more than ADC_MAX_SAMPLES to have any
+# effect, i.e. 15 or 16 bits. Voltages stay in 12 bit units – the thresholds and the stop detection are tuned for that –
+# so this only averages out more noise per reading, at the cost of longer captures. Rejected with continuous capture,
+# which does not oversample. The sample rate only applies on core 1, see the sampling profiles otherwise.
+ADC_RESOLUTION_BITS = 12
+ADC_SAMPLE_RATE = 0
+# Low-power idle (see GrinderHardware.set_low_power()): While idle or charging, the ADC is powered down between single
+# captures and the loop sleeps for IDLE_SLEEP_MS between runs, woken up early by a button edge.
+# Does not apply with DUAL_CORE_ACQUISITION.
+LOW_POWER_IDLE = True
+IDLE_SLEEP_MS = 50
+
 DEBOUNCE_TIME_MS = 20
+# Debounce the button from edge timestamps taken by a pin interrupt (GrinderIrqDebouncer) instead of polling the pin
+# on every run (GrinderDebouncer): no per-run pin read and ticks_ms(), and debouncing starts right at the edge.
+BUTTON_IRQ = True
+VOLTAGE_FILTER_ENABLED = False
 VOLTAGE_FILTER_SIZE = 16
 
+# Sampling profiles, declared per state (State.sampling_profile) and applied on each transition, see
+# GrinderHardware.set_sampling_profile(): (ADC samples per reading, ADC sample rate [1/s] – 0: full speed,
+# voltage filter depth – 0: unfiltered, None: VOLTAGE_FILTER_SIZE). Samples must be powers of two up to ADC_MAX_SAMPLES
+# (buffers are allocated for that once). The filter depth only applies with VOLTAGE_FILTER_ENABLED, up to
+# VOLTAGE_FILTER_SIZE. Not used with DUAL_CORE_ACQUISITION.
+ADC_MAX_SAMPLES = 16
+# Thresholds only (idle, charging, manual grinding): few samples at a tenth of the full rate (except for the single
+# captures of low-power idle, see GrinderHardware._configure_capture()), no filtering
+SAMPLING_PROFILE_COARSE = (4, 50000, 0)
+# Stop detection (grind begin, i.e. the start voltage, and automatic grinding): dense, filtered
+SAMPLING_PROFILE_DENSE = (16, 0, None)
+
 
 class GrinderHardware:
     # Should be an Enum
@@ -38,18 +81,81 @@ class GrinderHardware:
         STOPPED = 1
 
     def __init__(self):
+        if ADC_RESOLUTION_BITS != 12 and ADC_CONTINUOUS_CAPTURE and not DUAL_CORE_ACQUISITION:
+            raise ValueError('ADC_RESOLUTION_BITS needs the averaging capture')
         self._button = Pin(BUTTON_PIN, Pin.IN, Pin.PULL_UP)
         self._jack_switch = Pin(JACK_FET_PIN, Pin.OUT, value=0)  # Default: Connected
         self._motor_switch = Pin(MOTOR_FET_PIN, Pin.OUT, value=0)  # Default: Motor off
+        if BUTTON_IRQ:
+            self._debounce = None
+            self._irq_debounce = GrinderIrqDebouncer(self._button, DEBOUNCE_TIME_MS)  # also ends lightsleep()
+        else:
+            self._debounce = GrinderDebouncer(initial_value=1, debounce_time_ms=DEBOUNCE_TIME_MS)
+            self._irq_debounce = None
+        self._filter = None
+        self._filter_enabled = False
+        self._raw_voltage = VOLTAGE_THRESH_HIGH  # last reading before filtering
+        self._low_power = False
+        self._sampling_profile = (ADC_MAX_SAMPLES, 0, None)  # as constructed below
+        self._thresh_low = VOLTAGE_THRESH_LOW
+        self._thresh_high = VOLTAGE_THRESH_HIGH
+        if VOLTAGE_FILTER_ENABLED:
+            self._filter = GrinderFilter(initial_value=VOLTAGE_THRESH_HIGH, filter_size=VOLTAGE_FILTER_SIZE)
+            self._filter_enabled = True
+
+        self._core1 = None
+        if DUAL_CORE_ACQUISITION:
+            from grinder_core1 import Core1Acquisition
+            self._avg_adc = None
+            adc = Rp2040AdcDmaAveraging(gpio_pin=VOLTAGE_PIN, adc_samples=ADC_MAX_SAMPLES,
+                                        resolution_bits=ADC_RESOLUTION_BITS, sample_rate=ADC_SAMPLE_RATE)
+            self._core1 = Core1Acquisition(adc, self._filter, self.create_stop_detector(), CORE1_PERIOD_US)
+            self._filter = None  # owned by core 1 now
+            self._filter_enabled = False
+            self._stop_detector = self._core1.stop_detector
+            self._core1.start()
+            return
+
         # self._voltage_adc = ADC(Pin(VOLTAGE_PIN))
-        self._avg_adc = Rp2040AdcDmaAveraging(gpio_pin=VOLTAGE_PIN, dma_chan=0, adc_samples=16)
+        if ADC_CONTINUOUS_CAPTURE:
+            self._avg_adc = Rp2040AdcDmaPingPong(gpio_pin=VOLTAGE_PIN, adc_samples=ADC_MAX_SAMPLES)
+        else:
+            self._avg_adc = Rp2040AdcDmaAveraging(gpio_pin=VOLTAGE_PIN, adc_samples=ADC_MAX_SAMPLES,
+                                                  resolution_bits=ADC_RESOLUTION_BITS)
+
+        self._stop_detector = self.create_stop_detector()
 
-        self._debounce = GrinderDebouncer(initial_value=1, debounce_time_ms=DEBOUNCE_TIME_MS)
-        # self._filter = GrinderFilter(initial_value=VOLTAGE_THRESH_HIGH, filter_size=VOLTAGE_FILTER_SIZE)
+        if LOW_POWER_IDLE and self._irq_debounce is None:
+            self._button.irq(self._on_button_edge, Pin.IRQ_FALLING | Pin.IRQ_RISING)
 
-        # Start first ADC DMA capture, so that the first run() will have something to read
+        # Start first ADC DMA capture, so that the first run() will have something to read.
+        # In continuous mode, this keeps running from now on.
         self._avg_adc.capture_start()
 
+    # calibration: GrinderCalibration to take the CUSUM drift or stop voltage factor from, if given
+    @staticmethod
+    def create_stop_detector(calibration=None) -> StopDetector:
+        if AUTOGRIND_DETECTOR == 'cusum':
+            drift = CUSUM_DRIFT if calibration is None else calibration.cusum_drift(CUSUM_DRIFT)
+            return CusumStopDetector(drift=drift, threshold=CUSUM_THRESHOLD, min_dwell=CUSUM_MIN_DWELL,
+                                     baseline_shift=CUSUM_BASELINE_SHIFT)
+        factor = int(AUTOGRIND_STOP_VOLTAGE_FACTOR * 1000)
+        if calibration is not None:
+            factor = calibration.stop_factor_permille(factor)
+        return ThresholdStopDetector(factor, 1000)
+
+    # Uses the stop and charging thresholds learned by the given GrinderCalibration (the configured ones until it has
+    # seen enough sessions). Only to be called outside of automatic grinding. With DUAL_CORE_ACQUISITION, the stop
+    # detector on core 1 is kept.
+    def apply_calibration(self, calibration) -> None:
+        self._thresh_low, self._thresh_high = calibration.charge_thresholds(VOLTAGE_THRESH_LOW, VOLTAGE_THRESH_HIGH)
+        if self._core1 is None:
+            self._stop_detector = self.create_stop_detector(calibration)
+
+    @property
+    def stop_detector(self) -> StopDetector:
+        return self._stop_detector
+
     @staticmethod
     def _adc_to_voltage(adc_val):
         # FIXME Maybe actually convert?!
@@ -58,14 +164,119 @@ class GrinderHardware:
     def read_voltage(self):
         # return self._adc_to_voltage(self._filter.filter_value(self._voltage_adc.read_u16()))
         # return self._avg_adc.read_u16()
-        value = self._avg_adc.wait_and_read_average_u12()
+        if self._core1 is not None:
+            return self._core1.voltage
+        if self._low_power:
+            return self._filter_voltage(self._read_single_capture())
+        if ADC_CONTINUOUS_CAPTURE:
+            value = self._avg_adc.read_latest_average_u12()
+        else:
+            value = self._avg_adc.wait_and_read_average_u12()
+            # Restart ADC DMA capture for next run()
+            self._avg_adc.capture_start()
 
-        # Restart ADC DMA capture for next run()
+        return self._filter_voltage(value)
+
+    # One capture with the ADC powered up just for it
+    def _read_single_capture(self):
+        adc_power_up()
         self._avg_adc.capture_start()
+        if ADC_CONTINUOUS_CAPTURE:
+            value = self._avg_adc.read_latest_average_u12()  # capture_start() waited for the first buffer
+            self._avg_adc.capture_stop()
+        else:
+            value = self._avg_adc.wait_and_read_average_u12()
+        adc_power_down()
+        return value
+
+    @property
+    def low_power(self) -> bool:
+        return self._low_power
+
+    # Switches between full rate operation and low-power idle, in which read_voltage() only does a single capture each
+    # time and powers the ADC down afterwards, and idle_sleep() actually sleeps
+    def set_low_power(self, enabled: bool) -> None:
+        if not LOW_POWER_IDLE or self._core1 is not None or enabled == self._low_power:
+            return
+        self._low_power = enabled
+        if enabled:
+            if ADC_CONTINUOUS_CAPTURE:
+                self._avg_adc.capture_stop()
+            else:
+                self._avg_adc.wait_and_read_average_u12()  # end the capture started by the last read
+            self._configure_capture()
+            adc_power_down()
+        else:
+            self._configure_capture()
+            adc_power_up()
+            self._avg_adc.capture_start()
+
+    @property
+    def sampling_profile(self) -> tuple:
+        return self._sampling_profile
+
+    # Reconfigures capture (and the voltage filter) for the given sampling profile, see SAMPLING_PROFILE_COARSE. Only
+    # changes settings, nothing is reallocated. A running capture is restarted, so the next reading might take a bit
+    # longer.
+    def set_sampling_profile(self, profile: tuple) -> None:
+        if self._core1 is not None or profile == self._sampling_profile:
+            return
+        self._sampling_profile = profile
+        filter_depth = profile[2]
+        running = not self._low_power
+        if running:
+            if ADC_CONTINUOUS_CAPTURE:
+                self._avg_adc.capture_stop()
+            else:
+                self._avg_adc.wait_and_read_average_u12()  # end the capture started by the last read
+        self._configure_capture()
+        if running:
+            self._avg_adc.capture_start()
+        if self._filter is not None:
+            self._filter_enabled = filter_depth != 0
+            # The output is stale after running unfiltered – start from the current reading instead
+            if filter_depth is None:
+                self._filter.resize(self._filter.capacity, self._raw_voltage)
+            elif filter_depth > 0:
+                self._filter.resize(min(filter_depth, self._filter.capacity), self._raw_voltage)
+
+    # Applies the sampling profile to the capture, only while none is running. The single captures of low-power idle
+    # run at full speed regardless – the CPU waits for them, so a lower rate would only keep it awake longer.
+    def _configure_capture(self) -> None:
+        adc_samples, sample_rate, _ = self._sampling_profile
+        if self._low_power:
+            sample_rate = 0
+        if ADC_CONTINUOUS_CAPTURE:
+            self._avg_adc.configure(adc_samples, sample_rate)
+        else:
+            self._avg_adc.configure(ADC_RESOLUTION_BITS, sample_rate, adc_samples)
+
+    # Nothing to do – the interrupt itself ends lightsleep()
+    def _on_button_edge(self, pin) -> None:
+        pass
+
+    # In low-power idle, sleeps for IDLE_SLEEP_MS or until a button edge. Does not sleep while the button is pressed, as
+    # debouncing needs the full loop rate. Returns whether it slept.
+    def idle_sleep(self) -> bool:
+        if not self._low_power:
+            return False
+        if self._button.value() == 0:
+            return False
+        # An edge right before sleeping is only noticed after it, i.e. delayed by at most IDLE_SLEEP_MS
+        lightsleep(IDLE_SLEEP_MS)
+        return True
+
+    def _filter_voltage(self, value):
+        self._raw_voltage = value
+        if self._filter_enabled:
+            return self._filter.filter_value(value)
         return value
 
     def read_button_state(self):
-        debounced = self._debounce.debounce_button(self._button.value())
+        if self._irq_debounce is not None:
+            debounced = self._irq_debounce.debounced_state()
+        else:
+            debounced = self._debounce.debounce_button(self._button.value())
         return GrinderHardware.ButtonState.PRESSED if debounced == 0 else GrinderHardware.ButtonState.RELEASED
 
     def set_motor_state(self, val: MotorState):
@@ -74,14 +285,8 @@ class GrinderHardware:
     def set_jack_state(self, val: JackState):
         self._jack_switch.value(0 if val == GrinderHardware.JackState.ENABLED else 1)
 
-    @staticmethod
-    def should_stop_charging(current_voltage):
-        return current_voltage >= VOLTAGE_THRESH_HIGH
+    def should_stop_charging(self, current_voltage):
+        return current_voltage >= self._thresh_high
 
-    @staticmethod
-    def should_start_charging(current_voltage):
-        return current_voltage <= VOLTAGE_THRESH_LOW
-
-    @staticmethod
-    def should_stop_grinding(current_voltage, start_voltage):
-        return current_voltage >= start_voltage * AUTOGRIND_STOP_VOLTAGE_FACTOR
+    def should_start_charging(self, current_voltage):
+        return current_voltage <= self._thresh_low
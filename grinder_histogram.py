@@ -0,0 +1,65 @@
+import array
+
+
+# Histogram with fixed, linear buckets for collecting timing statistics on the device.
+# All memory is allocated on construction, so add() can be used in the control loop without causing heap churn.
+# Values beyond the last bucket are counted in the last bucket, negative values in the first one. Percentiles are
+# therefore only as accurate as the bucket width – min and max are tracked exactly.
+class GrinderHistogram:
+    def __init__(self, bucket_width: int, bucket_count: int):
+        self._bucket_width = bucket_width
+        self._bucket_count = bucket_count
+        self._buckets = array.array('l', (0 for _ in range(bucket_count)))
+        self._count = 0
+        self._min = 0
+        self._max = 0
+
+    def reset(self) -> None:
+        for i in range(self._bucket_count):
+            self._buckets[i] = 0
+        self._count = 0
+        self._min = 0
+        self._max = 0
+
+    def add(self, value: int) -> None:
+        index = value // self._bucket_width
+        if index >= self._bucket_count:
+            index = self._bucket_count - 1
+        elif index < 0:
+            index = 0
+        self._buckets[index] += 1
+        if self._count == 0 or value < self._min:
+            self._min = value
+        if self._count == 0 or value > self._max:
+            self._max = value
+        self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def min(self) -> int:
+        return self._min
+
+    @property
+    def max(self) -> int:
+        return self._max
+
+    # Returns the upper bound of the bucket containing the given percentile (0-100), limited by the actual maximum
+    def percentile(self, percent: int) -> int:
+        if self._count == 0:
+            return 0
+        needed = (self._count * percent + 99) // 100
+        seen = 0
+        for i in range(self._bucket_count):
+            seen += self._buckets[i]
+            if seen >= needed and seen > 0:
+                if i == self._bucket_count - 1:  # overflow bucket
+                    return self._max
+                return min((i + 1) * self._bucket_width, self._max)
+        return self._max
+
+    def summary(self) -> str:
+        return 'n={} min={} p50={} p90={} p99={} max={}'.format(
+            self._count, self._min, self.percentile(50), self.percentile(90), self.percentile(99), self._max)
@@ -0,0 +1,136 @@
+import array
+import struct
+import sys
+import time
+
+# Number of records the ring buffer can hold until records are dropped
+LOG_CAPACITY = 64
+# Write records as binary frames to the serial console (decode with tools/decode_log.py) instead of formatting them as
+# text on the device
+LOG_BINARY_OUTPUT = False
+
+# Event ids of the log records. Each has a format string for its up to three int arguments in EVENT_FORMATS.
+EVENT_DROPPED = 1
+EVENT_IDLE = 2
+EVENT_GRIND_BEGIN = 3
+EVENT_AUTOGRIND = 4
+EVENT_MANUAL_GRIND = 5
+EVENT_CHARGING = 6
+EVENT_STATUS = 7
+EVENT_STATUS_ASYNC = 8
+EVENT_GC = 9
+
+EVENT_FORMATS = {
+    EVENT_DROPPED: 'Log buffer overflow, {} records dropped',
+    EVENT_IDLE: 'Entering idle state',
+    EVENT_GRIND_BEGIN: 'Entering grind begin state',
+    EVENT_AUTOGRIND: 'Entering automatic grinding state; Vstart={}',
+    EVENT_MANUAL_GRIND: 'Entering manual grinding state',
+    EVENT_CHARGING: 'Entering charging state',
+    EVENT_STATUS: 'Battery voltage: {}; Button state: {}; Time for 1000 runs: {}us',
+    EVENT_STATUS_ASYNC: 'Battery voltage: {}; Button state: {}; State runs: {}',
+    EVENT_GC: 'Garbage collection took {}us; heap: {} used, {} free',
+}
+
+# A record is (timestamp [us], event id, arg1, arg2, arg3). Binary frames are a two byte marker followed by the record
+# as little endian int32 values.
+RECORD_WORDS = 5
+FRAME_MARKER = b'\xa5\x5a'
+FRAME_FORMAT = '<2s5i'
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+
+
+# Formats the message of a record (any sequence of RECORD_WORDS ints)
+def format_message(record) -> str:
+    event_format = EVENT_FORMATS.get(record[1])
+    if event_format is None:
+        return 'Unknown event {}: {} {} {}'.format(record[1], record[2], record[3], record[4])
+    return event_format.format(record[2], record[3], record[4])
+
+
+# Formats a record like GrinderController.log() formats its messages
+def format_record(record) -> str:
+    return '{} – {}'.format(record[0], format_message(record))
+
+
+# Deferred logger for the control loop: log_event() only stores a compact binary record in a preallocated ring buffer,
+# which is cheap and never blocks or allocates. Formatting and writing to the serial console happen in flush_one(),
+# which is meant to be called when the loop has idle time, e.g. from GrinderScheduler's slack before a deadline.
+# If the buffer is full, new records are dropped and counted; the number of dropped records is reported as record of
+# its own once the buffer has been drained.
+class GrinderLog:
+    def __init__(self, capacity=LOG_CAPACITY, binary_output=LOG_BINARY_OUTPUT):
+        self._buff = array.array('l', (0 for _ in range(RECORD_WORDS * capacity)))
+        self._capacity = capacity
+        self._head = 0  # record index to write next
+        self._tail = 0  # record index to read next
+        self._used = 0
+        self._dropped = 0
+        self._dropped_total = 0
+        self._binary_output = binary_output
+        self._record = array.array('l', (0 for _ in range(RECORD_WORDS)))
+        self._frame = bytearray(FRAME_SIZE)
+
+    @property
+    def pending(self) -> int:
+        return self._used
+
+    @property
+    def dropped_total(self) -> int:
+        return self._dropped_total
+
+    def log_event(self, event: int, arg1=0, arg2=0, arg3=0) -> None:
+        if self._used == self._capacity:
+            self._dropped += 1
+            self._dropped_total += 1
+            return
+        i = self._head * RECORD_WORDS
+        buff = self._buff
+        buff[i] = time.ticks_us()
+        buff[i + 1] = event
+        buff[i + 2] = arg1
+        buff[i + 3] = arg2
+        buff[i + 4] = arg3
+        self._head = self._head + 1 if self._head + 1 < self._capacity else 0
+        self._used += 1
+
+    # Copies the oldest record into record (at least RECORD_WORDS long) and removes it from the buffer. Returns False if
+    # there is nothing to read.
+    def read_record(self, record) -> bool:
+        if self._used == 0:
+            if self._dropped == 0:
+                return False
+            record[0] = time.ticks_us()
+            record[1] = EVENT_DROPPED
+            record[2] = self._dropped
+            record[3] = 0
+            record[4] = 0
+            self._dropped = 0
+            return True
+        i = self._tail * RECORD_WORDS
+        for j in range(RECORD_WORDS):
+            record[j] = self._buff[i + j]
+        self._tail = self._tail + 1 if self._tail + 1 < self._capacity else 0
+        self._used -= 1
+        return True
+
+    # Writes the oldest record to the serial console. Returns True if there are more records to write.
+    def flush_one(self) -> bool:
+        record = self._record
+        if not self.read_record(record):
+            return False
+        if self._binary_output:
+            struct.pack_into(FRAME_FORMAT, self._frame, 0, FRAME_MARKER,
+                             record[0], record[1], record[2], record[3], record[4])
+            sys.stdout.buffer.write(self._frame)
+        elif __debug__:
+            print(format_record(record))
+        return self._used > 0 or self._dropped > 0
+
+    def flush(self) -> None:
+        while self.flush_one():
+            pass
+
+
+# The logger used by the controller
+LOG = GrinderLog()
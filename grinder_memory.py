@@ -0,0 +1,59 @@
+import gc
+import sys
+import time
+
+import grinder_log
+from grinder_histogram import GrinderHistogram
+
+# Minimum time between explicit collections
+GC_INTERVAL_MS = 1000
+# Automatic collection only after this share of the free heap (as after the first collection) has been allocated
+GC_THRESHOLD_PERCENT = 75
+
+
+# Takes garbage collection off the control loop's critical path: The heap is collected explicitly by calling
+# collect_if_due() from states in which nothing time critical happens (idle, charging), and the threshold for automatic
+# collection is raised so far that it is only a safety net. Automatic collection is not disabled, as MicroPython would
+# then not even collect when an allocation fails, but raise MemoryError. As the control loop does not allocate while
+# grinding, neither happens there. On CPython (host simulation), the interpreter's own collection is left alone.
+# Each collection's pause is recorded in a histogram and logged together with the heap usage.
+class GrinderGc:
+    def __init__(self, interval_ms=GC_INTERVAL_MS, pause_bucket_us=100, pause_buckets=100):
+        self._interval_ms = interval_ms
+        self._pauses = GrinderHistogram(pause_bucket_us, pause_buckets)
+        self._last_collect = time.ticks_ms()
+        self._min_free = gc.mem_free()
+        gc.collect()
+        if sys.implementation.name == 'micropython':
+            gc.threshold(gc.mem_free() * GC_THRESHOLD_PERCENT // 100)
+
+    @property
+    def pauses(self) -> GrinderHistogram:
+        return self._pauses
+
+    # Lowest amount of free heap seen before a collection, i.e. the headroom left in between collections
+    @property
+    def min_free(self) -> int:
+        return self._min_free
+
+    def collect(self) -> None:
+        free_before = gc.mem_free()
+        if free_before < self._min_free:
+            self._min_free = free_before
+        start = time.ticks_us()
+        gc.collect()
+        pause = time.ticks_diff(time.ticks_us(), start)
+        self._pauses.add(pause)
+        self._last_collect = time.ticks_ms()
+        grinder_log.LOG.log_event(grinder_log.EVENT_GC, pause, gc.mem_alloc(), gc.mem_free())
+
+    # Collects if the last collection is at least interval_ms ago. Returns True if it did.
+    def collect_if_due(self) -> bool:
+        if time.ticks_diff(time.ticks_ms(), self._last_collect) < self._interval_ms:
+            return False
+        self.collect()
+        return True
+
+    def stats(self) -> str:
+        return 'GC pause [us]: {}; heap: {} used, {} free, {} min free'.format(
+            self._pauses.summary(), gc.mem_alloc(), gc.mem_free(), self._min_free)
@@ -0,0 +1,77 @@
+import sys
+import time
+
+from grinder_histogram import GrinderHistogram
+
+# Stages of the control loop timed by GrinderProfiler, indices into its histograms
+STAGE_ADC = 0
+STAGE_BUTTON = 1
+STAGE_LOG = 2
+STAGE_STATE = 3
+STAGE_TRANSITION = 4
+STAGE_NAMES = ('ADC', 'button', 'log', 'state run', 'transition')
+
+
+# Opt-in timing of the individual stages of the control loop, each collected in its own preallocated histogram, so
+# profiling does not allocate in the control loop.
+# Stages are timed back to back: start() marks the beginning of a loop run, each lap(stage) attributes the time since
+# the previous mark to the given stage. Transitions happen within the state's run(), so they are timed as nested
+# measurement (nested_start()/nested_end()) and excluded from the enclosing lap.
+#
+# The statistics can be dumped on demand over the serial console (USB CDC or UART REPL), see poll_serial().
+class GrinderProfiler:
+    def __init__(self, bucket_us=10, buckets=100):
+        self._histograms = tuple(GrinderHistogram(bucket_us, buckets) for _ in STAGE_NAMES)
+        self._start = time.ticks_us()
+        self._poll = None
+        try:
+            import select
+            self._poll = select.poll()
+            self._poll.register(sys.stdin, select.POLLIN)
+        except (ImportError, AttributeError, OSError, ValueError):
+            pass  # No pollable console, e.g. on the host
+
+    def histogram(self, stage: int) -> GrinderHistogram:
+        return self._histograms[stage]
+
+    def start(self) -> None:
+        self._start = time.ticks_us()
+
+    def lap(self, stage: int) -> None:
+        now = time.ticks_us()
+        self._histograms[stage].add(time.ticks_diff(now, self._start))
+        self._start = now
+
+    def nested_start(self) -> int:
+        return time.ticks_us()
+
+    def nested_end(self, stage: int, start: int) -> None:
+        duration = time.ticks_diff(time.ticks_us(), start)
+        self._histograms[stage].add(duration)
+        self._start = time.ticks_add(self._start, duration)
+
+    def reset(self) -> None:
+        for histogram in self._histograms:
+            histogram.reset()
+
+    def dump(self) -> None:
+        for name, histogram in zip(STAGE_NAMES, self._histograms):
+            print('{:>10} [us]: {}'.format(name, histogram.summary()))
+
+    # Handles single character commands from the serial console without blocking: 'p' prints all stage statistics,
+    # 'r' resets them. Returns True if a command was handled.
+    def poll_serial(self) -> bool:
+        if self._poll is None:
+            return False
+        handled = False
+        # ipoll() does not allocate a result list on MicroPython
+        events = self._poll.ipoll(0) if hasattr(self._poll, 'ipoll') else self._poll.poll(0)
+        for _ in events:
+            command = sys.stdin.read(1)
+            if command == 'p':
+                self.dump()
+                handled = True
+            elif command == 'r':
+                self.reset()
+                handled = True
+        return handled
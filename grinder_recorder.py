@@ -0,0 +1,280 @@
+import os
+import struct
+import time
+
+import grinder_log
+
+# Directory of the session files on the device's file system
+RECORDER_DIR = 'sessions'
+# The recorded voltage is the average over each interval, i.e. decimated to one sample per interval
+RECORD_INTERVAL_MS = 10
+# Samples per session, i.e. RECORD_INTERVAL_MS * RECORD_MAX_SAMPLES of voltage trace. Longer sessions are truncated.
+RECORD_MAX_SAMPLES = 2048
+RECORD_MAX_TRANSITIONS = 8
+# Recording goes on for this long after grinding stopped, so traces also cover the voltage a slower stop detection
+# would have seen
+RECORD_POST_MS = 500
+# Sessions waiting to be written; a session starting while all are taken is not recorded
+RECORD_BUFFERS = 2
+# Bytes written per call of flush_one(), one flash page
+WRITE_CHUNK_BYTES = 256
+# Sessions are appended to segment files of up to this size. If all segments together would exceed RECORDER_MAX_BYTES,
+# the oldest segments are deleted.
+SEGMENT_MAX_BYTES = 16 * 1024
+RECORDER_MAX_BYTES = 128 * 1024
+
+# Why a session ended
+STOP_NONE = 0  # not ended by a stop, e.g. charging started
+STOP_DETECTED = 1  # automatic grinding stopped by the stop detector
+STOP_TIMEOUT = 2  # automatic grinding stopped by AUTOGRIND_SAFETY_STOP_MS
+STOP_MANUAL = 3  # button released in manual grinding
+STOP_REASONS = {STOP_NONE: 'none', STOP_DETECTED: 'detected', STOP_TIMEOUT: 'timeout', STOP_MANUAL: 'manual'}
+
+# Session record: header, voltage samples (uint16) and transitions, all little endian. The header holds the session's
+# start time (ticks_ms(), i.e. only for ordering within a boot), the start voltage of automatic grinding (0 if not
+# entered), the sample interval [ms], stop reason, flags, number of transitions and number of samples.
+# Transitions are (time since session start [ms], grinder_log event id of the state entered).
+RECORD_MAGIC = b'GRS1'
+HEADER_FORMAT = '<4sIHHBBBxH'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TRANSITION_FORMAT = '<IH'
+TRANSITION_SIZE = struct.calcsize(TRANSITION_FORMAT)
+FLAG_TRUNCATED = 1  # more samples than RECORD_MAX_SAMPLES
+SEGMENT_SUFFIX = '.grs'
+
+
+# Records grind sessions – from entering the grind begin state until RECORD_POST_MS after entering the idle or charging
+# state – into a compact binary format on flash, as real-world voltage traces for tuning the stop detection offline (see
+# tools/trace_replay.py, which loads the session files).
+# The control loop only ever writes into preallocated RAM buffers: on_transition() is called on each state transition,
+# add_voltage() on each run. Once a session has ended, its buffer is written to flash by flush_one(), one flash page
+# per call, from states with time to spare (idle, charging) – so the loop never blocks on flash writes.
+# Sessions are appended to segment files (never rewritten, no index file), which are rotated oldest first to keep the
+# total size bounded. A session interrupted by a power cycle is lost, the segment files stay valid – readers ignore a
+# partial record at their end, and each boot starts a new segment.
+class GrinderRecorder:
+    def __init__(self, directory=RECORDER_DIR, interval_ms=RECORD_INTERVAL_MS, max_samples=RECORD_MAX_SAMPLES,
+                 buffers=RECORD_BUFFERS, segment_max_bytes=SEGMENT_MAX_BYTES, max_bytes=RECORDER_MAX_BYTES):
+        self._dir = directory
+        self._interval_ms = interval_ms
+        self._max_samples = max_samples
+        self._segment_max_bytes = segment_max_bytes
+        self._max_bytes = max_bytes
+        buffer_size = HEADER_SIZE + 2 * max_samples + TRANSITION_SIZE * RECORD_MAX_TRANSITIONS
+        self._buffs = [bytearray(buffer_size) for _ in range(buffers)]
+        self._lengths = [0] * buffers  # of sealed sessions, 0: free
+        self._recording = False
+        self._stopping = False  # grinding stopped, recording until RECORD_POST_MS later
+        self._stop_ms = 0
+        self._stop_reason = STOP_NONE
+        self._buff = None
+        self._buff_index = 0
+        self._start_ms = 0
+        self._interval_start_ms = 0
+        self._start_voltage = 0
+        self._sample_count = 0
+        self._sample_sum = 0
+        self._sample_runs = 0
+        self._truncated = False
+        self._transitions = [0] * (2 * RECORD_MAX_TRANSITIONS)  # (time, event id) pairs
+        self._transition_count = 0
+        self._dropped_sessions = 0
+        # Writing: buffer index and offset of the session being written, and its segment file
+        self._write_index = -1
+        self._write_offset = 0
+        self._file = None
+        self._new_segment = True  # never append to a segment of a previous boot, which might end with a partial record
+
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass  # exists
+        self._segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                                if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+        self._total_bytes = sum(self._segment_size(segment) for segment in self._segments)
+
+    @property
+    def recording(self) -> bool:
+        return self._recording
+
+    # Sessions not recorded because all buffers were still waiting to be written
+    @property
+    def dropped_sessions(self) -> int:
+        return self._dropped_sessions
+
+    # Sessions ended but not completely written yet
+    @property
+    def pending(self) -> int:
+        return sum(1 for length in self._lengths if length)
+
+    def _segment_path(self, segment: int) -> str:
+        return '{}/{:06d}{}'.format(self._dir, segment, SEGMENT_SUFFIX)
+
+    def _segment_size(self, segment: int) -> int:
+        return os.stat(self._segment_path(segment))[6]
+
+    # Called by the controller on every state transition, with the event id of the state entered (see grinder_log),
+    # the argument passed to it (stop reason when entering idle), and the current voltage
+    def on_transition(self, event: int, arg: int, voltage: int) -> None:
+        if event == grinder_log.EVENT_GRIND_BEGIN:
+            if self._stopping:
+                self._end_session()  # cut short by the next session
+            if not self._recording:
+                self._start_session()
+        if not self._recording:
+            return
+        if self._transition_count < RECORD_MAX_TRANSITIONS:
+            i = 2 * self._transition_count
+            self._transitions[i] = time.ticks_diff(time.ticks_ms(), self._start_ms)
+            self._transitions[i + 1] = event
+            self._transition_count += 1
+        if event == grinder_log.EVENT_AUTOGRIND:
+            self._start_voltage = voltage
+        elif (event == grinder_log.EVENT_IDLE or event == grinder_log.EVENT_CHARGING) and not self._stopping:
+            self._stopping = True
+            self._stop_ms = time.ticks_ms()
+            self._stop_reason = arg if event == grinder_log.EVENT_IDLE else STOP_NONE
+
+    # Called by the controller on every run. Samples are the averages of the values of each interval. If runs are
+    # further apart than an interval (e.g. in low-power idle), the average is repeated for each interval passed, so
+    # sample i is always at i * interval_ms.
+    def add_voltage(self, voltage: int) -> None:
+        if not self._recording:
+            return
+        self._sample_sum += voltage
+        self._sample_runs += 1
+        now = time.ticks_ms()
+        intervals = time.ticks_diff(now, self._interval_start_ms) // self._interval_ms
+        if intervals > 0:
+            self._interval_start_ms = time.ticks_add(self._interval_start_ms, intervals * self._interval_ms)
+            self._add_samples(self._sample_sum // self._sample_runs, intervals)
+            self._sample_sum = 0
+            self._sample_runs = 0
+        if self._stopping and time.ticks_diff(now, self._stop_ms) >= RECORD_POST_MS:
+            self._end_session()
+
+    def _add_samples(self, value: int, count: int) -> None:
+        if self._sample_count + count > self._max_samples:
+            self._truncated = True
+            count = self._max_samples - self._sample_count
+        buff = self._buff
+        offset = HEADER_SIZE + 2 * self._sample_count
+        for _ in range(count):
+            buff[offset] = value & 0xff
+            buff[offset + 1] = value >> 8
+            offset += 2
+        self._sample_count += count
+
+    def _start_session(self) -> None:
+        for index in range(len(self._buffs)):
+            if not self._lengths[index]:  # neither waiting nor being written
+                break
+        else:
+            self._dropped_sessions += 1
+            return
+        self._recording = True
+        self._stopping = False
+        self._buff_index = index
+        self._buff = self._buffs[index]
+        self._start_ms = time.ticks_ms()
+        self._interval_start_ms = self._start_ms
+        self._start_voltage = 0
+        self._sample_count = 0
+        self._sample_sum = 0
+        self._sample_runs = 0
+        self._truncated = False
+        self._transition_count = 0
+
+    def _end_session(self) -> None:
+        self._recording = False
+        self._stopping = False
+        buff = self._buff
+        struct.pack_into(HEADER_FORMAT, buff, 0, RECORD_MAGIC, self._start_ms, self._start_voltage,
+                         self._interval_ms, self._stop_reason, FLAG_TRUNCATED if self._truncated else 0,
+                         self._transition_count, self._sample_count)
+        offset = HEADER_SIZE + 2 * self._sample_count
+        for i in range(self._transition_count):
+            struct.pack_into(TRANSITION_FORMAT, buff, offset, self._transitions[2 * i], self._transitions[2 * i + 1])
+            offset += TRANSITION_SIZE
+        self._lengths[self._buff_index] = offset
+
+    # Writes the next chunk of the ended sessions to flash. Returns True if there is more to write.
+    def flush_one(self) -> bool:
+        if self._write_index < 0:
+            for index in range(len(self._lengths)):
+                if self._lengths[index]:
+                    break
+            else:
+                return False
+            self._write_index = index
+            self._write_offset = 0
+            self._open_segment(self._lengths[index])
+        index = self._write_index
+        length = self._lengths[index]
+        end = min(self._write_offset + WRITE_CHUNK_BYTES, length)
+        self._file.write(memoryview(self._buffs[index])[self._write_offset:end])
+        self._total_bytes += end - self._write_offset
+        self._write_offset = end
+        if end < length:
+            return True
+        self._file.close()
+        self._file = None
+        self._lengths[index] = 0
+        self._write_index = -1
+        return self.pending > 0
+
+    # Opens the segment file to append a session of the given size to, starting a new segment (and deleting the oldest
+    # ones) if needed
+    def _open_segment(self, length: int) -> None:
+        if self._new_segment or self._segment_size(self._segments[-1]) + length > self._segment_max_bytes:
+            self._new_segment = False
+            while self._segments and self._total_bytes + self._segment_max_bytes > self._max_bytes:
+                oldest = self._segments.pop(0)
+                self._total_bytes -= self._segment_size(oldest)
+                os.remove(self._segment_path(oldest))
+            self._segments.append(self._segments[-1] + 1 if self._segments else 0)
+        self._file = open(self._segment_path(self._segments[-1]), 'ab')
+
+
+# A recorded session, as read back by read_sessions()
+class Session:
+    def __init__(self, start_ms, start_voltage, interval_ms, stop_reason, flags, transitions, samples):
+        self.start_ms = start_ms
+        self.start_voltage = start_voltage
+        self.interval_ms = interval_ms
+        self.stop_reason = stop_reason
+        self.flags = flags
+        self.transitions = transitions  # (time since start [ms], event id)
+        self.samples = samples
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.flags & FLAG_TRUNCATED)
+
+    # Time of the first transition to the state with the given event id, or None
+    def transition_ms(self, event: int):
+        for at_ms, transition_event in self.transitions:
+            if transition_event == event:
+                return at_ms
+        return None
+
+
+# Parses the sessions of a segment file's content. A partial record at the end (power lost while writing) is ignored.
+def read_sessions(data) -> list:
+    sessions = []
+    offset = 0
+    while offset + HEADER_SIZE <= len(data):
+        magic, start_ms, start_voltage, interval_ms, stop_reason, flags, transition_count, sample_count = \
+            struct.unpack_from(HEADER_FORMAT, data, offset)
+        end = offset + HEADER_SIZE + 2 * sample_count + TRANSITION_SIZE * transition_count
+        if magic != RECORD_MAGIC or end > len(data):
+            break
+        offset += HEADER_SIZE
+        samples = list(struct.unpack_from('<{}H'.format(sample_count), data, offset))
+        offset += 2 * sample_count
+        transitions = []
+        for _ in range(transition_count):
+            transitions.append(struct.unpack_from(TRANSITION_FORMAT, data, offset))
+            offset += TRANSITION_SIZE
+        sessions.append(Session(start_ms, start_voltage, interval_ms, stop_reason, flags, transitions, samples))
+    return sessions
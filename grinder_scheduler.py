@@ -0,0 +1,75 @@
+import time
+
+from grinder_histogram import GrinderHistogram
+
+# Below this amount of slack, busy wait for the deadline instead of sleeping
+SPIN_MARGIN_US = 200
+# Minimum slack for running the idle task once more; needs to cover its worst case duration
+IDLE_MARGIN_US = 500
+
+
+# Runs a task at a fixed rate using a deadline loop, instead of as fast as possible.
+# Deadlines are derived from the previous deadline, not from the time the task actually ran, so jitter does not
+# accumulate. Lateness of each task start relative to its deadline ("jitter") is collected in a histogram.
+# If a run takes so long that one or more deadlines pass completely, those are counted as missed and skipped, instead of
+# trying to catch up with a burst of runs.
+# Optionally, an idle task (e.g. flushing the log) uses the slack before a deadline. It is called repeatedly while it
+# returns True (i.e. has more work) and enough slack is left.
+class GrinderScheduler:
+    def __init__(self, period_us: int, jitter_bucket_us=10, jitter_buckets=50):
+        self._period_us = period_us
+        self._jitter = GrinderHistogram(jitter_bucket_us, jitter_buckets)
+        self._missed_deadlines = 0
+        self._next_deadline = time.ticks_us()
+
+    @property
+    def period_us(self) -> int:
+        return self._period_us
+
+    @property
+    def jitter(self) -> GrinderHistogram:
+        return self._jitter
+
+    @property
+    def missed_deadlines(self) -> int:
+        return self._missed_deadlines
+
+    def reset_stats(self) -> None:
+        self._jitter.reset()
+        self._missed_deadlines = 0
+
+    def stats(self) -> str:
+        return 'Loop period {}us; jitter [us]: {}; missed deadlines: {}'.format(
+            self._period_us, self._jitter.summary(), self._missed_deadlines)
+
+    # Restarts the deadlines from now, e.g. after deliberately sleeping for longer than a period, which would otherwise
+    # count as missed deadlines
+    def resync(self) -> None:
+        self._next_deadline = time.ticks_us()
+
+    # Waits for the next deadline and runs the task once
+    def run_once(self, task, idle=None) -> None:
+        slack = time.ticks_diff(self._next_deadline, time.ticks_us())
+        if idle is not None:
+            while slack > IDLE_MARGIN_US and idle():
+                slack = time.ticks_diff(self._next_deadline, time.ticks_us())
+        if slack > SPIN_MARGIN_US:
+            time.sleep_us(slack - SPIN_MARGIN_US)
+        while time.ticks_diff(self._next_deadline, time.ticks_us()) > 0:
+            pass
+
+        lateness = time.ticks_diff(time.ticks_us(), self._next_deadline)
+        if lateness >= self._period_us:
+            missed = lateness // self._period_us
+            self._missed_deadlines += missed
+            self._next_deadline = time.ticks_add(self._next_deadline, missed * self._period_us)
+            lateness -= missed * self._period_us
+        self._jitter.add(lateness)
+        self._next_deadline = time.ticks_add(self._next_deadline, self._period_us)
+
+        task()
+
+    def run_forever(self, task, idle=None) -> None:
+        self._next_deadline = time.ticks_us()
+        while True:
+            self.run_once(task, idle)
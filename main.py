@@ -1,14 +1,37 @@
 import time
 
+# Time taken by the imports below, i.e. by compiling (for .py) and loading all modules; see --mpy of
+# tools/create_littlefs_image.py
+_import_start = time.ticks_ms()
 from machine import Pin
+from grinder_calibration import GrinderCalibration
 from grinder_controller import GrinderController
 from grinder_hardware import GrinderHardware
+from grinder_log import LOG
+from grinder_profiler import GrinderProfiler
+from grinder_recorder import GrinderRecorder
+from grinder_scheduler import GrinderScheduler
+_import_ms = time.ticks_diff(time.ticks_ms(), _import_start)
+
+# Use cooperative tasks instead of a single control loop. LOOP_PERIOD_US does not apply then.
+ASYNC_CONTROLLER = False
+# Run the control loop at a fixed rate. 0 runs it as fast as possible instead.
+LOOP_PERIOD_US = 2000
+# Number of loop runs after which scheduler statistics are logged
+SCHEDULER_STATS_RUNS = 5000
+# Time the stages of each control loop run. Send 'p' over the serial console to print the statistics, 'r' to reset them.
+PROFILING_ENABLED = False
+# Record grind sessions to flash (see GrinderRecorder)
+RECORDER_ENABLED = True
+# Learn the stop and charging thresholds from the grind sessions (see GrinderCalibration)
+CALIBRATION_ENABLED = True
 
 
 def say_hi():
     led = Pin(25, Pin.OUT, value=0)
     led.value(1)
     GrinderController.log("Hi")
+    GrinderController.log("Imports took {}ms".format(_import_ms))
     time.sleep(0.5)
     led.value(0)
     time.sleep(0.5)
@@ -17,10 +40,31 @@ def say_hi():
 
 def main():
     say_hi()
+    profiler = GrinderProfiler() if PROFILING_ENABLED else None
+    recorder = GrinderRecorder() if RECORDER_ENABLED else None
+    calibration = GrinderCalibration() if CALIBRATION_ENABLED else None
+    if ASYNC_CONTROLLER:
+        from grinder_controller_async import AsyncGrinderController, AsyncGrinderHardware
+        AsyncGrinderController(AsyncGrinderHardware(), profiler, recorder, calibration).run_forever()
+
     hw = GrinderHardware()
-    ctrl = GrinderController(hw)
+    if LOOP_PERIOD_US <= 0:
+        ctrl = GrinderController(hw, profiler, recorder=recorder, calibration=calibration)
+        while True:
+            ctrl.run()
+            LOG.flush_one()
+
+    scheduler = GrinderScheduler(LOOP_PERIOD_US)
+    ctrl = GrinderController(hw, profiler, scheduler, recorder, calibration)
+    # Bound methods are allocated on each access on MicroPython
+    run = ctrl.run
+    flush_log = LOG.flush_one
     while True:
-        ctrl.run()
+        for _ in range(SCHEDULER_STATS_RUNS):
+            scheduler.run_once(run, flush_log)
+        GrinderController.log(scheduler.stats())
+        GrinderController.log(ctrl.gc.stats())
+        scheduler.reset_stats()
 
 
 if __name__ == '__main__':
@@ -53,7 +53,8 @@ DMA_CHAN_REGS = {
     "WRITE_ADDR_REG":      0x04|UINT32,
     "TRANS_COUNT_REG":     0x08|UINT32,
     "CTRL_TRIG_REG":       0x0c|UINT32,
-    "CTRL_TRIG":          (0x0c,DMA_CTRL_TRIG_FIELDS)
+    "CTRL_TRIG":          (0x0c,DMA_CTRL_TRIG_FIELDS),
+    "AL1_CTRL_REG":        0x10|UINT32
 }
 
 # General DMA registers
@@ -0,0 +1,97 @@
+# Arbitration of the RP2040's DMA resources between their users – channels and the single, global sniffer.
+#
+# Channels are claimed either as a specific channel number or as "any free channel". If MicroPython provides rp2.DMA
+# (v1.21+), "any free channel" claims go through it, i.e. through the Pico SDK's dma_claim_unused_channel(), so they
+# cannot clash with channels used by the SDK itself (e.g. for SPI or I2S). Specific channel numbers are only checked
+# against the claims made through this module.
+# The sniffer can only observe one channel at a time, so it is claimed on behalf of a channel, and only by its owner.
+import rp_devices as devs
+
+try:
+    import rp2
+    _SdkDma = rp2.DMA
+except (ImportError, AttributeError):
+    _SdkDma = None
+
+DMA_CHAN_COUNT = len(devs.DMA_CHANS)
+
+_claimed_mask = 0
+_sdk_claims = {}  # channel number -> rp2.DMA object holding the SDK claim
+_sniffer_channel = -1
+
+
+def claim_channel(channel=None) -> int:
+    global _claimed_mask
+    if channel is None:
+        channel = _claim_any_channel()
+    elif not 0 <= channel < DMA_CHAN_COUNT:
+        raise ValueError('invalid DMA channel {}'.format(channel))
+    elif _claimed_mask & (1 << channel):
+        raise RuntimeError('DMA channel {} already claimed'.format(channel))
+    _claimed_mask |= 1 << channel
+    return channel
+
+
+def _claim_any_channel() -> int:
+    if _SdkDma is not None:
+        try:
+            sdk_dma = _SdkDma()
+        except OSError:
+            raise RuntimeError('no free DMA channel')
+        channel = sdk_dma.channel
+        if not _claimed_mask & (1 << channel):
+            _sdk_claims[channel] = sdk_dma
+            return channel
+        # Claimed by a specific number through this module before, unknown to the SDK – keep it from the SDK as well
+        _sdk_claims[-channel - 1] = sdk_dma
+        return _claim_any_channel()
+    for channel in range(DMA_CHAN_COUNT):
+        if not _claimed_mask & (1 << channel):
+            return channel
+    raise RuntimeError('no free DMA channel')
+
+
+def release_channel(channel: int) -> None:
+    global _claimed_mask
+    if channel == _sniffer_channel:
+        release_sniffer(channel)
+    _claimed_mask &= ~(1 << channel)
+    for key in (channel, -channel - 1):
+        sdk_dma = _sdk_claims.pop(key, None)
+        if sdk_dma is not None:
+            sdk_dma.close()
+
+
+def is_claimed(channel: int) -> bool:
+    return bool(_claimed_mask & (1 << channel))
+
+
+# Claims the sniffer for observing the given (claimed) channel
+def claim_sniffer(channel: int) -> None:
+    global _sniffer_channel
+    if not is_claimed(channel):
+        raise ValueError('DMA channel {} not claimed'.format(channel))
+    if _sniffer_channel >= 0 and _sniffer_channel != channel:
+        raise RuntimeError('DMA sniffer already in use by channel {}'.format(_sniffer_channel))
+    _sniffer_channel = channel
+
+
+def release_sniffer(channel: int) -> None:
+    global _sniffer_channel
+    if _sniffer_channel == channel:
+        devs.DMA_DEVICE.SNIFF_CTRL_REG = 0
+        _sniffer_channel = -1
+
+
+def sniffer_channel() -> int:
+    return _sniffer_channel
+
+
+# Releases everything, e.g. after a (simulated) reset of the chip
+def release_all() -> None:
+    global _claimed_mask, _sniffer_channel
+    for sdk_dma in _sdk_claims.values():
+        sdk_dma.close()
+    _sdk_claims.clear()
+    _claimed_mask = 0
+    _sniffer_channel = -1
@@ -0,0 +1,81 @@
+# Behavioural stand-ins for the DMA captures of RP2040ADC, used by GrinderSimulation unless register_adc is set.
+# Setup and configuration are inherited, i.e. still done on the modelled registers. Only the per-run calls are
+# replaced: A capture takes the same virtual time as on the register-level model, and once it is complete, its average
+# comes straight from the scripted input of rp2040_model's ADC (with its noise) – no DMA channel is stepped, no buffer
+# written or summed up. Polling costs one bus access per call, so busy-wait loops still terminate.
+# The register-level model is exercised by test_rp2040_adc.py, and by the simulation with register_adc=True.
+import rp2040_model
+from RP2040ADC import Rp2040AdcDmaAveraging, Rp2040AdcDmaPingPong
+
+
+def _charge_access() -> None:
+    chip = rp2040_model.CHIP
+    chip.clock.advance_ns(chip.bus.access_cost_ns)
+
+
+class BehaviouralAdcDmaAveraging(Rp2040AdcDmaAveraging):
+    def __init__(self, *args, **kwargs):
+        self._done_ns = 0
+        super().__init__(*args, **kwargs)
+
+    def capture_start(self) -> None:
+        _charge_access()
+        self._done_ns = rp2040_model.CHIP.clock.now_ns + self.capture_time_us * 1000
+
+    def capture_busy(self) -> bool:
+        _charge_access()
+        return rp2040_model.CHIP.clock.now_ns < self._done_ns
+
+    def _wait(self) -> None:
+        clock = rp2040_model.CHIP.clock
+        clock.advance_ns(max(self._done_ns - clock.now_ns, 0))
+
+    def _sum(self) -> int:
+        return rp2040_model.CHIP.adc.sum_samples_of(self._adc_channel, self._capture_samples)
+
+    def read_average_u12(self) -> int:
+        return self._sum() // self._capture_samples
+
+    def wait_and_read_average_u12(self) -> int:
+        self._wait()
+        return self.read_average_u12()
+
+    def read_average_u16(self) -> int:
+        return (self._sum() << 4) // self._capture_samples
+
+    def wait_and_read_average_u16(self) -> int:
+        self._wait()
+        return self.read_average_u16()
+
+
+class BehaviouralAdcDmaPingPong(Rp2040AdcDmaPingPong):
+    def __init__(self, *args, **kwargs):
+        self._start_ns = None  # start of the free-running capture, None: stopped
+        self._period_ns = 0
+        self._buffer = -1  # number of the buffer the average is taken from, counted from the start
+        self._average = 0
+        super().__init__(*args, **kwargs)
+
+    # Blocks until the first buffer is filled, as the original
+    def capture_start(self) -> None:
+        _charge_access()
+        clock = rp2040_model.CHIP.clock
+        self._start_ns = clock.now_ns
+        self._period_ns = max(self.capture_time_us, 1) * 1000
+        self._buffer = -1
+        clock.advance_ns(self._period_ns)
+
+    def capture_stop(self) -> None:
+        _charge_access()
+        self._start_ns = None
+
+    def read_latest_average_u12(self) -> int:
+        _charge_access()
+        if self._start_ns is None:
+            return self._average  # as the buffers are left by the last capture
+        buffer = (rp2040_model.CHIP.clock.now_ns - self._start_ns) // self._period_ns
+        if buffer != self._buffer:
+            self._buffer = buffer
+            self._average = rp2040_model.CHIP.adc.sum_samples_of(self._adc_channel, self._adc_samples) \
+                // self._adc_samples
+        return self._average
@@ -0,0 +1,378 @@
+# Host-side simulation harness for the whole controller stack.
+# Runs the unmodified GrinderController, its states and GrinderHardware under CPython, using the fake machine, uctypes
+# and micropython modules in this directory together with the simulated RP2040 of rp2040_model, and a virtual clock
+# instead of the real one. Inputs (button, battery voltage) are scripted with timestamps in virtual time.
+#
+# Usage:
+#   sim = GrinderSimulation(voltage=2000)
+#   sim.press_button(at_ms=100, duration_ms=200)
+#   sim.set_voltage(at_ms=3000, voltage=2300)
+#   sim.run_until(5000)
+#   print(sim.transitions)
+# AsyncGrinderSimulation does the same for AsyncGrinderController.
+#
+# The ADC captures are behavioural by default (see behavioural_adc): each reading returns the scripted voltage once its
+# capture is complete, without stepping the DMA model. register_adc=True runs RP2040ADC's captures on the register-level
+# model instead – much slower, for when the DMA and ADC registers themselves are under test.
+import asyncio
+import gc
+import heapq
+import math
+import os
+import selectors
+import sys
+import time
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SIM_DIR)
+
+_active_simulation = None
+
+
+def _chip():
+    import rp2040_model
+    return rp2040_model.CHIP
+
+
+def _ticks_ms():
+    return _chip().clock.ticks_ms()
+
+
+def _ticks_us():
+    return _chip().clock.ticks_us()
+
+
+def _ticks_cpu():
+    return _chip().clock.ticks_cpu()
+
+
+def _sleep_ms(ms):
+    _chip().clock.sleep_ms(ms)
+
+
+def _sleep_us(us):
+    _chip().clock.sleep_us(us)
+
+
+def _log(s: str) -> None:
+    if _active_simulation is not None:
+        _active_simulation.log_lines.append((_active_simulation.now_ms, s))
+
+
+def _mem_alloc():
+    return 0
+
+
+def _mem_free():
+    return 0
+
+
+# Makes the fake modules importable and adds MicroPython's time functions (on the virtual clock) to CPython's time
+# module. Only additions – CPython's own time functions keep working. The heap is not simulated, gc.mem_alloc() and
+# gc.mem_free() just exist.
+def install() -> None:
+    for path in (REPO_DIR, SIM_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    import rp2040_model
+    time.ticks_ms = _ticks_ms
+    time.ticks_us = _ticks_us
+    time.ticks_cpu = _ticks_cpu
+    time.ticks_diff = rp2040_model.VirtualClock.ticks_diff
+    time.ticks_add = rp2040_model.VirtualClock.ticks_add
+    time.sleep_ms = _sleep_ms
+    time.sleep_us = _sleep_us
+    if not hasattr(gc, 'mem_alloc'):
+        gc.mem_alloc = _mem_alloc
+        gc.mem_free = _mem_free
+
+
+class GrinderSimulation:
+    def __init__(self, voltage=3456, loop_cost_us=100, noise=0, seed=0, capture_log=True, profiler=None,
+                 recorder=None, calibration=None, register_adc=False):
+        global _active_simulation
+        install()
+        import rp2040_model
+        import grinder_hardware
+        import grinder_log
+        from grinder_controller import GrinderController
+
+        self.chip = rp2040_model.reset()
+        self.chip.adc.set_noise(noise, seed)
+        self._hw_module = grinder_hardware
+        self._voltage_channel = grinder_hardware.VOLTAGE_PIN - 26
+        self.chip.adc.values[self._voltage_channel] = voltage
+        self.chip.gpio.inputs[grinder_hardware.BUTTON_PIN] = 1  # pulled up, i.e. released
+
+        self.loop_cost_us = loop_cost_us
+        self._register_adc = register_adc
+        self.log_lines = []
+        self.transitions = []
+        self._events = []
+        self._event_seq = 0
+
+        _active_simulation = self
+        if capture_log:
+            GrinderController.log = staticmethod(_log)
+        self._log_module = grinder_log
+        self._log_record = [0] * grinder_log.RECORD_WORDS
+        self._capture_log = capture_log
+        grinder_log.LOG = grinder_log.GrinderLog()
+
+        self._create_controller(profiler, recorder, calibration)
+        self._last_state = type(self.ctrl.state).__name__
+        self.transitions.append((self.now_ms, self._last_state))
+
+    def _create_controller(self, profiler, recorder, calibration) -> None:
+        from grinder_controller import GrinderController
+        from grinder_hardware import GrinderHardware
+        self.hw = self._create_hardware(GrinderHardware)
+        self.ctrl = GrinderController(self.hw, profiler, recorder=recorder, calibration=calibration)
+
+    # Constructs the hardware with the captures of behavioural_adc instead of RP2040ADC's, unless register_adc is set
+    def _create_hardware(self, hardware_class):
+        if self._register_adc:
+            return hardware_class()
+        import behavioural_adc
+        hw_module = self._hw_module
+        originals = hw_module.Rp2040AdcDmaAveraging, hw_module.Rp2040AdcDmaPingPong
+        hw_module.Rp2040AdcDmaAveraging = behavioural_adc.BehaviouralAdcDmaAveraging
+        hw_module.Rp2040AdcDmaPingPong = behavioural_adc.BehaviouralAdcDmaPingPong
+        try:
+            return hardware_class()
+        finally:
+            hw_module.Rp2040AdcDmaAveraging, hw_module.Rp2040AdcDmaPingPong = originals
+
+    @property
+    def now_ms(self) -> int:
+        return self.chip.clock.now_ns // 1000000
+
+    @property
+    def now_us(self) -> int:
+        return self.chip.clock.now_ns // 1000
+
+    @property
+    def state_name(self) -> str:
+        return type(self.ctrl.state).__name__
+
+    @property
+    def voltage(self) -> int:
+        return self.chip.adc.values[self._voltage_channel]
+
+    @property
+    def motor_running(self) -> bool:
+        return self.chip.gpio.outputs.get(self._hw_module.MOTOR_FET_PIN, 0) == 1
+
+    @property
+    def jack_enabled(self) -> bool:
+        return self.chip.gpio.outputs.get(self._hw_module.JACK_FET_PIN, 0) == 0
+
+    # Scripted inputs
+
+    def _schedule(self, at_ms: int, action, value) -> None:
+        heapq.heappush(self._events, (int(at_ms * 1000000), self._event_seq, action, value))
+        self._event_seq += 1
+        self.chip.next_event_ns = self._events[0][0]
+
+    def set_voltage(self, at_ms: int, voltage: int) -> None:
+        self._schedule(at_ms, self._apply_voltage, voltage)
+
+    def set_button(self, at_ms: int, pressed: bool) -> None:
+        self._schedule(at_ms, self._apply_button, pressed)
+
+    def press_button(self, at_ms: int, duration_ms: int) -> None:
+        self.set_button(at_ms, True)
+        self.set_button(at_ms + duration_ms, False)
+
+    # Schedules a voltage trace given as (time in ms, voltage) pairs, e.g. from a recording
+    def set_voltage_trace(self, trace, offset_ms=0) -> None:
+        for at_ms, voltage in trace:
+            self.set_voltage(offset_ms + at_ms, voltage)
+
+    def _apply_voltage(self, voltage: int) -> None:
+        self.chip.adc.values[self._voltage_channel] = voltage
+
+    def _apply_button(self, pressed: bool) -> None:
+        self.chip.gpio.set_input(self._hw_module.BUTTON_PIN, 0 if pressed else 1)
+
+    def _apply_due_events(self) -> None:
+        now = self.chip.clock.now_ns
+        while self._events and self._events[0][0] <= now:
+            _, _, action, value = heapq.heappop(self._events)
+            action(value)
+        self.chip.next_event_ns = self._events[0][0] if self._events else None
+
+    # Moves the records of the deferred log (see GrinderLog) into log_lines
+    def _drain_log(self) -> None:
+        log = self._log_module.LOG
+        while log.read_record(self._log_record):
+            self.log_lines.append((self.now_ms, self._log_module.format_message(self._log_record)))
+
+    # Running
+
+    def step(self) -> None:
+        self._apply_due_events()
+        self.ctrl.run()
+        if self._capture_log:
+            self._drain_log()
+        self.chip.clock.advance_us(self.loop_cost_us)
+        self._track_state()
+
+    def _track_state(self) -> None:
+        state = type(self.ctrl.state).__name__
+        if state != self._last_state:
+            self._last_state = state
+            self.transitions.append((self.now_ms, state))
+
+    def run_until(self, at_ms: int) -> None:
+        end_ns = at_ms * 1000000
+        while self.chip.clock.now_ns < end_ns:
+            self.step()
+
+    def run_for(self, duration_ms: int) -> None:
+        self.run_until(self.now_ms + duration_ms)
+
+    # Runs until the given state is entered (returns True) or the timeout has passed (returns False)
+    def run_until_state(self, state_name: str, timeout_ms: int) -> bool:
+        end_ns = self.chip.clock.now_ns + timeout_ms * 1000000
+        while self.chip.clock.now_ns < end_ns:
+            self.step()
+            if self._last_state == state_name:
+                return True
+        return False
+
+
+# Selector of _VirtualEventLoop: Instead of blocking until its timeout (the next timer of the loop), advances the
+# virtual clock to it. Each pass of the loop – the task steps run before it – costs loop_cost_us of the simulation,
+# which also gets to apply its scripted inputs.
+class _VirtualSelector(selectors.DefaultSelector):
+    def __init__(self, simulation):
+        super().__init__()
+        self._simulation = simulation
+
+    def select(self, timeout=None):
+        self._simulation._on_loop_pass(timeout)
+        return super().select(0)
+
+
+# asyncio event loop on the virtual clock
+class _VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, simulation):
+        super().__init__(_VirtualSelector(simulation))
+        self._virtual_clock = simulation.chip.clock
+
+    def time(self) -> float:
+        return self._virtual_clock.now_ns / 1000000000
+
+
+# Runs AsyncGrinderController with AsyncGrinderHardware instead, its tasks on an asyncio event loop on the virtual
+# clock. loop_cost_us is the cost of one pass of the event loop here, i.e. of the task steps run in it. Tasks given
+# to add_task() run as well.
+class AsyncGrinderSimulation(GrinderSimulation):
+    def __init__(self, voltage=3456, loop_cost_us=20, noise=0, seed=0, capture_log=True, profiler=None,
+                 recorder=None, calibration=None, register_adc=False):
+        super().__init__(voltage, loop_cost_us, noise, seed, capture_log, profiler, recorder, calibration, register_adc)
+        self._loop = _VirtualEventLoop(self)
+        self._main_task = None
+        self._wanted_state = None  # (state name, future) of run_until_state()
+
+    def _create_controller(self, profiler, recorder, calibration) -> None:
+        from grinder_controller_async import AsyncGrinderController, AsyncGrinderHardware
+        self.hw = self._create_hardware(AsyncGrinderHardware)
+        self.ctrl = AsyncGrinderController(self.hw, profiler, recorder, calibration)
+
+    # Adds a coroutine to run along with the controller's tasks, see AsyncGrinderController.add_task(). Only before
+    # running.
+    def add_task(self, coro) -> None:
+        self.ctrl.add_task(coro)
+
+    def close(self) -> None:
+        if self._main_task is not None:
+            self._main_task.cancel()
+            self._loop.run_until_complete(asyncio.gather(self._main_task, return_exceptions=True))
+        self._loop.close()
+
+    def _on_loop_pass(self, timeout) -> None:
+        self._apply_due_events()
+        if self._capture_log:
+            self._drain_log()
+        self._track_state()
+        cost_ns = self.loop_cost_us * 1000
+        if timeout is not None:
+            cost_ns = max(cost_ns, math.ceil(timeout * 1000000000))
+        self.chip.clock.advance_ns(cost_ns)
+
+    def _track_state(self) -> None:
+        super()._track_state()
+        if self._wanted_state is not None and self._last_state == self._wanted_state[0]:
+            if not self._wanted_state[1].done():
+                self._wanted_state[1].set_result(True)
+
+    # Runs the event loop until the given future is done (returns its result) or the timeout has passed (returns
+    # False)
+    def _run(self, future, timeout_ns: int):
+        if self._main_task is None:
+            self._main_task = self._loop.create_task(self.ctrl._main())
+        waiter = self._loop.create_task(asyncio.wait_for(future, timeout_ns / 1000000000))
+        # Stops early if a task of the controller failed
+        self._loop.run_until_complete(asyncio.wait((waiter, self._main_task), return_when=asyncio.FIRST_COMPLETED))
+        if self._main_task.done():
+            waiter.cancel()
+            self._main_task.result()
+        try:
+            return waiter.result()
+        except asyncio.TimeoutError:
+            return False
+
+    # The event loop has no single steps – runs it for a millisecond
+    def step(self) -> None:
+        self.run_until(self.now_ms + 1)
+
+    def run_until(self, at_ms: int) -> None:
+        self._run(self._loop.create_future(), max(0, at_ms * 1000000 - self.chip.clock.now_ns))
+
+    def run_until_state(self, state_name: str, timeout_ms: int) -> bool:
+        future = self._loop.create_future()
+        self._wanted_state = (state_name, future)
+        try:
+            return self._run(future, timeout_ms * 1000000)
+        finally:
+            self._wanted_state = None
+
+
+# What the harness was built for: thousands of simulated grind sessions per second
+BENCHMARK_TARGET_SESSIONS_PER_S = 1000
+
+
+# Simple benchmark: Runs a number of automatic grind sessions (about 3s each) and returns the sessions per second and
+# how much faster than real time this is. Each session takes about 3000ms / loop_cost_us runs of the controller, which
+# bound the rate – compare against BENCHMARK_TARGET_SESSIONS_PER_S with large loop costs only.
+def benchmark(sessions: int, loop_cost_us=1000, register_adc=False) -> tuple:
+    start = time.perf_counter()
+    simulated_ms = 0
+    for session in range(sessions):
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=loop_cost_us, noise=2, register_adc=register_adc)
+        sim.press_button(at_ms=100, duration_ms=200)
+        sim.set_voltage(at_ms=3000 + 10 * session, voltage=2300)
+        sim.run_until_state('AutoGrindState', timeout_ms=1000)
+        sim.run_until_state('IdleState', timeout_ms=10000)
+        simulated_ms += sim.now_ms
+    elapsed = time.perf_counter() - start
+    return sessions / elapsed, simulated_ms / 1000 / elapsed
+
+
+def main() -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark simulated grind sessions')
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--loop-cost-us', type=int, default=1000, help='virtual time charged per control loop run')
+    parser.add_argument('--register-adc', action='store_true', help='run the captures on the register-level model')
+    args = parser.parse_args()
+    sessions_per_s, speedup = benchmark(args.sessions, args.loop_cost_us, args.register_adc)
+    print('{} sessions: {:.1f} sessions/s ({:.1f}% of the target of {} sessions/s), {:.1f}x real time'.format(
+        args.sessions, sessions_per_s, 100 * sessions_per_s / BENCHMARK_TARGET_SESSIONS_PER_S,
+        BENCHMARK_TARGET_SESSIONS_PER_S, speedup))
+
+
+if __name__ == '__main__':
+    main()
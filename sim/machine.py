@@ -0,0 +1,124 @@
+# Fake machine module for running on CPython, backed by the simulated RP2040 in rp2040_model
+import rp2040_model
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin_id, mode=IN, pull=None, value=None):
+        self._id = pin_id
+        self._mode = mode
+        self._pull = pull
+        if value is not None:
+            self.value(value)
+
+    @property
+    def id(self) -> int:
+        return self._id
+
+    def value(self, value=None):
+        gpio = rp2040_model.CHIP.gpio
+        if value is None:
+            if self._mode == Pin.OUT:
+                return gpio.outputs.get(self._id, 0)
+            return gpio.inputs.get(self._id, 1 if self._pull == Pin.PULL_UP else 0)
+        gpio.outputs[self._id] = 1 if value else 0
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        rp2040_model.CHIP.gpio.irqs[self._id] = (handler, trigger, self)
+
+
+class ADC:
+    CORE_TEMP = 4
+
+    def __init__(self, pin):
+        pin_id = pin.id if isinstance(pin, Pin) else pin
+        self._channel = pin_id - 26 if pin_id >= 26 else pin_id
+        adc = rp2040_model.CHIP.adc
+        adc.cs |= 1  # EN
+
+    def read_u16(self) -> int:
+        adc = rp2040_model.CHIP.adc
+        adc.cs = (adc.cs & ~(0x7 << 12)) | (self._channel << 12)
+        value = adc.next_sample()
+        return value << 4 | value >> 8
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, timer_id=-1, mode=PERIODIC, freq=-1, period=-1, callback=None):
+        self._mode = mode
+        self._period_ns = 0
+        self._callback = None
+        self.next_ns = 0
+        if callback is not None:
+            self.init(mode=mode, freq=freq, period=period, callback=callback)
+
+    def init(self, mode=PERIODIC, freq=-1, period=-1, callback=None):
+        clock = rp2040_model.CHIP.clock
+        self._mode = mode
+        self._period_ns = 1000000000 // freq if freq > 0 else period * 1000000
+        self._callback = callback
+        self.next_ns = clock.now_ns + self._period_ns
+        clock.add_timer(self)
+
+    def deinit(self):
+        rp2040_model.CHIP.clock.remove_timer(self)
+
+    def fire(self):
+        if self._mode == Timer.PERIODIC:
+            self.next_ns += self._period_ns
+        else:
+            self.deinit()
+        if self._callback is not None:
+            self._callback(self)
+
+
+class _Mem:
+    def __getitem__(self, address):
+        return rp2040_model.CHIP.bus.read32(address)
+
+    def __setitem__(self, address, value):
+        rp2040_model.CHIP.bus.write32(address, value)
+
+
+mem32 = _Mem()
+
+
+def freq(hz=None):
+    return 125000000
+
+
+def idle():
+    rp2040_model.CHIP.clock.advance_us(1)
+
+
+def lightsleep(time_ms=None):
+    # Wakes up early if a pin interrupt is scheduled by the simulation harness
+    chip = rp2040_model.CHIP
+    chip.clock.advance_ns(chip.wake_ns(time_ms))
+
+
+def unique_id() -> bytes:
+    return b'\x00' * 8
+
+
+def reset():
+    raise SystemExit('machine.reset()')
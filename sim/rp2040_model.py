@@ -0,0 +1,550 @@
+# Minimal behavioural model of the RP2040 parts used by GrinderController, for running it under CPython.
+# Only what the controller actually touches is modelled: a virtual clock, memory-mapped ADC and DMA (incl. chaining,
+# write address rings and the sniffer), GPIO levels and pin interrupts. Everything else on the bus is plain storage.
+#
+# The virtual clock only advances when something "costs" time: each register access, each ticks_*() call, sleeps and
+# whatever the simulation harness charges per control loop run. That way busy-wait loops terminate as they do on the
+# device, while the whole simulation runs much faster than real time.
+import array
+import ctypes
+import random
+import sys
+
+ADC_BASE = 0x4004c000
+ADC_SIZE = 0x24
+ADC_CLOCK_HZ = 48000000
+ADC_MIN_CYCLES = 96
+ADC_CHANNELS = 5
+DMA_BASE = 0x50000000
+DMA_SIZE = 0x800
+DMA_CHAN_WIDTH = 0x40
+DMA_CHAN_COUNT = 12
+DREQ_ADC = 36
+RAM_BASE = 0x20000000
+RAM_END = 0x30000000
+
+_ARRAY_TYPES = {1: 'B', 2: 'H', 4: 'L'}
+NOISE_TABLE_SIZE = 4093  # prime, to avoid lining up with buffer sizes
+_NOISE_TABLES = {}  # (sigma, seed) -> table, see AdcModel.set_noise()
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+class VirtualClock:
+    def __init__(self, read_cost_ns=1000):
+        self.now_ns = 0
+        self.read_cost_ns = read_cost_ns
+        self._timers = []
+
+    def advance_ns(self, ns: int) -> None:
+        target = self.now_ns + ns
+        while self._timers:
+            due = min(self._timers, key=lambda t: t.next_ns)
+            if due.next_ns > target:
+                break
+            self.now_ns = max(self.now_ns, due.next_ns)
+            due.fire()
+        self.now_ns = target
+
+    def advance_us(self, us: int) -> None:
+        self.advance_ns(us * 1000)
+
+    def add_timer(self, timer) -> None:
+        if timer not in self._timers:
+            self._timers.append(timer)
+
+    def remove_timer(self, timer) -> None:
+        if timer in self._timers:
+            self._timers.remove(timer)
+
+    # MicroPython time module API
+
+    def ticks_ms(self) -> int:
+        self.advance_ns(self.read_cost_ns)
+        return (self.now_ns // 1000000) & TICKS_MAX
+
+    def ticks_us(self) -> int:
+        self.advance_ns(self.read_cost_ns)
+        return (self.now_ns // 1000) & TICKS_MAX
+
+    def ticks_cpu(self) -> int:
+        return self.ticks_us()
+
+    @staticmethod
+    def ticks_diff(ticks1: int, ticks2: int) -> int:
+        return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+    @staticmethod
+    def ticks_add(ticks: int, delta: int) -> int:
+        return (ticks + delta) & TICKS_MAX
+
+    def sleep_ms(self, ms: int) -> None:
+        self.advance_ns(int(ms) * 1000000)
+
+    def sleep_us(self, us: int) -> None:
+        self.advance_ns(int(us) * 1000)
+
+
+# Plain RAM, i.e. Python buffers passed to uctypes.addressof(). Each buffer gets a fake bus address, so DMA writes end
+# up in the actual Python object.
+class Ram:
+    def __init__(self):
+        self._next_address = RAM_BASE
+        self._regions = {}  # id(root object) -> (bus address, host address, byte view, root object)
+
+    @staticmethod
+    def _host_address(obj) -> int:
+        view = memoryview(obj).cast('B')
+        return ctypes.addressof((ctypes.c_char * max(len(view), 1)).from_buffer(view))
+
+    def addressof(self, obj) -> int:
+        root = obj.obj if isinstance(obj, memoryview) else obj
+        region = self._regions.get(id(root))
+        if region is None:
+            view = memoryview(root).cast('B')
+            region = (self._next_address, self._host_address(root), view, root)
+            self._regions[id(root)] = region
+            self._next_address += (len(view) + 15) // 16 * 16 + 16  # 16 byte aligned like the MicroPython heap
+        if root is obj:
+            return region[0]
+        return region[0] + self._host_address(obj) - region[1]
+
+    def _find(self, address: int, size: int):
+        for bus_address, _, view, _ in self._regions.values():
+            if bus_address <= address and address + size <= bus_address + len(view):
+                return view, address - bus_address
+        raise MemoryError('simulated bus error at 0x{:08x}'.format(address))
+
+    def write_bytes(self, address: int, data: bytes) -> None:
+        view, offset = self._find(address, len(data))
+        view[offset:offset + len(data)] = data
+
+    def write(self, address: int, value: int, size: int) -> None:
+        view, offset = self._find(address, size)
+        view[offset:offset + size] = (value & ((1 << (8 * size)) - 1)).to_bytes(size, 'little')
+
+    def read(self, address: int, size: int) -> int:
+        view, offset = self._find(address, size)
+        return int.from_bytes(view[offset:offset + size], 'little')
+
+
+class AdcModel:
+    def __init__(self, clock: VirtualClock):
+        self._clock = clock
+        self.values = [0] * ADC_CHANNELS  # current input per channel, 12 bit
+        self._noise_table = []
+        self._noise_index = 0
+        self._table = []  # see _sample_table()
+        self._table_sum = 0
+        self._table_key = None
+        self.cs = 0
+        self.result = 0
+        self.fcs = 0
+        self.div = 0
+
+    # Adds gaussian noise with the given standard deviation to each sample. Drawn from a precomputed table, as
+    # generating random numbers for every simulated sample would be too slow. Tables are kept across resets, as
+    # generating one takes about as long as simulating a grind session.
+    def set_noise(self, sigma: float, seed=0) -> None:
+        table = _NOISE_TABLES.get((sigma, seed))
+        if table is None and sigma:
+            rng = random.Random(seed)
+            table = _NOISE_TABLES[(sigma, seed)] = [int(round(rng.gauss(0, sigma))) for _ in range(NOISE_TABLE_SIZE)]
+        self._noise_table = table or []
+        self._noise_index = 0
+        self._table_key = None
+
+    # The noise table applied to the given channel's input and clipped to 12 bits, so that taking samples is just
+    # slicing. Rebuilt when the input changes, which is rare compared to how often it is sampled.
+    def _sample_table(self, channel: int) -> list:
+        value = self.values[channel]
+        if self._table_key != (channel, value):
+            self._table = [min(max(value + noise, 0), 0xfff) for noise in self._noise_table]
+            self._table_sum = sum(self._table)
+            self._table_key = (channel, value)
+        return self._table
+
+    @property
+    def running(self) -> bool:
+        return bool(self.cs & 1 << 3) and bool(self.cs & 1)  # START_MANY and EN
+
+    @property
+    def sample_period_ns(self) -> int:
+        cycles = max(ADC_MIN_CYCLES, 1 + (self.div >> 8) + (self.div & 0xff) / 256)
+        return max(1, int(cycles * 1000000000 // ADC_CLOCK_HZ))
+
+    def next_sample(self) -> int:
+        channel = (self.cs >> 12) & 0x7
+        rrobin = (self.cs >> 16) & 0x1f
+        if rrobin:
+            # Advance AINSEL to the next channel enabled in the round robin mask
+            for step in range(1, ADC_CHANNELS + 1):
+                candidate = (channel + step) % ADC_CHANNELS
+                if rrobin & (1 << candidate):
+                    self.cs = (self.cs & ~(0x7 << 12)) | (candidate << 12)
+                    break
+        if self._noise_table:
+            return self.next_samples_of(channel, 1)[0]
+        return min(max(self.values[channel], 0), 0xfff)
+
+    def next_samples(self, count: int) -> list:
+        if (self.cs >> 16) & 0x1f:
+            return [self.next_sample() for _ in range(count)]
+        channel = (self.cs >> 12) & 0x7
+        if self._noise_table:
+            return self.next_samples_of(channel, count)
+        return [min(max(self.values[channel], 0), 0xfff)] * count
+
+    def next_samples_of(self, channel: int, count: int) -> list:
+        table = self._sample_table(channel)
+        start = self._noise_index
+        end = start + count
+        if end < NOISE_TABLE_SIZE:
+            self._noise_index = end
+            return table[start:end]
+        self._noise_index = end % NOISE_TABLE_SIZE
+        samples = table[start:]
+        while len(samples) < count:
+            samples += table[:count - len(samples)]
+        return samples
+
+    # Same as sum(next_samples(count)), but without building the list for long stretches of samples
+    def sum_samples(self, count: int) -> int:
+        if (self.cs >> 16) & 0x1f or count < NOISE_TABLE_SIZE:
+            return sum(self.next_samples(count))
+        return self.sum_samples_of((self.cs >> 12) & 0x7, count)
+
+    # Sum of the next samples of the given channel, regardless of AINSEL and round robin
+    def sum_samples_of(self, channel: int, count: int) -> int:
+        if not self._noise_table:
+            return min(max(self.values[channel], 0), 0xfff) * count
+        self._sample_table(channel)
+        cycles, rest = divmod(count, NOISE_TABLE_SIZE)
+        return cycles * self._table_sum + sum(self.next_samples_of(channel, rest))
+
+    # Same as next_samples(), for when the values are not needed
+    def skip_samples(self, count: int) -> None:
+        rrobin = (self.cs >> 16) & 0x1f
+        if rrobin:
+            enabled = bin(rrobin).count('1')
+            for _ in range(count % enabled):
+                self.next_sample()
+
+    def read(self, offset: int) -> int:
+        if offset == 0x00:
+            return self.cs | 1 << 8  # always READY
+        if offset == 0x04:
+            return self.result
+        if offset == 0x08:
+            return self.fcs | 1 << 8  # FIFO always EMPTY – the DMA model takes samples directly
+        if offset == 0x0c:
+            return self.next_sample()
+        if offset == 0x10:
+            return self.div
+        return 0
+
+    def write(self, offset: int, value: int) -> None:
+        if offset == 0x00:
+            if value & 1 << 2:  # START_ONCE
+                self.result = self.next_sample()
+            self.cs = value & ~((1 << 2) | (1 << 8))
+        elif offset == 0x08:
+            self.fcs = value
+        elif offset == 0x10:
+            self.div = value
+
+
+class DmaChannelModel:
+    def __init__(self, index: int):
+        self.index = index
+        self.read_addr = 0
+        self.write_addr = 0
+        self.reload = 0
+        self.remaining = 0
+        self.ctrl = 0
+        self.busy = False
+        self.progress_ns = 0  # time up to which transfers have been accounted for
+
+    # The fields of CTRL are decoded once on each write, not on each simulated transfer
+    @property
+    def ctrl(self) -> int:
+        return self._ctrl
+
+    @ctrl.setter
+    def ctrl(self, value: int) -> None:
+        self._ctrl = value
+        self.enabled = bool(value & 1)
+        self.size = 1 << self.field(2, 2)
+        self.incr_write = self.field(5, 1)
+        self.ring_bytes = 1 << self.field(6, 4) if self.field(10, 1) and self.field(6, 4) else 0
+        self.chain_to = self.field(11, 4)
+        self.adc_paced = self.field(15, 6) == DREQ_ADC
+        self.sniff_en = self.field(23, 1)
+
+    def field(self, pos: int, length: int) -> int:
+        return (self._ctrl >> pos) & ((1 << length) - 1)
+
+
+class DmaModel:
+    def __init__(self, clock: VirtualClock, adc: AdcModel, ram: Ram):
+        self._clock = clock
+        self._adc = adc
+        self._ram = ram
+        self.chans = [DmaChannelModel(n) for n in range(DMA_CHAN_COUNT)]
+        self.sniff_ctrl = 0
+        self.sniff_data = 0
+        self.intr = 0
+
+    def trigger(self, chan: DmaChannelModel, at_ns: int) -> None:
+        if not chan.enabled or chan.busy:
+            return
+        chan.remaining = chan.reload
+        chan.busy = chan.remaining > 0
+        chan.progress_ns = at_ns
+        if not chan.busy:
+            self._complete(chan, at_ns)
+
+    def _complete(self, chan: DmaChannelModel, at_ns: int) -> None:
+        chan.busy = False
+        self.intr |= 1 << chan.index
+        if chan.chain_to != chan.index:
+            self.trigger(self.chans[chan.chain_to], at_ns)
+
+    def _transfer(self, chan: DmaChannelModel, count: int) -> None:
+        size = chan.size
+        incr_write = chan.incr_write
+        ring_bytes = chan.ring_bytes
+        # Only the last samples can be visible in memory – skip writing the others
+        span = count
+        if not incr_write:
+            span = 1
+        elif ring_bytes:
+            span = min(count, ring_bytes // size)
+        skipped = count - span
+        sniffing = (self.sniff_ctrl & 1) and chan.sniff_en and ((self.sniff_ctrl >> 1) & 0xf) == chan.index
+        sniffed = 0
+        if skipped:
+            chan.write_addr = self._advance_write(chan, skipped * size * incr_write, ring_bytes)
+            if sniffing:
+                sniffed += self._adc.sum_samples(skipped)
+            else:
+                self._adc.skip_samples(skipped)
+        values = self._adc.next_samples(span)
+        if sniffing:
+            sniffed += sum(values)
+        if incr_write:
+            data = array.array(_ARRAY_TYPES[size], values).tobytes()
+            # Write in up to two pieces, split where the ring wraps
+            while data:
+                piece = len(data)
+                if ring_bytes:
+                    piece = min(piece, ring_bytes - (chan.write_addr & (ring_bytes - 1)))
+                self._ram.write_bytes(chan.write_addr, data[:piece])
+                chan.write_addr = self._advance_write(chan, piece, ring_bytes)
+                data = data[piece:]
+        else:
+            self._ram.write(chan.write_addr, values[-1], size)
+        if sniffing:
+            self.sniff_data = (self.sniff_data + sniffed) & 0xffffffff
+        chan.remaining -= count
+
+    @staticmethod
+    def _advance_write(chan: DmaChannelModel, delta: int, ring_bytes: int) -> int:
+        if not ring_bytes:
+            return chan.write_addr + delta
+        base = chan.write_addr & ~(ring_bytes - 1)
+        return base + (chan.write_addr - base + delta) % ring_bytes
+
+    # Brings all ADC-paced channels up to the current time. A capture is completed with a single transfer once the
+    # clock has passed its end. Of a ping-pong pair, only the buffers that can still be seen are written: the one
+    # completed last, and the head of the one in progress (which is not read before it completes, and then fully
+    # rewritten). Everything before is overwritten without anyone having been able to look, and only skipped.
+    def update(self) -> None:
+        now = self._clock.now_ns
+        period = self._adc.sample_period_ns
+        for _ in range(DMA_CHAN_COUNT * 4):  # bounded number of chain hops per update
+            chan = None
+            for candidate in self.chans:
+                if candidate.busy and candidate.adc_paced:
+                    chan = candidate
+                    break
+            if chan is None:
+                return
+            if not self._adc.running:
+                chan.progress_ns = now
+                return
+            available = (now - chan.progress_ns) // period
+            if available <= 0:
+                return
+            partner = self.chans[chan.chain_to]
+            if partner is not chan and partner.chain_to == chan.index and partner.reload and not self._sniffs(chan) \
+                    and available >= chan.remaining + partner.reload:
+                self._fast_forward_ping_pong(chan, partner, available, period)
+                return
+            count = min(available, chan.remaining)
+            self._transfer(chan, count)
+            chan.progress_ns += count * period
+            if chan.remaining:
+                return
+            self._complete(chan, chan.progress_ns)
+
+    # Same as transferring the given number of samples one buffer after the other, starting with the rest of chan's
+    # buffer, at least until the partner has completed once: Only the buffer completed last and the head of the one in
+    # progress are written. The other samples are only skipped.
+    def _fast_forward_ping_pong(self, chan: DmaChannelModel, partner: DmaChannelModel, available: int,
+                                period: int) -> None:
+        end_ns = chan.progress_ns + available * period
+        chan.write_addr = self._advance_write(chan, chan.remaining * chan.size * chan.incr_write, chan.ring_bytes)
+        head = (available - chan.remaining) % (partner.reload + chan.reload)
+        if head < partner.reload:
+            completed, in_progress = chan, partner
+        else:
+            completed, in_progress = partner, chan
+            head -= partner.reload
+        self._adc.skip_samples(available - completed.reload - head)
+        completed.remaining = completed.reload
+        self._transfer(completed, completed.reload)
+        completed.busy = False
+        completed.progress_ns = end_ns - head * period
+        in_progress.remaining = in_progress.reload
+        in_progress.busy = True
+        if head:
+            self._transfer(in_progress, head)
+        in_progress.progress_ns = end_ns
+        self.intr |= 1 << chan.index | 1 << partner.index
+
+    def _sniffs(self, chan: DmaChannelModel) -> bool:
+        return bool(self.sniff_ctrl & 1) and ((self.sniff_ctrl >> 1) & 0xf) == chan.index
+
+    def read(self, offset: int) -> int:
+        self.update()
+        if offset < DMA_CHAN_COUNT * DMA_CHAN_WIDTH:
+            chan = self.chans[offset // DMA_CHAN_WIDTH]
+            reg = offset % DMA_CHAN_WIDTH
+            if reg == 0x00:
+                return chan.read_addr
+            if reg == 0x04:
+                return chan.write_addr
+            if reg == 0x08:
+                return chan.remaining if chan.busy else 0
+            if reg in (0x0c, 0x10):
+                return chan.ctrl | (1 << 24 if chan.busy else 0)
+            return 0
+        if offset == 0x400:
+            return self.intr
+        if offset == 0x434:
+            return self.sniff_ctrl
+        if offset == 0x438:
+            return self.sniff_data
+        return 0  # CHAN_ABORT finishes immediately
+
+    def write(self, offset: int, value: int) -> None:
+        self.update()
+        if offset < DMA_CHAN_COUNT * DMA_CHAN_WIDTH:
+            chan = self.chans[offset // DMA_CHAN_WIDTH]
+            reg = offset % DMA_CHAN_WIDTH
+            if reg == 0x00:
+                chan.read_addr = value
+            elif reg == 0x04:
+                chan.write_addr = value
+            elif reg == 0x08:
+                chan.reload = value
+            elif reg in (0x0c, 0x10):
+                chan.ctrl = value & ~(1 << 24)
+                if not chan.enabled:
+                    chan.busy = False
+                elif reg == 0x0c:
+                    self.trigger(chan, self._clock.now_ns)
+        elif offset == 0x400:
+            self.intr &= ~value
+        elif offset == 0x434:
+            self.sniff_ctrl = value
+        elif offset == 0x438:
+            self.sniff_data = value
+        elif offset == 0x444:  # CHAN_ABORT
+            for chan in self.chans:
+                if value & (1 << chan.index):
+                    chan.busy = False
+
+
+class GpioModel:
+    def __init__(self):
+        self.inputs = {}  # externally driven levels
+        self.outputs = {}  # levels driven by the firmware
+        self.irqs = {}  # pin -> (handler, trigger mask, pin object)
+
+    def set_input(self, pin: int, level: int) -> None:
+        old = self.inputs.get(pin, 1)
+        self.inputs[pin] = level
+        if old != level and pin in self.irqs:
+            handler, trigger, pin_obj = self.irqs[pin]
+            edge = 8 if level else 4  # IRQ_RISING / IRQ_FALLING
+            if trigger & edge and handler is not None:
+                handler(pin_obj)
+
+
+# Bus dispatching register accesses to the models, charging virtual time for each access
+class Bus:
+    def __init__(self, clock: VirtualClock, adc: AdcModel, dma: DmaModel, ram: Ram, access_cost_ns=1000):
+        self._clock = clock
+        self._adc = adc
+        self._dma = dma
+        self._ram = ram
+        self._storage = {}
+        self.access_cost_ns = access_cost_ns
+
+    def read32(self, address: int) -> int:
+        self._clock.advance_ns(self.access_cost_ns)
+        if ADC_BASE <= address < ADC_BASE + ADC_SIZE:
+            return self._adc.read(address - ADC_BASE)
+        if DMA_BASE <= address < DMA_BASE + DMA_SIZE:
+            return self._dma.read(address - DMA_BASE)
+        if RAM_BASE <= address < RAM_END:
+            return self._ram.read(address, 4)
+        return self._storage.get(address, 0)
+
+    def write32(self, address: int, value: int) -> None:
+        self._clock.advance_ns(self.access_cost_ns)
+        value &= 0xffffffff
+        if ADC_BASE <= address < ADC_BASE + ADC_SIZE:
+            self._adc.write(address - ADC_BASE, value)
+        elif DMA_BASE <= address < DMA_BASE + DMA_SIZE:
+            self._dma.write(address - DMA_BASE, value)
+        elif RAM_BASE <= address < RAM_END:
+            self._ram.write(address, value, 4)
+        else:
+            self._storage[address] = value
+
+
+# The one simulated chip. Module-level, because the fake uctypes/machine modules (just like the real ones) are global.
+class Rp2040Model:
+    def __init__(self):
+        self.clock = VirtualClock()
+        self.ram = Ram()
+        self.adc = AdcModel(self.clock)
+        self.dma = DmaModel(self.clock, self.adc, self.ram)
+        self.gpio = GpioModel()
+        self.bus = Bus(self.clock, self.adc, self.dma, self.ram)
+        self.next_event_ns = None  # time of the next externally scheduled input change, if any
+
+    # Duration of a light sleep: Ends early when an input changes, as that would trigger a wake-up interrupt
+    def wake_ns(self, time_ms=None) -> int:
+        duration = 1 << 62 if time_ms is None else int(time_ms) * 1000000
+        if self.next_event_ns is not None:
+            duration = min(duration, max(0, self.next_event_ns - self.clock.now_ns))
+        return duration
+
+
+CHIP = Rp2040Model()
+
+
+# Resets all peripherals and the clock, keeping the module-level CHIP object identity
+def reset() -> Rp2040Model:
+    CHIP.__init__()
+    # The firmware's DMA claims do not survive a reset either
+    rp_dma = sys.modules.get('rp_dma')
+    if rp_dma is not None:
+        rp_dma.release_all()
+    return CHIP
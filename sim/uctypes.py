@@ -0,0 +1,61 @@
+# Fake uctypes for running on CPython: Structures access the simulated RP2040 bus instead of memory.
+# Layout descriptors are encoded like in MicroPython's moductypes, so rp_devices.py can be used unmodified.
+import rp2040_model
+
+LITTLE_ENDIAN = 0
+BIG_ENDIAN = 1
+NATIVE = 2
+
+BF_POS = 17
+BF_LEN = 22
+
+UINT8, INT8, UINT16, INT16, UINT32, INT32, UINT64, INT64 = (n << 28 for n in range(8))
+BFUINT8, BFINT8, BFUINT16, BFINT16, BFUINT32, BFINT32 = (n << 28 for n in range(8, 14))
+FLOAT32, FLOAT64 = 14 << 28, 15 << 28
+PTR = 1 << 29
+ARRAY = 2 << 29
+
+_OFFSET_MASK = (1 << BF_POS) - 1
+
+
+def addressof(obj) -> int:
+    return rp2040_model.CHIP.ram.addressof(obj)
+
+
+def sizeof(struct_obj) -> int:
+    return 4 * len(object.__getattribute__(struct_obj, '_layout'))
+
+
+class struct:
+    def __init__(self, addr: int, layout: dict, layout_type=NATIVE):
+        object.__setattr__(self, '_addr', addr)
+        object.__setattr__(self, '_layout', layout)
+
+    def _descriptor(self, name):
+        layout = object.__getattribute__(self, '_layout')
+        if name not in layout:
+            raise AttributeError(name)
+        return object.__getattribute__(self, '_addr'), layout[name]
+
+    def __getattr__(self, name):
+        addr, desc = self._descriptor(name)
+        if isinstance(desc, tuple):
+            return struct(addr + desc[0], desc[1])
+        value = rp2040_model.CHIP.bus.read32(addr + (desc & _OFFSET_MASK))
+        if desc >> 28 >= BFUINT8 >> 28:
+            pos = (desc >> BF_POS) & 0x1f
+            length = (desc >> BF_LEN) & 0x1f
+            return (value >> pos) & ((1 << length) - 1)
+        return value
+
+    def __setattr__(self, name, value):
+        addr, desc = self._descriptor(name)
+        if isinstance(desc, tuple):
+            raise TypeError('cannot assign to aggregate')
+        address = addr + (desc & _OFFSET_MASK)
+        if desc >> 28 >= BFUINT8 >> 28:
+            pos = (desc >> BF_POS) & 0x1f
+            mask = ((1 << ((desc >> BF_LEN) & 0x1f)) - 1) << pos
+            old = rp2040_model.CHIP.bus.read32(address)
+            value = (old & ~mask) | ((value << pos) & mask)
+        rp2040_model.CHIP.bus.write32(address, value)
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+import create_littlefs_image  # noqa: E402
+import import_timing  # noqa: E402
+
+try:
+    import littlefs
+except ImportError:  # optional, only needed for building images
+    littlefs = None
+
+
+class MyTestCase(unittest.TestCase):
+    def test_discover_modules(self):
+        modules = create_littlefs_image.discover_modules(ROOT)
+        self.assertIn('main.py', modules)
+        self.assertIn('grinder_filter.py', modules)
+        self.assertIn('grinder_controller_async.py', modules)  # imported within main()
+        self.assertIn('grinder_core1.py', modules)
+        self.assertIn('rp_dma.py', modules)
+        self.assertNotIn('grinder_benchmark.py', modules)  # not imported by the firmware
+        self.assertFalse([module for module in modules if module.startswith('test_')])
+
+        modules = create_littlefs_image.discover_modules(ROOT, extra=create_littlefs_image.EXTRA_FILES)
+        self.assertIn('grinder_benchmark.py', modules)  # run on the device by hand
+        self.assertIn('grinder_fast.py', modules)
+        self.assertFalse([module for module in modules if module.startswith('test_')])
+
+    def test_import_timing_order(self):
+        self.assertEqual(create_littlefs_image.import_order(ROOT), list(import_timing.MODULES))
+
+    @staticmethod
+    def _write(root: str, filename: str, source: str) -> None:
+        with open(os.path.join(root, filename), 'w') as fh:
+            fh.write(source)
+
+    @staticmethod
+    def _build(root: str, **kwargs) -> int:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return create_littlefs_image.build_image(root, os.path.join(root, 'image.img'), extra=(), **kwargs)
+
+    @staticmethod
+    def _image_files(root: str) -> dict:
+        with open(os.path.join(root, 'image.img'), 'rb') as fh:
+            lfs = create_littlefs_image._open_fs(fh.read())
+        files = {}
+        for filename in lfs.listdir('/'):
+            with lfs.open(filename, 'rb') as lfs_file:
+                files[filename] = lfs_file.read()
+        return files
+
+    @unittest.skipIf(littlefs is None, 'littlefs-python not installed')
+    def test_incremental_build(self):
+        with tempfile.TemporaryDirectory() as root:
+            self._write(root, 'main.py', 'import first\nimport second\n')
+            self._write(root, 'first.py', 'A = 1\n')
+            self._write(root, 'second.py', 'B = 2\n')
+            self.assertEqual(3, self._build(root))
+            self.assertEqual({'main.py', 'first.py', 'second.py'}, set(self._image_files(root)))
+
+            # Nothing changed: the image is not even rewritten
+            modified = os.stat(os.path.join(root, 'image.img')).st_mtime_ns
+            self.assertEqual(0, self._build(root))
+            self.assertEqual(modified, os.stat(os.path.join(root, 'image.img')).st_mtime_ns)
+
+            self._write(root, 'first.py', 'A = 3\n')
+            self.assertEqual(1, self._build(root))
+            self.assertEqual(b'A = 3\n', self._image_files(root)['first.py'])
+
+            # Dropped from the imports
+            self._write(root, 'main.py', 'import first\n')
+            self.assertEqual(2, self._build(root))
+            self.assertEqual({'main.py': b'import first\n', 'first.py': b'A = 3\n'}, self._image_files(root))
+
+            self.assertEqual(2, self._build(root, full=True))
+            self.assertEqual({'main.py', 'first.py'}, set(self._image_files(root)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+import grinder_sim  # noqa: E402
+grinder_sim.install()
+import rp2040_model  # noqa: E402
+from grinder_benchmark import _BytecodeDebouncer, _BytecodeFilter  # noqa: E402
+from grinder_debouncer import GrinderDebouncer  # noqa: E402
+from grinder_filter import GrinderFilter  # noqa: E402
+
+
+class MyTestCase(unittest.TestCase):
+    # The bytecode references have to stay copies of the native methods, or the benchmark compares different code
+    def test_bytecode_filter_matches(self):
+        source = [(i * 7919) & 0xfff for i in range(200)]
+        for filter_size in (16, 10):
+            native = GrinderFilter(2000, filter_size)
+            bytecode = _BytecodeFilter(2000, filter_size)
+            self.assertEqual([native.filter_value(value) for value in source],
+                             [bytecode.filter_value(value) for value in source])
+
+    def test_bytecode_debouncer_matches(self):
+        chip = rp2040_model.reset()
+        # Mostly stable with some bouncing, like the button pin
+        pin_states = [1 if i % 100 < 50 or i % 7 == 0 else 0 for i in range(500)]
+        native = GrinderDebouncer(0, 20)
+        bytecode = _BytecodeDebouncer(0, 20)
+        native_states = []
+        bytecode_states = []
+        for pin_state in pin_states:
+            chip.clock.advance_us(1000)
+            native_states.append(native.debounce_button(pin_state))
+            bytecode_states.append(bytecode.debounce_button(pin_state))
+        self.assertEqual(native_states, bytecode_states)
+        self.assertIn(0, native_states)
+        self.assertIn(1, native_states)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+from grinder_sim import GrinderSimulation  # noqa: E402
+import grinder_calibration  # noqa: E402
+from grinder_calibration import GrinderCalibration  # noqa: E402
+import grinder_hardware  # noqa: E402
+from grinder_detector import CusumStopDetector  # noqa: E402
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, 'calib.bin')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    # Idle at 2200, sagging to 2000 under load, rising to 2300 when the beans are through
+    def _autogrind(self, sim):
+        start_ms = sim.now_ms
+        sim.set_voltage(at_ms=start_ms, voltage=2200)
+        sim.press_button(at_ms=start_ms + 100, duration_ms=200)
+        sim.set_voltage(at_ms=start_ms + 250, voltage=2000)
+        sim.set_voltage(at_ms=start_ms + 2000, voltage=2300)
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+        sim.set_voltage(at_ms=sim.now_ms, voltage=2200)
+        sim.run_for(grinder_calibration.CALIB_SETTLE_MS + 100)  # learned once settled
+
+    def test_learn_and_persist(self):
+        calibration = GrinderCalibration(self.path)
+        self.assertEqual(0, calibration.sessions)
+        sim = GrinderSimulation(voltage=2200, loop_cost_us=500, noise=4, calibration=calibration)
+        default_low = grinder_hardware.VOLTAGE_THRESH_LOW
+        for sessions in range(1, 4):
+            self.assertEqual(default_low, sim.hw._thresh_low)  # configured ones until enough sessions were seen
+            self.assertEqual(grinder_hardware.CUSUM_DRIFT, sim.hw.stop_detector._drift)
+            self._autogrind(sim)
+            self.assertEqual(sessions, calibration.sessions)
+            self.assertTrue(os.path.exists(self.path))  # saved while idle
+
+        self.assertAlmostEqual(2200, calibration.idle_voltage, delta=5)
+        self.assertAlmostEqual(2000, calibration.loaded_voltage, delta=5)
+        self.assertAlmostEqual(300, calibration.rise, delta=10)
+        self.assertLess(calibration.noise_sigma_fixed >> 2, 10)
+        self.assertAlmostEqual(150, calibration.stop_margin(), delta=5)
+        self.assertAlmostEqual(default_low + 200, sim.hw._thresh_low, delta=5)
+        self.assertIsInstance(sim.hw.stop_detector, CusumStopDetector)
+        self.assertEqual(calibration.cusum_drift(grinder_hardware.CUSUM_DRIFT), sim.hw.stop_detector._drift)
+        self.assertLess(sim.hw.stop_detector._drift, 40)  # from the noise
+        self.assertAlmostEqual(1075, calibration.stop_factor_permille(1100), delta=3)
+
+        # Manual grinding and ones stopped by the timeout are not learned from
+        sim.press_button(at_ms=sim.now_ms + 100, duration_ms=1500)
+        self.assertTrue(sim.run_until_state('ManualGrindState', timeout_ms=2000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=2000))
+        self.assertEqual(3, calibration.sessions)
+
+        # Loaded at boot
+        loaded = GrinderCalibration(self.path)
+        self.assertEqual(calibration.sessions, loaded.sessions)
+        self.assertEqual(calibration.stop_margin(), loaded.stop_margin())
+        sim = GrinderSimulation(voltage=2200, loop_cost_us=500, calibration=loaded)
+        self.assertEqual(calibration.cusum_drift(grinder_hardware.CUSUM_DRIFT), sim.hw.stop_detector._drift)
+
+    # The rise to 2300 as a ramp, which the detector stops somewhere along
+    def _ramp_autogrind(self, sim):
+        start_ms = sim.now_ms
+        sim.set_voltage(at_ms=start_ms, voltage=2200)
+        sim.press_button(at_ms=start_ms + 100, duration_ms=200)
+        sim.set_voltage(at_ms=start_ms + 250, voltage=2000)
+        for step in range(1, 31):
+            sim.set_voltage(at_ms=start_ms + 2000 + 10 * step, voltage=2000 + 10 * step)
+        sim.set_voltage(at_ms=start_ms + 3000, voltage=2200)
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+        stop_ms = sim.now_ms - start_ms
+        sim.run_until(start_ms + 3100)
+        return stop_ms
+
+    def test_margin_stable_on_ramp(self):
+        # The stop point depends on the learned thresholds – the rise learned must not depend on the stop point in
+        # turn, or each session stops earlier than the last one
+        for detector in ('threshold', 'cusum'):
+            grinder_hardware.AUTOGRIND_DETECTOR = detector
+            try:
+                calibration = GrinderCalibration(self.path + detector)
+                sim = GrinderSimulation(voltage=2200, loop_cost_us=500, noise=4, calibration=calibration)
+                stops_ms = []
+                margins = []
+                for _ in range(8):
+                    stops_ms.append(self._ramp_autogrind(sim))
+                    margins.append(calibration.stop_margin())
+            finally:
+                grinder_hardware.AUTOGRIND_DETECTOR = 'cusum'
+
+            self.assertEqual(8, calibration.sessions)
+            self.assertAlmostEqual(300, calibration.rise, delta=20)
+            learned = margins[grinder_calibration.CALIB_MIN_SESSIONS - 1:]
+            self.assertLessEqual(max(learned) - min(learned), 10)
+            self.assertAlmostEqual(150, learned[-1], delta=10)
+            self.assertLessEqual(max(stops_ms[3:]) - min(stops_ms[3:]), 30)
+
+    def test_corrupt_file_and_limits(self):
+        with open(self.path, 'wb') as fh:
+            fh.write(b'GRC1' + bytes(5))  # truncated
+        self.assertEqual(0, GrinderCalibration(self.path).sessions)
+
+        calibration = GrinderCalibration(self.path)
+        calibration._sessions = 5
+        calibration._idle, calibration._loaded, calibration._rise = 3000 << 4, 1200 << 4, 300 << 4
+        calibration._variance = 100 << 4  # sigma 10
+        self.assertEqual((2600, 3500), calibration.charge_thresholds(800, 3500))  # starts earlier by the sag of 1800
+        self.assertEqual((3000 - grinder_calibration.CHARGE_HYSTERESIS, 3000),
+                         calibration.charge_thresholds(1000, 3000))  # kept apart from the one to stop charging
+        calibration._variance = 4000 << 4  # sigma 63: the rise cannot be told from the noise
+        self.assertIsNone(calibration.stop_margin())
+        self.assertEqual(20, calibration.cusum_drift(20))
+        self.assertEqual(1100, calibration.stop_factor_permille(1100))
+
+        calibration._dirty = True
+        self.assertTrue(calibration.save_if_dirty())
+        self.assertFalse(calibration.save_if_dirty())
+        with open(self.path, 'r+b') as fh:
+            fh.seek(8)
+            fh.write(b'\xff')
+        self.assertFalse(GrinderCalibration(self.path).valid)  # checksum mismatch
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+import gc
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+import grinder_sim  # noqa: E402
+from grinder_sim import GrinderSimulation  # noqa: E402
+import grinder_hardware  # noqa: E402
+from grinder_hardware import DEBOUNCE_TIME_MS, IDLE_SLEEP_MS, SAMPLING_PROFILE_COARSE, \
+    SAMPLING_PROFILE_DENSE  # noqa: E402
+from grinder_profiler import GrinderProfiler, STAGE_ADC, STAGE_STATE, STAGE_TRANSITION  # noqa: E402
+from RP2040ADC import adc_div_for_sample_rate  # noqa: E402
+
+# Simulated time per wall-clock time and grind sessions per second the simulation harness has to reach at least
+SIM_MIN_SPEEDUP = 20
+SIM_MIN_SESSIONS_PER_S = 5
+
+
+class MyTestCase(unittest.TestCase):
+    def test_autogrind_stops_on_voltage_rise(self):
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500)
+        sim.press_button(at_ms=100, duration_ms=200)
+        sim.set_voltage(at_ms=3000, voltage=2300)
+
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertTrue(sim.motor_running)
+        self.assertFalse(sim.jack_enabled)
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+        self.assertFalse(sim.motor_running)
+        self.assertGreaterEqual(sim.now_ms, 3000)
+        self.assertLess(sim.now_ms, 3100)
+
+    def test_autogrind_stops_on_small_voltage_rise(self):
+        # 7.5% rise: below the old fixed stop factor of 1.1, but detected by the CUSUM detector
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500, noise=5, seed=3)
+        sim.press_button(at_ms=100, duration_ms=200)
+        sim.set_voltage(at_ms=3000, voltage=2150)
+
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+        self.assertGreaterEqual(sim.now_ms, 3000)
+        self.assertLess(sim.now_ms, 3100)
+
+    def test_manual_grind_while_button_held(self):
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500)
+        sim.press_button(at_ms=100, duration_ms=3000)
+        self.assertTrue(sim.run_until_state('ManualGrindState', timeout_ms=2000))
+        self.assertEqual(adc_div_for_sample_rate(SAMPLING_PROFILE_COARSE[1]), sim.hw._avg_adc._adc_div)
+        sim.run_until(5000)
+
+        states = [state for _, state in sim.transitions]
+        self.assertEqual(states, ['IdleState', 'GrindBeginState', 'ManualGrindState', 'IdleState'])
+        self.assertFalse(sim.motor_running)
+
+    def test_charging(self):
+        sim = GrinderSimulation(voltage=900, loop_cost_us=500)
+        sim.set_voltage(at_ms=1000, voltage=3100)
+        self.assertTrue(sim.run_until_state('ChargingState', timeout_ms=100))
+        self.assertTrue(sim.jack_enabled)
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=2000))
+        self.assertFalse(sim.jack_enabled)
+
+    def test_simulation_throughput(self):
+        # Grind sessions at 1ms loop cost, i.e. about 3000 control loop runs each, with ADC noise. Conservative, as the
+        # machine running the tests might be busy: a typical PC gets about twice that.
+        sessions_per_s, speedup = grinder_sim.benchmark(sessions=3)
+        self.assertGreater(sessions_per_s, SIM_MIN_SESSIONS_PER_S)
+        self.assertGreater(speedup, SIM_MIN_SPEEDUP)
+
+    def test_behavioural_adc_matches_registers(self):
+        results = []
+        for register_adc in (False, True):
+            sim = GrinderSimulation(voltage=2000, loop_cost_us=500, noise=2, register_adc=register_adc)
+            sim.press_button(at_ms=100, duration_ms=200)
+            sim.set_voltage(at_ms=3000, voltage=2300)
+            self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+            self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+            results.append(sim.transitions)
+        self.assertEqual([state for _, state in results[0]], [state for _, state in results[1]])
+        for (behavioural_ms, _), (register_ms, _) in zip(*results):
+            self.assertAlmostEqual(register_ms, behavioural_ms, delta=5)
+
+    def test_profiler_stages(self):
+        profiler = GrinderProfiler()
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500, profiler=profiler)
+        profiler.reset()
+        sim.press_button(at_ms=100, duration_ms=3000)
+        sim.run_until(5000)
+
+        runs = profiler.histogram(STAGE_ADC).count
+        self.assertGreater(runs, 0)
+        self.assertEqual(runs, profiler.histogram(STAGE_STATE).count)
+        self.assertEqual(len(sim.transitions) - 1, profiler.histogram(STAGE_TRANSITION).count)
+        self.assertGreater(profiler.histogram(STAGE_ADC).max, 0)
+
+    def test_states_reused_and_gc_only_when_idle(self):
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500)
+        collected_in = []
+        collect = sim.ctrl.gc.collect
+
+        def collect_and_record():
+            collected_in.append(sim.state_name)
+            collect()
+        sim.ctrl.gc.collect = collect_and_record
+
+        state_objects = {}
+        for press_ms in (2000, 10000):
+            sim.press_button(at_ms=press_ms, duration_ms=200)
+            sim.set_voltage(at_ms=press_ms + 4000, voltage=2300)
+            sim.set_voltage(at_ms=press_ms + 6000, voltage=2000)
+        while sim.now_ms < 18000:
+            sim.step()
+            state_objects.setdefault(sim.state_name, set()).add(id(sim.ctrl.state))
+
+        self.assertEqual(4, len([state for _, state in sim.transitions if state == 'AutoGrindState' or
+                                 state == 'GrindBeginState']))
+        self.assertTrue(all(len(objects) == 1 for objects in state_objects.values()))
+        self.assertIn('IdleState', collected_in)
+        self.assertEqual({'IdleState'}, set(collected_in))
+        self.assertTrue(gc.isenabled())  # CPython's own collection is left alone
+
+    def test_low_power_idle(self):
+        profiler = GrinderProfiler()
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500, profiler=profiler)
+        sim.press_button(at_ms=1000, duration_ms=200)
+        sim.set_voltage(at_ms=3000, voltage=2300)
+
+        sim.run_until(999)
+        self.assertTrue(sim.hw.low_power)
+        self.assertEqual(0, sim.chip.adc.cs & 1)  # powered down between captures
+        self.assertLess(profiler.histogram(STAGE_ADC).count, 1000 // IDLE_SLEEP_MS + 2)
+
+        # Woken up by the button, debounced at full rate
+        self.assertTrue(sim.run_until_state('GrindBeginState', timeout_ms=100))
+        self.assertLess(sim.now_ms, 1000 + DEBOUNCE_TIME_MS + 5)
+        self.assertFalse(sim.hw.low_power)
+        self.assertEqual(1, sim.chip.adc.cs & 1)
+
+        profiler.reset()
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        sim.run_until(2000)
+        self.assertGreater(profiler.histogram(STAGE_ADC).count, 1000)
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=2000))
+        self.assertLess(sim.now_ms, 3100)
+        self.assertTrue(sim.hw.low_power)
+        self.assertEqual(0, sim.chip.adc.cs & 1)
+
+    def test_adc_oversampling(self):
+        grinder_hardware.ADC_RESOLUTION_BITS = 16
+        try:
+            self.assertRaises(ValueError, GrinderSimulation)  # the continuous capture does not oversample
+            grinder_hardware.ADC_CONTINUOUS_CAPTURE = False
+            sim = GrinderSimulation(voltage=2000, loop_cost_us=500, noise=2)
+            self.assertEqual(256, sim.hw._avg_adc.capture_samples)
+            sim.press_button(at_ms=100, duration_ms=200)
+            self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+            self.assertAlmostEqual(2000, sim.hw.read_voltage(), delta=1)  # still in 12 bit units
+        finally:
+            grinder_hardware.ADC_RESOLUTION_BITS = 12
+            grinder_hardware.ADC_CONTINUOUS_CAPTURE = True
+
+    def test_polled_button_fallback(self):
+        grinder_hardware.BUTTON_IRQ = False
+        try:
+            sim = GrinderSimulation(voltage=2000, loop_cost_us=500)
+        finally:
+            grinder_hardware.BUTTON_IRQ = True
+        self.assertIsNone(sim.hw._irq_debounce)
+        sim.press_button(at_ms=100, duration_ms=200)
+        sim.set_voltage(at_ms=3000, voltage=2300)
+
+        self.assertTrue(sim.run_until_state('GrindBeginState', timeout_ms=1000))
+        self.assertLess(sim.now_ms, 100 + IDLE_SLEEP_MS + DEBOUNCE_TIME_MS + 5)
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+
+    def test_sampling_profiles(self):
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500)
+        sim.press_button(at_ms=100, duration_ms=200)
+        sim.set_voltage(at_ms=3000, voltage=2300)
+        self.assertEqual(SAMPLING_PROFILE_COARSE, sim.hw.sampling_profile)
+        self.assertEqual(SAMPLING_PROFILE_COARSE[0], sim.hw._avg_adc.adc_samples)
+        self.assertEqual(0, sim.hw._avg_adc._adc_div)  # single captures of low-power idle at full speed
+
+        # The filter unused while idle starts from the current reading, not from its stale output
+        self.assertTrue(sim.run_until_state('GrindBeginState', timeout_ms=1000))
+        sim.step()
+        self.assertEqual(2000, sim.ctrl.voltage)
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertEqual(SAMPLING_PROFILE_DENSE, sim.hw.sampling_profile)
+        self.assertEqual(SAMPLING_PROFILE_DENSE[0], sim.hw._avg_adc.adc_samples)
+        self.assertEqual(2000, sim.hw.read_voltage())
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+        self.assertEqual(SAMPLING_PROFILE_COARSE[0], sim.hw._avg_adc.adc_samples)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+from grinder_sim import AsyncGrinderSimulation  # noqa: E402
+from grinder_calibration import GrinderCalibration  # noqa: E402
+import grinder_controller_async  # noqa: E402
+import grinder_recorder  # noqa: E402
+from grinder_recorder import GrinderRecorder  # noqa: E402
+from grinder_hardware import DEBOUNCE_TIME_MS, IDLE_SLEEP_MS  # noqa: E402
+from grinder_profiler import GrinderProfiler, STAGE_STATE  # noqa: E402
+
+
+class MyTestCase(unittest.TestCase):
+    def _simulation(self, **kwargs) -> AsyncGrinderSimulation:
+        sim = AsyncGrinderSimulation(**kwargs)
+        self.addCleanup(sim.close)
+        return sim
+
+    def test_autogrind_stops_on_voltage_rise(self):
+        sim = self._simulation(voltage=2000, noise=2)
+        sim.press_button(at_ms=100, duration_ms=200)
+        sim.set_voltage(at_ms=3000, voltage=2300)
+
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertTrue(sim.motor_running)
+        self.assertFalse(sim.jack_enabled)
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+        self.assertFalse(sim.motor_running)
+        self.assertGreaterEqual(sim.now_ms, 3000)
+        self.assertLess(sim.now_ms, 3100)
+        states = [state for _, state in sim.transitions]
+        self.assertEqual(['IdleState', 'GrindBeginState', 'AutoGrindState', 'IdleState'], states)
+
+    def test_manual_grind_while_button_held(self):
+        sim = self._simulation(voltage=2000)
+        sim.press_button(at_ms=100, duration_ms=3000)
+        sim.run_until(5000)
+
+        states = [state for _, state in sim.transitions]
+        self.assertEqual(['IdleState', 'GrindBeginState', 'ManualGrindState', 'IdleState'], states)
+        self.assertFalse(sim.motor_running)
+
+    def test_charging(self):
+        sim = self._simulation(voltage=900)
+        sim.set_voltage(at_ms=1000, voltage=3100)
+        self.assertTrue(sim.run_until_state('ChargingState', timeout_ms=100))
+        self.assertTrue(sim.jack_enabled)
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=2000))
+        self.assertFalse(sim.jack_enabled)
+
+    def test_added_tasks_run(self):
+        sim = self._simulation(voltage=2000)
+        sim.press_button(at_ms=0, duration_ms=3000)
+        runs = []
+
+        async def task():
+            while True:
+                runs.append(sim.now_ms)
+                await grinder_controller_async._sleep_ms(10)
+        sim.add_task(task())
+        sim.run_until(1000)
+
+        self.assertGreaterEqual(len(runs), 95)
+        self.assertLessEqual(len(runs), 101)
+
+    def test_state_runs_paced_to_capture(self):
+        profiler = GrinderProfiler()
+        sim = self._simulation(voltage=2000, profiler=profiler)
+        sim.press_button(at_ms=100, duration_ms=3000)
+        self.assertTrue(sim.run_until_state('ManualGrindState', timeout_ms=2000))
+
+        profiler.reset()
+        sim.run_for(1000)
+        # One run per new voltage value, i.e. per millisecond with the short captures
+        runs = profiler.histogram(STAGE_STATE).count
+        self.assertGreater(runs, 900)
+        self.assertLessEqual(runs, 1000)
+
+    def test_low_power_idle_sleeps_without_blocking(self):
+        profiler = GrinderProfiler()
+        sim = self._simulation(voltage=2000, profiler=profiler)
+        runs = []
+
+        async def task():
+            while True:
+                runs.append(sim.now_ms)
+                await grinder_controller_async._sleep_ms(10)
+        sim.add_task(task())
+        sim.press_button(at_ms=1000, duration_ms=200)
+
+        sim.run_until(999)
+        self.assertTrue(sim.hw.low_power)
+        self.assertEqual(0, sim.chip.adc.cs & 1)  # powered down between captures
+        self.assertLess(profiler.histogram(STAGE_STATE).count, 1000 // IDLE_SLEEP_MS + 2)
+        self.assertGreaterEqual(len(runs), 95)  # not blocked by the sleeping
+
+        # Woken up by the button
+        self.assertTrue(sim.run_until_state('GrindBeginState', timeout_ms=100))
+        self.assertLess(sim.now_ms, 1000 + DEBOUNCE_TIME_MS + 5)
+        self.assertFalse(sim.hw.low_power)
+        self.assertEqual(1, sim.chip.adc.cs & 1)
+
+    def test_session_recorded_and_learned(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        directory = os.path.join(tmp.name, 'sessions')
+        recorder = GrinderRecorder(directory)
+        calibration = GrinderCalibration(os.path.join(tmp.name, 'calib.bin'))
+        sim = self._simulation(voltage=2200, noise=2, recorder=recorder, calibration=calibration)
+        sim.press_button(at_ms=100, duration_ms=200)
+        sim.set_voltage(at_ms=250, voltage=2000)
+        sim.set_voltage(at_ms=2000, voltage=2300)
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+        sim.run_for(1500)  # written while idle
+
+        self.assertEqual(1, calibration.sessions)
+        self.assertAlmostEqual(2000, calibration.loaded_voltage, delta=5)
+        self.assertEqual(0, recorder.pending)
+        sessions = []
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), 'rb') as fh:
+                sessions.extend(grinder_recorder.read_sessions(fh.read()))
+        self.assertEqual(1, len(sessions))
+        self.assertEqual(grinder_recorder.STOP_DETECTED, sessions[0].stop_reason)
+        self.assertGreater(len(sessions[0].samples), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import array
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+import grinder_sim  # noqa: E402
+grinder_sim.install()
+import rp2040_model  # noqa: E402
+from grinder_core1 import Core1Acquisition, VoltageSlot, SLOT_WORDS, SLOT_VOLTAGE, SLOT_STOPPED  # noqa: E402
+from grinder_detector import CusumStopDetector  # noqa: E402
+from grinder_filter import EmaFilter  # noqa: E402
+from RP2040ADC import Rp2040AdcDmaAveraging  # noqa: E402
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.chip = rp2040_model.reset()
+        self.chip.adc.values[3] = 2000
+        self.adc = Rp2040AdcDmaAveraging(gpio_pin=29, adc_samples=16)
+        self.acquisition = Core1Acquisition(self.adc, None, CusumStopDetector(drift=20, threshold=200, min_dwell=2),
+                                            2000)
+
+    def test_slot(self):
+        slot = VoltageSlot()
+        snapshot = array.array('l', (0 for _ in range(SLOT_WORDS)))
+        slot.publish(1234, 1, 1)
+        slot.read(snapshot)
+        self.assertEqual(2, snapshot[0])
+        self.assertEqual(1234, snapshot[SLOT_VOLTAGE])
+        self.assertEqual(1, snapshot[SLOT_STOPPED])
+        self.assertEqual(1234, slot.voltage)
+
+    def test_detector_proxy(self):
+        acquisition = self.acquisition
+        acquisition.step()
+        self.assertEqual(2000, acquisition.voltage)
+
+        detector = acquisition.stop_detector
+        detector.reset(2000)
+        self.chip.adc.values[3] = 2300
+        self.assertFalse(detector.update(0))  # reset request not handled by core 1 yet
+        acquisition.step()
+        self.assertFalse(detector.update(0))
+        acquisition.step()
+        self.assertTrue(detector.update(0))
+        self.assertEqual(2300, acquisition.voltage)
+
+        # A new grind starts over
+        detector.reset(2300)
+        self.assertFalse(detector.update(0))
+        acquisition.step()
+        self.assertFalse(detector.update(0))
+
+    def test_filter_on_core1(self):
+        self.adc.deinit()  # there is only one sniffer
+        acquisition = Core1Acquisition(Rp2040AdcDmaAveraging(gpio_pin=29, adc_samples=16),
+                                       EmaFilter(1000, 1), CusumStopDetector(20, 200), 2000)
+        acquisition.step()
+        self.assertEqual(1500, acquisition.voltage)
+
+    def test_thread(self):
+        acquisition = self.acquisition
+        acquisition.start()
+        seq = acquisition.scheduler.jitter.count
+        deadline = time.monotonic() + 5
+        while acquisition.scheduler.jitter.count < seq + 3 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        acquisition.stop()
+        self.assertGreaterEqual(acquisition.scheduler.jitter.count, seq + 3)
+        self.assertEqual(2000, acquisition.voltage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+import grinder_sim  # noqa: E402
+grinder_sim.install()
+import rp2040_model  # noqa: E402
+from grinder_debouncer import GrinderDebouncer, GrinderIrqDebouncer  # noqa: E402
+from machine import Pin  # noqa: E402
+
+BUTTON_PIN = 3
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.chip = rp2040_model.reset()
+        self.chip.clock.advance_us(1000000)
+        self.chip.gpio.inputs[BUTTON_PIN] = 1
+        self.pin = Pin(BUTTON_PIN, Pin.IN, Pin.PULL_UP)
+
+    def _edges(self, levels, interval_ms=1):
+        for level in levels:
+            self.chip.gpio.set_input(BUTTON_PIN, level)
+            self.chip.clock.advance_us(interval_ms * 1000)
+
+    def test_bouncing_press(self):
+        debouncer = GrinderIrqDebouncer(self.pin, debounce_time_ms=20)
+        self.assertEqual(1, debouncer.debounced_state())
+        self._edges([0, 1, 0, 1, 0])  # ends 1ms after the last edge
+        self.assertEqual(0, debouncer.level)
+        self.chip.clock.advance_us(18000)
+        self.assertEqual(1, debouncer.debounced_state())
+        self.chip.clock.advance_us(2000)
+        self.assertEqual(0, debouncer.debounced_state())  # over 20ms after the last edge, however late it is read
+
+        # Glitch shorter than the debounce time
+        self._edges([1, 0])
+        self.chip.clock.advance_us(30000)
+        self.assertEqual(0, debouncer.debounced_state())
+        self.assertEqual(0, debouncer.lost_edges)
+
+    def test_same_result_as_polling(self):
+        irq_debouncer = GrinderIrqDebouncer(self.pin, debounce_time_ms=20)
+        poll_debouncer = GrinderDebouncer(initial_value=1, debounce_time_ms=20)
+        levels = [0, 1, 0] + [0] * 30 + [1, 0, 1] + [1] * 30
+        for level in levels:
+            if level != self.pin.value():
+                self.chip.gpio.set_input(BUTTON_PIN, level)
+            self.assertEqual(poll_debouncer.debounce_button(self.pin.value()), irq_debouncer.debounced_state())
+            self.chip.clock.advance_us(1000)
+
+    def test_queue_overflow(self):
+        debouncer = GrinderIrqDebouncer(self.pin, debounce_time_ms=20, queue_size=4)
+        self._edges([0, 1] * 5 + [0])
+        self.chip.clock.advance_us(30000)
+        self.assertEqual(0, debouncer.debounced_state())  # the last edge still decides
+        self.assertEqual(7, debouncer.lost_edges)
+        self.assertRaises(ValueError, GrinderIrqDebouncer, self.pin, 20, 6)
+
+        debouncer.deinit()
+        self._edges([1])
+        self.assertEqual(0, debouncer.level)
+
+
+if __name__ == '__main__':
+    unittest.main()
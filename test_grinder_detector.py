@@ -0,0 +1,49 @@
+import random
+import unittest
+
+from grinder_detector import ThresholdStopDetector, CusumStopDetector
+
+
+class MyTestCase(unittest.TestCase):
+    def test_threshold(self):
+        detector = ThresholdStopDetector(11, 10)
+        detector.reset(2000)
+        self.assertFalse(detector.update(2199))
+        self.assertTrue(detector.update(2200))
+
+    def test_cusum_ignores_noise(self):
+        rnd = random.Random(1)
+        detector = CusumStopDetector(drift=20, threshold=200, min_dwell=3, baseline_shift=8)
+        detector.reset(2000)
+        for _ in range(10000):
+            self.assertFalse(detector.update(2000 + rnd.randint(-15, 15)))
+
+    def test_cusum_detects_small_step(self):
+        # A 5% rise would never reach a stop factor of 1.1
+        detector = CusumStopDetector(drift=20, threshold=200, min_dwell=3)
+        detector.reset(2000)
+        for _ in range(100):
+            self.assertFalse(detector.update(2000))
+        results = [detector.update(2100) for _ in range(5)]
+        # Sum 80, 160, 240 (dwell 1), 320 (dwell 2), 400 (dwell 3)
+        self.assertEqual([False, False, False, False, True], results)
+
+    def test_cusum_dwell_rejects_spike(self):
+        detector = CusumStopDetector(drift=20, threshold=200, min_dwell=3)
+        detector.reset(2000)
+        # Crosses the threshold for a single value only
+        self.assertFalse(detector.update(2250))
+        for _ in range(100):
+            self.assertFalse(detector.update(1900))
+
+    def test_cusum_baseline_tracks_drift(self):
+        detector = CusumStopDetector(drift=20, threshold=200, min_dwell=1, baseline_shift=6)
+        detector.reset(2000)
+        # Slow rise by 200 over 2000 values, always below the drift per value
+        for i in range(2000):
+            self.assertFalse(detector.update(2000 + i // 10))
+        self.assertTrue(any(detector.update(2300) for _ in range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
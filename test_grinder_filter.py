@@ -1,5 +1,12 @@
+import array
+import random
 import unittest
-from grinder_filter import GrinderFilter
+from grinder_filter import GrinderFilter, EmaFilter, MedianFilter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class MyTestCase(unittest.TestCase):
@@ -264,6 +271,90 @@ class MyTestCase(unittest.TestCase):
             plt.legend(loc="upper left")
         self.assertEqual(output, expected)
 
+    def test_filter_block(self):
+        rng = random.Random(0)
+        samples = array.array('H', (rng.randrange(4096) for _ in range(1000)))
+        single_filter = GrinderFilter(2000, 16)
+        expected = [single_filter.filter_value(v) for v in samples]
+
+        block_filter = GrinderFilter(2000, 16)
+        output = array.array('H', bytes(2 * len(samples)))
+        view = memoryview(samples)
+        block_filter.filter_block(view[:300], output)
+        block_filter.filter_block(view[300:], memoryview(output)[300:])
+        self.assertEqual(list(output), expected)
+
+    @unittest.skipIf(numpy is None, 'NumPy not available')
+    def test_filter_block_numpy(self):
+        rng = random.Random(1)
+        samples = [rng.randrange(4096) for _ in range(1000)]
+        single_filter = GrinderFilter(2000, 16)
+        expected = [single_filter.filter_value(v) for v in samples]
+
+        block_filter = GrinderFilter(2000, 16)
+        output = (list(block_filter.filter_block_numpy(samples[:10])) +
+                  list(block_filter.filter_block_numpy(samples[10:])))
+        self.assertEqual(output, expected)
+
+    def test_filter_non_power_of_two(self):
+        rng = random.Random(2)
+        samples = [rng.randrange(4096) for _ in range(500)]
+        v_filter = GrinderFilter(1000, 10)
+        window = [1000] * 10
+        for v in samples:
+            window = window[1:] + [v]
+            self.assertAlmostEqual(v_filter.filter_value(v), sum(window) / 10, delta=1)
+
+    def test_filter_resize(self):
+        rng = random.Random(4)
+        samples = [rng.randrange(4096) for _ in range(200)]
+        v_filter = GrinderFilter(1000, 16)
+        for v in samples:
+            v_filter.filter_value(v)
+        value = v_filter.filter_value(samples[-1])
+
+        v_filter.resize(4)
+        self.assertEqual((4, 16), (v_filter.filter_size, v_filter.capacity))
+        self.assertEqual(value, v_filter.filter_value(value))
+        reference = GrinderFilter(value, 4)
+        for v in samples:
+            self.assertEqual(reference.filter_value(v), v_filter.filter_value(v))
+        self.assertRaises(ValueError, v_filter.resize, 17)
+
+        v_filter.resize(8, 3000)  # seeded with the current reading
+        self.assertEqual(3000, v_filter.filter_value(3000))
+        reference = GrinderFilter(3000, 8)
+        for v in samples:
+            self.assertEqual(reference.filter_value(v), v_filter.filter_value(v))
+
+    def test_ema_filter(self):
+        v_filter = EmaFilter(1000, 3)
+        self.assertEqual([v_filter.filter_value(1000) for _ in range(10)], [1000] * 10)
+        step = [v_filter.filter_value(2000) for _ in range(200)]
+        self.assertEqual(step[0], 1125)
+        self.assertEqual(step, sorted(step))
+        self.assertEqual(step[-1], 2000)
+
+        block_filter = EmaFilter(1000, 3)
+        output = array.array('H', bytes(2 * 210))
+        block_filter.filter_block([1000] * 10 + [2000] * 200, output)
+        self.assertEqual(list(output[10:]), step)
+
+    def test_median_filter(self):
+        rng = random.Random(3)
+        samples = [rng.randrange(100) for _ in range(1000)]
+        for filter_size in (1, 3, 5):
+            v_filter = MedianFilter(50, filter_size)
+            window = [50] * filter_size
+            for v in samples:
+                window = window[1:] + [v]
+                self.assertEqual(v_filter.filter_value(v), sorted(window)[filter_size // 2])
+
+    def test_median_filter_rejects_spikes(self):
+        v_filter = MedianFilter(2000, 3)
+        output = [v_filter.filter_value(v) for v in [2000, 4095, 2000, 2001, 0, 2002, 2003]]
+        self.assertEqual(output, [2000, 2000, 2000, 2001, 2000, 2001, 2002])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from grinder_histogram import GrinderHistogram
+
+
+class MyTestCase(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = GrinderHistogram(bucket_width=10, bucket_count=10)
+        for value in range(100):
+            histogram.add(value)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.min, 0)
+        self.assertEqual(histogram.max, 99)
+        self.assertEqual(histogram.percentile(50), 50)
+        self.assertEqual(histogram.percentile(90), 90)
+        self.assertEqual(histogram.percentile(99), 99)
+
+    def test_out_of_range(self):
+        histogram = GrinderHistogram(bucket_width=10, bucket_count=4)
+        histogram.add(-5)
+        histogram.add(1000)
+        histogram.add(1001)
+
+        self.assertEqual(histogram.min, -5)
+        self.assertEqual(histogram.percentile(10), 10)
+        self.assertEqual(histogram.percentile(90), 1001)
+
+        histogram.reset()
+        self.assertEqual(histogram.count, 0)
+        self.assertEqual(histogram.percentile(50), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
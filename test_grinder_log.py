@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools'))
+import grinder_sim  # noqa: E402
+grinder_sim.install()
+import grinder_log  # noqa: E402
+import decode_log  # noqa: E402
+from grinder_log import GrinderLog, EVENT_AUTOGRIND, EVENT_DROPPED, EVENT_IDLE  # noqa: E402
+
+
+class _BinaryStdout:
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+
+class MyTestCase(unittest.TestCase):
+    def test_ring_buffer(self):
+        log = GrinderLog(capacity=4)
+        record = [0] * grinder_log.RECORD_WORDS
+        for round_ in range(3):
+            log.log_event(EVENT_AUTOGRIND, 2000 + round_)
+            log.log_event(EVENT_IDLE)
+            self.assertEqual(2, log.pending)
+            self.assertTrue(log.read_record(record))
+            self.assertEqual([EVENT_AUTOGRIND, 2000 + round_, 0, 0], record[1:])
+            self.assertTrue(log.read_record(record))
+            self.assertEqual(EVENT_IDLE, record[1])
+            self.assertFalse(log.read_record(record))
+
+    def test_overflow(self):
+        log = GrinderLog(capacity=4)
+        record = [0] * grinder_log.RECORD_WORDS
+        for i in range(10):
+            log.log_event(EVENT_AUTOGRIND, i)
+        self.assertEqual(6, log.dropped_total)
+        events = []
+        while log.read_record(record):
+            events.append((record[1], record[2]))
+        self.assertEqual([(EVENT_AUTOGRIND, 0), (EVENT_AUTOGRIND, 1), (EVENT_AUTOGRIND, 2), (EVENT_AUTOGRIND, 3),
+                          (EVENT_DROPPED, 6)], events)
+
+    def test_binary_output_decodes(self):
+        log = GrinderLog(capacity=8, binary_output=True)
+        log.log_event(EVENT_AUTOGRIND, 2345)
+        log.log_event(EVENT_IDLE)
+        output = io.BytesIO()
+        stdout = sys.stdout
+        sys.stdout = _BinaryStdout(output)
+        try:
+            log.flush()
+        finally:
+            sys.stdout = stdout
+        data = b'>>> ' + output.getvalue() + b'done\n'
+
+        items, remaining = decode_log.decode(data)
+        self.assertEqual(0, remaining)
+        self.assertEqual('>>> ', items[0])
+        self.assertEqual('Entering automatic grinding state; Vstart=2345', grinder_log.format_message(items[1]))
+        self.assertEqual('Entering idle state', grinder_log.format_message(items[2]))
+        self.assertEqual('done\n', items[3])
+
+        # Incomplete frame at the end is kept for the next chunk
+        items, remaining = decode_log.decode(data[:10])
+        self.assertEqual(['>>> '], items)
+        self.assertEqual(6, remaining)
+
+
+if __name__ == '__main__':
+    unittest.main()
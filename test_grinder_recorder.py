@@ -0,0 +1,119 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools'))
+from grinder_sim import GrinderSimulation  # noqa: E402
+import grinder_log  # noqa: E402
+import grinder_recorder  # noqa: E402
+from grinder_recorder import GrinderRecorder  # noqa: E402
+import trace_replay  # noqa: E402
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = os.path.join(self._tmp.name, 'sessions')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _read_all(self):
+        sessions = []
+        for name in sorted(os.listdir(self.dir)):
+            with open(os.path.join(self.dir, name), 'rb') as fh:
+                sessions.extend(grinder_recorder.read_sessions(fh.read()))
+        return sessions
+
+    def _autogrind(self, recorder, sim=None):
+        sim = sim or GrinderSimulation(voltage=2000, loop_cost_us=500, recorder=recorder)
+        start_ms = sim.now_ms
+        sim.press_button(at_ms=start_ms + 100, duration_ms=200)
+        sim.set_voltage(at_ms=start_ms + 2000, voltage=2300)
+        self.assertTrue(sim.run_until_state('AutoGrindState', timeout_ms=1000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=5000))
+        return sim
+
+    def test_autogrind_session(self):
+        recorder = GrinderRecorder(self.dir)
+        sim = self._autogrind(recorder)
+        self.assertTrue(recorder.recording)  # after the stop
+        self.assertEqual([], os.listdir(self.dir))  # nothing written while recording
+        sim.run_for(1500)  # written chunk by chunk while idle
+        self.assertFalse(recorder.recording)
+        self.assertEqual(0, recorder.pending)
+
+        sessions = self._read_all()
+        self.assertEqual(1, len(sessions))
+        session = sessions[0]
+        self.assertEqual(grinder_recorder.STOP_DETECTED, session.stop_reason)
+        self.assertEqual(2000, session.start_voltage)
+        self.assertEqual([grinder_log.EVENT_GRIND_BEGIN, grinder_log.EVENT_AUTOGRIND, grinder_log.EVENT_IDLE],
+                         [event for _, event in session.transitions])
+        self.assertAlmostEqual(1900, session.transition_ms(grinder_log.EVENT_IDLE), delta=50)
+        self.assertAlmostEqual(240, len(session.samples), delta=5)  # including 500ms after the stop
+        self.assertEqual(2000, session.samples[0])
+        self.assertEqual(2300, session.samples[-1])
+        self.assertEqual(2300, session.samples[195])  # time base kept in low-power idle
+        self.assertFalse(session.truncated)
+
+        # Manual grind, recorded into the next free buffer
+        sim.press_button(at_ms=sim.now_ms + 100, duration_ms=1500)
+        self.assertTrue(sim.run_until_state('ManualGrindState', timeout_ms=2000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=2000))
+        sim.run_for(1500)
+        sessions = self._read_all()
+        self.assertEqual(2, len(sessions))
+        self.assertEqual(grinder_recorder.STOP_MANUAL, sessions[1].stop_reason)
+        self.assertEqual(0, sessions[1].start_voltage)
+
+    def test_rotation_and_partial_records(self):
+        recorder = GrinderRecorder(self.dir, max_samples=100, segment_max_bytes=500, max_bytes=1200)
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500, recorder=recorder)
+        for _ in range(8):
+            self._autogrind(recorder, sim)
+            sim.set_voltage(at_ms=sim.now_ms, voltage=2000)
+            sim.run_for(1000)
+            self.assertEqual(0, recorder.pending)
+        names = sorted(os.listdir(self.dir))
+        self.assertEqual(['000002.grs', '000003.grs'], names)  # oldest ones deleted
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(self.dir, name)) for name in names), 1200)
+        sessions = self._read_all()
+        self.assertTrue(all(session.truncated for session in sessions))  # 100 samples are only 1s
+        self.assertTrue(all(len(session.samples) == 100 for session in sessions))
+
+        # Power lost while writing: a partial record at the end is ignored, and the next boot starts a new segment
+        path = os.path.join(self.dir, names[-1])
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        with open(path, 'ab') as fh:
+            fh.write(data[:100])
+        self.assertEqual(len(sessions), len(self._read_all()))
+        recorder = GrinderRecorder(self.dir, max_samples=100, segment_max_bytes=500, max_bytes=1200)
+        sim = GrinderSimulation(voltage=2000, loop_cost_us=500, recorder=recorder)
+        self._autogrind(recorder, sim)
+        sim.run_for(1000)
+        self.assertEqual(['000003.grs', '000004.grs'], sorted(os.listdir(self.dir)))
+        self.assertEqual(3, len(self._read_all()))  # two before the partial record, one new
+
+    def test_replay_recorded_session(self):
+        recorder = GrinderRecorder(self.dir)
+        sim = self._autogrind(recorder)
+        sim.press_button(at_ms=sim.now_ms + 100, duration_ms=1500)
+        self.assertTrue(sim.run_until_state('ManualGrindState', timeout_ms=2000))
+        self.assertTrue(sim.run_until_state('IdleState', timeout_ms=2000))
+        sim.run_for(1500)
+
+        traces = trace_replay.load_traces(os.path.join(self.dir, '000000.grs'))
+        self.assertEqual(['000000.grs#0 (detected)', '000000.grs#1 (manual)'], [trace.name for trace in traces])
+        result = trace_replay.replay_exact(traces[0])
+        self.assertEqual('auto', result.reason)
+        self.assertAlmostEqual(1900, result.stop_ms, delta=50)
+        result = trace_replay.replay_exact(traces[1])
+        self.assertEqual('not stopped', result.reason)
+
+
+if __name__ == '__main__':
+    unittest.main()
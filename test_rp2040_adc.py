@@ -0,0 +1,169 @@
+import array
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim'))
+import grinder_sim  # noqa: E402
+grinder_sim.install()
+import rp2040_model  # noqa: E402
+import rp_dma  # noqa: E402
+import RP2040ADC  # noqa: E402
+from RP2040ADC import Rp2040AdcDmaAveraging, Rp2040AdcDmaMultiChannel, Rp2040AdcDmaPingPong, \
+    adc_div_for_sample_rate  # noqa: E402
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.chip = rp2040_model.reset()
+        self.chip.adc.values[:] = [100, 200, 300, 2000, 876]
+
+    def test_multi_channel(self):
+        adc = Rp2040AdcDmaMultiChannel(adc_inputs=(4, 3, 0), samples_per_input=8)
+        self.assertEqual([0, 3, 4], adc.inputs)
+        averages = array.array('H', (0, 0, 0))
+        for _ in range(3):
+            adc.capture_start()
+            adc.wait_and_read_averages_u12(averages)
+            self.assertEqual([100, 2000, 876], list(averages))
+
+    def test_single_channel_after_multi_channel(self):
+        multi = Rp2040AdcDmaMultiChannel(adc_inputs=(1, 2), samples_per_input=4)
+        multi.capture_start()
+        multi.wait_and_read_averages_u12([0, 0])
+        single = Rp2040AdcDmaAveraging(gpio_pin=29, adc_samples=16)
+        single.capture_start()
+        self.assertEqual(2000, single.wait_and_read_average_u12())
+
+    def test_oversampling(self):
+        self.chip.adc.set_noise(2, seed=1)
+        adc = Rp2040AdcDmaAveraging(gpio_pin=29, adc_samples=16, resolution_bits=16)
+        self.assertEqual(256, adc.capture_samples)
+        results = []
+        for _ in range(20):
+            adc.capture_start()
+            results.append(adc.wait_and_read_average_u16())
+        for value in results:
+            self.assertAlmostEqual(2000 * 16, value, delta=16)
+        # Uses the bits below 12 bit resolution
+        self.assertTrue(any(value % 16 for value in results))
+
+        adc.configure(resolution_bits=12)
+        self.assertEqual(16, adc.capture_samples)
+        adc.capture_start()
+        self.assertAlmostEqual(2000, adc.wait_and_read_average_u12(), delta=2)
+
+        # No more samples than averaged anyway
+        self.assertRaises(ValueError, adc.configure, resolution_bits=14)
+        self.assertEqual(16, adc.capture_samples)
+        adc.configure(resolution_bits=14, adc_samples=4)
+        self.assertEqual(16, adc.capture_samples)
+
+    def test_sample_rate(self):
+        self.assertEqual(0, adc_div_for_sample_rate(0))
+        self.assertEqual(0, adc_div_for_sample_rate(500000))
+        self.assertEqual(4799 * 256, adc_div_for_sample_rate(10000))
+        adc = Rp2040AdcDmaAveraging(gpio_pin=29, adc_samples=64, sample_rate=10000)
+        self.assertEqual(6400, adc.capture_time_us)
+        start = self.chip.clock.ticks_us()
+        adc.capture_start()
+        self.assertEqual(2000, adc.wait_and_read_average_u12())
+        self.assertGreaterEqual(self.chip.clock.ticks_diff(self.chip.clock.ticks_us(), start), 6400)
+
+    def test_dma_claims(self):
+        self.assertEqual(0, rp_dma.claim_channel())
+        self.assertEqual(5, rp_dma.claim_channel(5))
+        self.assertRaises(RuntimeError, rp_dma.claim_channel, 5)
+        self.assertEqual(1, rp_dma.claim_channel())
+        rp_dma.release_channel(0)
+        self.assertEqual(0, rp_dma.claim_channel())
+
+        rp_dma.claim_sniffer(5)
+        self.assertRaises(RuntimeError, rp_dma.claim_sniffer, 1)
+        self.assertRaises(ValueError, rp_dma.claim_sniffer, 7)
+        rp_dma.release_channel(5)
+        self.assertEqual(-1, rp_dma.sniffer_channel())
+        rp_dma.claim_sniffer(1)
+
+    def test_capture_classes_coexist(self):
+        averaging = Rp2040AdcDmaAveraging(gpio_pin=29, adc_samples=16)
+        multi = Rp2040AdcDmaMultiChannel(adc_inputs=(0, 4), samples_per_input=4)
+        self.assertRaises(RuntimeError, Rp2040AdcDmaAveraging, gpio_pin=28)  # sniffer taken
+        self.assertFalse(rp_dma.is_claimed(2))  # the failed one's channel was released again
+
+        averages = [0, 0]
+        for _ in range(2):
+            averaging.capture_start()
+            self.assertEqual(2000, averaging.wait_and_read_average_u12())
+            multi.capture_start()
+            multi.wait_and_read_averages_u12(averages)
+            self.assertEqual([100, 876], averages)
+
+        averaging.deinit()
+        self.assertEqual(-1, rp_dma.sniffer_channel())
+        Rp2040AdcDmaAveraging(gpio_pin=28)
+
+    def test_fast_register_access(self):
+        adc = Rp2040AdcDmaAveraging(gpio_pin=29, adc_samples=4, resolution_bits=14)
+        results = {}
+        try:
+            for fast in (False, True):
+                RP2040ADC.FAST_REGISTER_ACCESS = fast
+                self.chip.adc.set_noise(2, seed=1)
+                values = []
+                for _ in range(3):
+                    adc.capture_start()
+                    self.assertTrue(adc.capture_busy())
+                    values.append(adc.wait_and_read_average_u16())
+                    self.assertFalse(adc.capture_busy())
+                adc.capture_start()
+                values.append(adc.wait_and_read_average_u12())
+                results[fast] = values
+        finally:
+            RP2040ADC.FAST_REGISTER_ACCESS = True
+        self.assertEqual(results[False], results[True])
+        # ADC stopped and DMA channel disabled, like by the uctypes path
+        self.assertEqual(0, self.chip.adc.cs & 0x8)
+        self.assertEqual(0, adc._dma_chan.CTRL_TRIG.EN)
+
+    def test_ping_pong_fast_forward(self):
+        # Skipping over many buffers at once ends in the same state as transferring them one by one
+        states = []
+        for step_ns in (1000000, 2000, 3000):
+            self.chip = rp2040_model.reset()
+            self.chip.adc.values[3] = 2000
+            adc = Rp2040AdcDmaPingPong(gpio_pin=29, adc_samples=16)
+            adc.capture_start()
+            end_ns = self.chip.clock.now_ns + 1000123
+            while self.chip.clock.now_ns < end_ns:
+                self.chip.clock.advance_ns(min(step_ns, end_ns - self.chip.clock.now_ns))
+                self.chip.dma.update()
+            chans = [self.chip.dma.chans[index] for index in adc._dma_chan_indices]
+            states.append([(chan.busy, chan.remaining, chan.write_addr, chan.progress_ns) for chan in chans])
+            self.assertEqual(2000, adc.read_latest_average_u12())
+            adc.deinit()
+        self.assertEqual(states[1], states[0])
+        self.assertEqual(states[2], states[0])
+
+    def test_ping_pong_configure(self):
+        adc = Rp2040AdcDmaPingPong(gpio_pin=29, adc_samples=16)
+        adc.configure(adc_samples=4, sample_rate=10000)
+        adc.capture_start()
+        self.chip.clock.advance_us(5000)
+        self.assertEqual(2000, adc.read_latest_average_u12())
+        # Only the beginnings of the buffers are written
+        self.assertEqual([2000] * 4 + [0] * 12, list(adc._full_buffs[0]))
+        adc.capture_stop()
+        self.assertRaises(ValueError, adc.configure, adc_samples=32)
+        self.assertRaises(ValueError, adc.configure, adc_samples=6)
+
+        adc.configure(adc_samples=16)
+        self.chip.adc.values[3] = 1000
+        adc.capture_start()
+        self.chip.clock.advance_us(100)
+        self.assertEqual(1000, adc.read_latest_average_u12())
+        adc.deinit()
+
+
+if __name__ == '__main__':
+    unittest.main()
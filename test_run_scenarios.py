@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools'))
+import run_scenarios  # noqa: E402
+
+SCENARIO = {
+    'name': 'autogrind',
+    'duration_ms': 5000,
+    'events': [
+        {'at_ms': 1000, 'button': 1, 'transition': 'Entering grind begin state'},
+        {'at_ms': 1200, 'button': 0, 'transition': 'Entering automatic grinding state'},
+        {'at_ms': 3000, 'adc': 3, 'value': 2200, 'transition': 'Entering idle state'},
+    ],
+    'expect': ['Entering grind begin state', 'Entering automatic grinding state', 'Entering idle state'],
+}
+
+
+# Log lines arrive on the host 5000000us after their device time stamp plus some delay
+def simulated_run(events_host_us, log) -> run_scenarios.ScenarioRun:
+    run = run_scenarios.ScenarioRun()
+    run.lines.append((5000000, '>>> boot output'))
+    for device_us, message, delay_us in log:
+        run.lines.append((5000000 + device_us + delay_us, '{} – {}'.format(device_us, message)))
+    run.events = [(host_us, index) for index, host_us in enumerate(events_host_us)]
+    run.done = True
+    run.heap_free = 123456
+    return run
+
+
+class MyTestCase(unittest.TestCase):
+    def test_analyse(self):
+        run = simulated_run((6000000, 6200000, 8000000), (
+            (500000, 'Hi', 100),
+            (1021000, 'Entering grind begin state', 900),
+            (1201000, 'Entering automatic grinding state; Vstart=1800', 2000),
+            (2000000, 'Battery voltage: 1800; Button state: 0; Time for 1000 runs: 2004000us', 300),
+            (2500000, 'Loop period 2000us; jitter [us]: n=5000 min=0 p50=10 p90=20 p99=40 max=90; '
+                      'missed deadlines: 2', 300),
+            (3050000, 'Entering idle state', 500),
+        ))
+        result = run_scenarios.analyse(SCENARIO, run)
+        self.assertTrue(result['passed'])
+        self.assertEqual([21.1, 1.1, 50.1], [event['latency_ms'] for event in result['events']])
+        self.assertEqual(3, result['latency_ms']['n'])
+        self.assertEqual(2004, result['loop_period_us']['max'])
+        self.assertEqual({'jitter_p99_us': 40, 'jitter_max_us': 90, 'missed_deadlines': 2}, result['scheduler'])
+        self.assertEqual(123456, result['heap_free'])
+
+    def test_analyse_missing_transition(self):
+        run = simulated_run((6000000, 6200000, 8000000), (
+            (500000, 'Hi', 100),
+            (1021000, 'Entering grind begin state', 100),
+            (1500000, 'Entering manual grinding state', 100),
+        ))
+        result = run_scenarios.analyse(SCENARIO, run)
+        self.assertFalse(result['passed'])
+        self.assertEqual([21.1, None, None], [event['latency_ms'] for event in result['events']])
+
+
+if __name__ == '__main__':
+    unittest.main()
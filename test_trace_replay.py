@@ -0,0 +1,55 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools'))
+import trace_replay  # noqa: E402
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def synthetic_trace(seed: int, end_ms: int, start_voltage=2000, rise=250, noise=5) -> trace_replay.Trace:
+    rng = random.Random(seed)
+    times = list(range(0, end_ms + 1000, 5))
+    voltages = [start_voltage + (rise if t >= end_ms else 0) + int(rng.gauss(0, noise)) for t in times]
+    return trace_replay.Trace('synthetic{}'.format(seed), times, voltages, end_ms=end_ms)
+
+
+class MyTestCase(unittest.TestCase):
+    def test_exact_replay(self):
+        trace = synthetic_trace(seed=1, end_ms=1500)
+        result = trace_replay.replay_exact(trace, stop_factor=1.1)
+        self.assertEqual(result.reason, 'auto')
+        self.assertFalse(result.false_stop)
+        self.assertLess(result.overgrind_ms, 20)
+
+        result = trace_replay.replay_exact(trace, stop_factor=1.2)
+        self.assertIsNone(result.stop_ms)
+
+    @unittest.skipIf(numpy is None, 'NumPy not available')
+    def test_numpy_matches_exact(self):
+        traces = [synthetic_trace(seed, end_ms=1000 + 200 * seed) for seed in range(3)]
+        fast = trace_replay.sweep_numpy(traces, [1.05, 1.2], [1, 8])
+        exact = trace_replay.sweep_exact(traces, [1.05, 1.2], [1, 8])
+        for fast_summary, exact_summary in zip(fast, exact):
+            self.assertEqual(fast_summary['not_stopped'], exact_summary['not_stopped'])
+            self.assertEqual(fast_summary['false_stops'], exact_summary['false_stops'])
+            if exact_summary['mean_overgrind_ms'] is not None:
+                self.assertAlmostEqual(fast_summary['mean_overgrind_ms'], exact_summary['mean_overgrind_ms'], delta=3)
+
+    @unittest.skipIf(numpy is None, 'NumPy not available')
+    def test_sma_numpy_matches_filter(self):
+        from grinder_filter import GrinderFilter
+        rng = random.Random(0)
+        values = [rng.randrange(4096) for _ in range(200)]
+        v_filter = GrinderFilter(3000, 16)
+        expected = [v_filter.filter_value(v) for v in values]
+        self.assertEqual(list(trace_replay.sma_numpy([values], 16, 3000)[0]), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
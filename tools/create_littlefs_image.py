@@ -1,21 +1,228 @@
-from littlefs import LittleFS
+# Creates a LittleFS image with the firmware for the Pico, to be used with rp2040js (or flashed).
+#
+# The modules to include are discovered from the imports of main.py (recursively, including imports within functions),
+# so the image always contains exactly what the firmware can import from this repository. Modules that are not imported
+# by the firmware, but run on the device by hand (EXTRA_FILES and --include), are added along with their imports.
+# Builds are incremental: A cache next to the image records the content hash of each file's source and build options.
+# If the image on disk still matches the cache, it is mounted and only changed files are rewritten (and files no longer
+# needed are removed); if nothing changed, the image is not touched at all. --full forces a build from scratch.
+#
+# With --mpy, all modules except main.py are precompiled to .mpy bytecode with mpy-cross, so the device does not have to
+# compile them on every boot – saving boot time and the heap needed by the compiler. main.py stays source, as it is the
+# entry point run by MicroPython. mpy-cross has to match the MicroPython version on the device (see --mpy-cross); it is
+# taken from the mpy-cross Python package ("pip install mpy-cross==<version>") or the PATH.
+# A table of the per-module sizes and changes is printed. Use tools/import_timing.py on the device to compare the
+# import times of both kinds of images.
+#
+# Run from the repository root: python3 tools/create_littlefs_image.py [--mpy] [--full] [--include FILE ...]
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 
-files = ['grinder_controller.py',
-         'grinder_controller_states.py',
-         'grinder_debouncer.py',
-         'grinder_hardware.py',
-         'rp_devices.py',
-         'RP2040ADC.py',
-         'main.py']
+# Entry point, always kept as source
+ENTRY_POINT = 'main.py'
+# Run from the REPL on the device, not imported by the firmware
+EXTRA_FILES = ('grinder_benchmark.py',)
+
+# Image geometry: block size, block count, program size
+GEOMETRY = (4096, 352, 256)
 
 # Put image to output folder, which is symlinked to rp2040js for direct starting
 output_image = 'output/littlefs.img'
 
-lfs = LittleFS(block_size=4096, block_count=352, prog_size=256)
+CACHE_SUFFIX = '.cache.json'
+
+
+# Returns the .py files of root imported by the given one (anywhere, also within functions), in the order of the source
+def _local_imports(root: str, filename: str) -> list:
+    with open(os.path.join(root, filename), 'rb') as fh:
+        tree = ast.parse(fh.read(), filename)
+    imports = []
+    for node in sorted(ast.walk(tree), key=lambda n: (getattr(n, 'lineno', 0), getattr(n, 'col_offset', 0))):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            candidate = name.split('.')[0] + '.py'
+            if candidate not in imports and os.path.isfile(os.path.join(root, candidate)):
+                imports.append(candidate)
+    return imports
+
+
+# Returns the .py files of root reachable by imports from entry and the extra files, sorted by name
+def discover_modules(root: str, entry=ENTRY_POINT, extra=()) -> list:
+    found = set()
+    pending = [entry]
+    pending.extend(extra)
+    while pending:
+        filename = pending.pop()
+        if filename in found:
+            continue
+        found.add(filename)
+        pending.extend(_local_imports(root, filename))
+    return sorted(found, key=str.lower)
+
+
+# Returns the names of the modules reachable from entry (without it) so that each comes after the modules it imports,
+# see tools/import_timing.py. A module importing one that imports it in turn is left out, as it is imported along with
+# that one.
+def import_order(root: str, entry=ENTRY_POINT) -> list:
+    order = []
+    visited = {entry}
+    importing = [entry]
+
+    def visit(filename) -> bool:
+        cyclic = False
+        for imported in _local_imports(root, filename):
+            if imported in importing[1:]:
+                cyclic = True
+            elif imported not in visited:
+                visited.add(imported)
+                importing.append(imported)
+                if not visit(imported):
+                    order.append(os.path.splitext(imported)[0])
+                importing.pop()
+        return cyclic
+    visit(entry)
+    return order
+
+
+# Returns the command line prefix for running mpy-cross
+def _mpy_cross_command(mpy_cross=None) -> list:
+    if mpy_cross:
+        return [mpy_cross]
+    try:
+        import mpy_cross  # noqa: F401
+        return [sys.executable, '-m', 'mpy_cross']
+    except ImportError:
+        pass
+    path = shutil.which('mpy-cross')
+    if path is None:
+        raise SystemExit('mpy-cross not found: pip install mpy-cross (matching the firmware version) '
+                         'or use --mpy-cross')
+    return [path]
+
+
+def compile_mpy(source: str, output_dir: str, command: list, opt_level: int) -> str:
+    target = os.path.join(output_dir, os.path.splitext(os.path.basename(source))[0] + '.mpy')
+    subprocess.run(command + ['-march=armv6m', '-O{}'.format(opt_level), '-o', target, source], check=True)
+    return target
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# Returns the cache of the image, including the image data, or {} if there is no image matching it
+def _load_cache(image_path: str) -> dict:
+    try:
+        with open(image_path + CACHE_SUFFIX) as fh:
+            cache = json.load(fh)
+        with open(image_path, 'rb') as fh:
+            image = fh.read()
+    except (OSError, ValueError):
+        return {}
+    if cache.get('geometry') != list(GEOMETRY) or cache.get('image') != _sha256(image):
+        return {}  # Image modified or built differently – start over
+    cache['data'] = image
+    return cache
+
+
+# Returns a new, formatted file system, or mounts the given image data
+def _open_fs(data=None):
+    from littlefs import LittleFS
+    block_size, block_count, prog_size = GEOMETRY
+    if data is None:
+        return LittleFS(block_size=block_size, block_count=block_count, prog_size=prog_size)
+    lfs = LittleFS(block_size=block_size, block_count=block_count, prog_size=prog_size, mount=False)
+    lfs.context.buffer = bytearray(data)
+    lfs.mount()
+    return lfs
+
+
+# Builds (or updates) the image at output from the modules of root, see above. Returns the number of files written or
+# removed; 0 if the image was up to date and left untouched.
+def build_image(root: str, output: str, mpy=False, mpy_cross=None, opt_level=0, full=False, extra=EXTRA_FILES) -> int:
+    cache = {} if full else _load_cache(output)
+    lfs = _open_fs(cache.get('data'))
+    cached_files = cache.get('files', {})
+    files = {}
+    command = None
+    changes = 0
+
+    print('{:32} {:>8} {:>8}  {}'.format('Module', 'Source', 'Image', 'Status'))
+    with tempfile.TemporaryDirectory() as build_dir:
+        for filename in discover_modules(root, extra=extra):
+            path = os.path.join(root, filename)
+            with open(path, 'rb') as fh:
+                source = fh.read()
+            compiled = mpy and filename != ENTRY_POINT
+            image_name = os.path.splitext(filename)[0] + '.mpy' if compiled else filename
+            entry = {'hash': _sha256(source), 'build': 'mpy-O{}'.format(opt_level) if compiled else 'py'}
+            cached = cached_files.get(image_name)
+            if cached is not None and cached['hash'] == entry['hash'] and cached['build'] == entry['build']:
+                entry['size'] = cached['size']
+                status = 'unchanged'
+            else:
+                image_file = path
+                if compiled:
+                    if command is None:
+                        command = _mpy_cross_command(mpy_cross)
+                    image_file = compile_mpy(path, build_dir, command, opt_level)
+                with open(image_file, 'rb') as src_file, lfs.open(image_name, 'wb') as lfs_file:
+                    data = src_file.read()
+                    lfs_file.write(data)
+                entry['size'] = len(data)
+                status = 'new' if cached is None else 'changed'
+                changes += 1
+            files[image_name] = entry
+            print('{:32} {:>8} {:>8}  {}'.format(image_name, len(source), entry['size'], status))
+
+    for image_name in sorted(set(cached_files) - set(files)):
+        lfs.remove(image_name)
+        print('{:32} {:>8} {:>8}  {}'.format(image_name, '', '', 'removed'))
+        changes += 1
+
+    print('{:32} {:>8} {:>8}'.format('Total', '', sum(entry['size'] for entry in files.values())))
+    if cache and not changes:
+        print('{} is up to date'.format(output))
+        return 0
+
+    image = bytes(lfs.context.buffer)
+    with open(output, 'wb') as fh:
+        fh.write(image)
+    with open(output + CACHE_SUFFIX, 'w') as fh:
+        json.dump({'geometry': list(GEOMETRY), 'image': _sha256(image), 'files': files}, fh, indent=1, sort_keys=True)
+    print('{}: {} change(s)'.format(output, changes))
+    return changes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Create a LittleFS image with the firmware')
+    parser.add_argument('--mpy', action='store_true', help='precompile modules (except main.py) with mpy-cross')
+    parser.add_argument('--mpy-cross', default=None, help='mpy-cross executable to use')
+    parser.add_argument('--opt-level', type=int, default=0,
+                        help='mpy-cross optimization level; 1+ strips assertions and __debug__ blocks like -O')
+    parser.add_argument('--full', action='store_true', help='rebuild the image from scratch')
+    parser.add_argument('--include', nargs='+', default=[], metavar='FILE',
+                        help='further modules to run on the device, in addition to {}'.format(', '.join(EXTRA_FILES)))
+    parser.add_argument('--output', default=output_image)
+    args = parser.parse_args()
+    for filename in args.include:
+        if not os.path.isfile(filename):
+            parser.error('{} not found'.format(filename))
+    build_image('.', args.output, args.mpy, args.mpy_cross, args.opt_level, args.full,
+                EXTRA_FILES + tuple(args.include))
 
-for filename in files:
-    with open(filename, 'rb') as src_file, lfs.open(filename, 'w') as lfs_file:
-        lfs_file.write(src_file.read())
 
-with open(output_image, 'wb') as fh:
-    fh.write(lfs.context.buffer)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Decodes serial console output containing binary log frames (grinder_log.LOG_BINARY_OUTPUT = True) into text.
+# Anything that is not a log frame, e.g. output of print(), is passed through unchanged.
+#
+# Example: python3 tools/decode_log.py capture.bin
+#          cat /dev/ttyACM0 | python3 tools/decode_log.py
+import argparse
+import os
+import struct
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import grinder_log  # noqa: E402
+
+
+# Splits data into text and records. Returns a list of str (passed through output) and tuples (decoded records), and the
+# number of bytes at the end of data which could be the beginning of an incomplete frame.
+def decode(data: bytes):
+    items = []
+    text_start = 0
+    pos = data.find(grinder_log.FRAME_MARKER)
+    while pos >= 0:
+        if pos + grinder_log.FRAME_SIZE > len(data):
+            break
+        record = struct.unpack_from(grinder_log.FRAME_FORMAT, data, pos)[1:]
+        if record[1] not in grinder_log.EVENT_FORMATS:
+            # Not a frame after all, just bytes looking like the marker
+            pos = data.find(grinder_log.FRAME_MARKER, pos + 1)
+            continue
+        if pos > text_start:
+            items.append(data[text_start:pos].decode('utf-8', 'replace'))
+        items.append(record)
+        text_start = pos + grinder_log.FRAME_SIZE
+        pos = data.find(grinder_log.FRAME_MARKER, text_start)
+    end = len(data) if pos < 0 else pos
+    # Keep a trailing first marker byte, as the rest of the marker may follow with the next chunk
+    if pos < 0 and data.endswith(grinder_log.FRAME_MARKER[:1]):
+        end -= 1
+    if end > text_start:
+        items.append(data[text_start:end].decode('utf-8', 'replace'))
+    return items, len(data) - max(end, text_start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Decode binary grinder log frames into text')
+    parser.add_argument('input', nargs='?', default=None, help='capture file (default: stdin)')
+    args = parser.parse_args()
+
+    stream = open(args.input, 'rb') if args.input else sys.stdin.buffer
+    pending = b''
+    with stream:
+        while True:
+            chunk = stream.read1(4096) if hasattr(stream, 'read1') else stream.read(4096)
+            data = pending + chunk
+            items, remaining = decode(data)
+            for item in items:
+                if isinstance(item, str):
+                    sys.stdout.write(item)
+                else:
+                    sys.stdout.write(grinder_log.format_record(item) + '\n')
+            sys.stdout.flush()
+            pending = data[len(data) - remaining:] if remaining else b''
+            if not chunk:
+                # Incomplete frame or marker at the end of the input
+                sys.stdout.write(pending.decode('utf-8', 'replace'))
+                break
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# Measures the import time and heap usage of each firmware module on the device, e.g. to compare an image built with
+# and without --mpy (see create_littlefs_image.py). Run right after a soft reset, so no module is imported yet:
+#
+#   mpremote soft-reset run tools/import_timing.py
+#
+# Modules are imported in dependency order, so each one is timed on its own, without the modules it imports – the order
+# of create_littlefs_image.import_order(), which test_create_littlefs_image.py checks MODULES against.
+# grinder_controller and grinder_controller_states import each other, so they are timed together.
+import gc
+import sys
+import time
+
+MODULES = ('grinder_log', 'grinder_recorder', 'grinder_calibration', 'grinder_fast', 'grinder_filter',
+           'grinder_debouncer', 'grinder_detector', 'rp_devices', 'rp_dma', 'RP2040ADC', 'grinder_histogram',
+           'grinder_scheduler', 'grinder_core1', 'grinder_hardware', 'grinder_memory', 'grinder_profiler',
+           'grinder_controller', 'grinder_controller_async')
+
+
+def main():
+    total_us = 0
+    total_bytes = 0
+    print('{:28} {:>8} {:>8}'.format('Module', 'us', 'bytes'))
+    for name in MODULES:
+        if name in sys.modules:
+            print('{:28} already imported'.format(name))
+            continue
+        gc.collect()
+        free = gc.mem_free()
+        start = time.ticks_us()
+        __import__(name)
+        duration = time.ticks_diff(time.ticks_us(), start)
+        used = free - gc.mem_free()
+        total_us += duration
+        total_bytes += used
+        print('{:28} {:>8} {:>8}'.format(name, duration, used))
+    print('{:28} {:>8} {:>8}'.format('Total', total_us, total_bytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -54,12 +54,45 @@ if (fs.existsSync('littlefs.img')) {
 // const gdbServer = new GDBTCPServer(mcu, 3333);
 // console.log(`RP2040 GDB Server ready! Listening on port ${gdbServer.port}`);
 
+// Scenario mode (GRINDER_SCENARIO=<file.json>, used by tools/run_scenarios.py): Button and ADC events are taken from
+// the scenario instead of the fixed script below and scheduled relative to the serial output containing the scenario's
+// start marker. Applied events are reported on stderr as "rp2040js: event <index>", the end as "rp2040js: done".
+const scenarioFile = process.env.GRINDER_SCENARIO;
+const scenario = scenarioFile ? JSON.parse(fs.readFileSync(scenarioFile, 'utf8')) : null;
+if (scenario && scenario.adc) {
+  adcChannelValues = scenario.adc.slice();
+}
+let scenarioOutput: string | null = '';
+
+function startScenario() {
+  scenario.events.forEach((event: any, index: number) => setTimeout(() => {
+    if ('button' in event) {
+      buttonGpio.setInputValue(!event.button); // 1 = pressed, active low
+    }
+    if ('adc' in event) {
+      adcChannelValues[event.adc] = event.value;
+    }
+    process.stderr.write(`rp2040js: event ${index}\n`);
+  }, event.at_ms));
+  setTimeout(() => process.stderr.write('rp2040js: done\n'), scenario.duration_ms);
+}
+
 const cdc = new USBCDC(mcu.usbCtrl);
+const decoder = new TextDecoder();
 cdc.onSerialData = (value) => {
   process.stdout.write(value);
+  if (scenario && scenarioOutput !== null) {
+    scenarioOutput = (scenarioOutput + decoder.decode(value, { stream: true })).slice(-256);
+    if (scenarioOutput.includes(scenario.start_marker)) {
+      scenarioOutput = null;
+      startScenario();
+    }
+  }
 };
 
-process.stdin.setRawMode(true);
+if (process.stdin.isTTY) {
+  process.stdin.setRawMode(true);
+}
 process.stdin.on('data', (chunk) => {
   // 24 is Ctrl+X
   if (chunk[0] === 24) {
@@ -73,17 +106,19 @@ process.stdin.on('data', (chunk) => {
 mcu.PC = 0x10000000;
 mcu.execute();
 
-setTimeout(() => adcChannelValues[3] = 1111, 1000 * 10);
-setTimeout(() => buttonGpio.setInputValue(false), 1000 * 12);
-setTimeout(() => buttonGpio.setInputValue(true),  1000 * 12 + 300);
-setTimeout(() => adcChannelValues[3] = 900, 1000 * 12 + 100);
-setTimeout(() => adcChannelValues[3] = 999, 1000 * 15);
-setTimeout(() => buttonGpio.setInputValue(false), 1000 * 18);
-setTimeout(() => buttonGpio.setInputValue(true),  1000 * 22);
-setTimeout(() => adcChannelValues[3] = 4000, 1000 * 30);
-setTimeout(() => buttonGpio.setInputValue(false), 1000 * 32);
-setTimeout(() => buttonGpio.setInputValue(true),  1000 * 32 + 2);
-setTimeout(() => buttonGpio.setInputValue(false), 1000 * 32 + 4);
-setTimeout(() => buttonGpio.setInputValue(true),  1000 * 32 + 300);
-setTimeout(() => buttonGpio.setInputValue(false), 1000 * 34);
-setTimeout(() => buttonGpio.setInputValue(true), 1000 * 36);
+if (!scenario) {
+  setTimeout(() => adcChannelValues[3] = 1111, 1000 * 10);
+  setTimeout(() => buttonGpio.setInputValue(false), 1000 * 12);
+  setTimeout(() => buttonGpio.setInputValue(true),  1000 * 12 + 300);
+  setTimeout(() => adcChannelValues[3] = 900, 1000 * 12 + 100);
+  setTimeout(() => adcChannelValues[3] = 999, 1000 * 15);
+  setTimeout(() => buttonGpio.setInputValue(false), 1000 * 18);
+  setTimeout(() => buttonGpio.setInputValue(true),  1000 * 22);
+  setTimeout(() => adcChannelValues[3] = 4000, 1000 * 30);
+  setTimeout(() => buttonGpio.setInputValue(false), 1000 * 32);
+  setTimeout(() => buttonGpio.setInputValue(true),  1000 * 32 + 2);
+  setTimeout(() => buttonGpio.setInputValue(false), 1000 * 32 + 4);
+  setTimeout(() => buttonGpio.setInputValue(true),  1000 * 32 + 300);
+  setTimeout(() => buttonGpio.setInputValue(false), 1000 * 34);
+  setTimeout(() => buttonGpio.setInputValue(true), 1000 * 36);
+}
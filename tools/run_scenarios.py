@@ -0,0 +1,252 @@
+# Runs scenarios against the unmodified firmware in the rp2040js simulator, without user interaction, and reports
+# loop timing and transition latencies as JSON – a repeatable performance regression check without hardware.
+#
+# Each scenario (see tools/scenarios.json) declares the initial ADC values, a schedule of button and ADC events relative
+# to the firmware's "Hi" log line, and the expected sequence of state transitions. For every scenario, the simulator is
+# started through socat (like tools/start_socat_rp2040js.sh) with GRINDER_SCENARIO pointing to the scenario, so
+# micropython-run.ts applies the events. The controller's log output is read from the PTY; at the end the main loop is
+# interrupted with Ctrl+C and the free heap is queried over the REPL.
+#
+# Reported per scenario:
+# - transitions: state transition log messages in order, and whether they contain the expected ones
+# - latency_ms: time from an event to the transition it should cause (events with "transition"), e.g. including
+#               debouncing or stop detection. The firmware's log timestamps are mapped to host time by the smallest
+#               observed log line delay, so latencies are accurate to about one flush of the deferred log.
+# - loop_period_us: from the status log ("Time for 1000 runs")
+# - scheduler: jitter and missed deadlines from the scheduler statistics (if the loop period is fixed)
+#
+# The LittleFS image (see create_littlefs_image.py) has to be built and available to rp2040js beforehand.
+# Example: python3 tools/run_scenarios.py --simulator-dir ../rp2040js --report report.json
+import argparse
+import json
+import os
+import re
+import selectors
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SCENARIOS = os.path.join(TOOLS_DIR, 'scenarios.json')
+DEFAULT_COMMAND = 'npm run start:micropython'
+
+# Serial output starting the event schedule of a scenario
+START_MARKER = ' – Hi'
+# Maximum time from an event to the transition it causes
+LATENCY_WINDOW_MS = 3000
+# Time allowed for starting the simulator and booting MicroPython
+BOOT_TIMEOUT_S = 120
+REPL_TIMEOUT_S = 10
+
+_LOG_LINE = re.compile(r'^(\d+) – (.*)$')
+_HEAP_FREE = re.compile(r'heap_free (\d+)')
+_RUNS_TIME = re.compile(r'Time for 1000 runs: (\d+)us')
+_SCHEDULER_STATS = re.compile(r'Loop period (\d+)us; jitter \[us\]: n=(\d+) min=(-?\d+) p50=(-?\d+) p90=(-?\d+) '
+                              r'p99=(-?\d+) max=(-?\d+); missed deadlines: (\d+)')
+
+
+# Output of a scenario run: serial lines and applied events, each as (host time [us], ...)
+class ScenarioRun:
+    def __init__(self):
+        self.lines = []  # (host_us, line)
+        self.events = []  # (host_us, event index)
+        self.done = False
+        self.heap_free = None
+
+
+# Returns (device time [us], message) of a controller log line, or None
+def parse_log_line(line: str):
+    match = _LOG_LINE.match(line)
+    return (int(match.group(1)), match.group(2)) if match else None
+
+
+def _stats(values) -> dict:
+    if not values:
+        return {'n': 0}
+    return {'n': len(values), 'min': min(values), 'mean': sum(values) / len(values), 'max': max(values)}
+
+
+# Whether expected is a subsequence of the messages, matching by substring
+def _contains_in_order(messages, expected) -> bool:
+    remaining = iter(messages)
+    return all(any(pattern in message for message in remaining) for pattern in expected)
+
+
+def analyse(scenario: dict, run: ScenarioRun) -> dict:
+    log = []  # (host_us, device_us, message)
+    for host_us, line in run.lines:
+        parsed = parse_log_line(line)
+        if parsed is not None:
+            log.append((host_us, parsed[0], parsed[1]))
+    transitions = [(device_us, message) for _, device_us, message in log if message.startswith('Entering')]
+
+    loop_periods = []
+    jitter_p99 = []
+    jitter_max = []
+    missed_deadlines = 0
+    for _, _, message in log:
+        match = _RUNS_TIME.search(message)
+        if match:
+            loop_periods.append(int(match.group(1)) / 1000)
+        match = _SCHEDULER_STATS.search(message)
+        if match and int(match.group(2)):
+            jitter_p99.append(int(match.group(6)))
+            jitter_max.append(int(match.group(7)))
+            missed_deadlines += int(match.group(8))
+
+    # Host time of a log line minus its device time is the device's time offset plus the delay of the line
+    offset = min(host_us - device_us for host_us, device_us, _ in log) if log else None
+    events = []
+    latencies = []
+    passed = run.done and _contains_in_order([message for _, message in transitions], scenario.get('expect', ()))
+    for host_us, index in run.events:
+        event = dict(scenario['events'][index])
+        expected = event.get('transition')
+        if expected is not None:
+            event_us = host_us - offset if offset is not None else None
+            latency = None
+            for device_us, message in transitions:
+                if event_us is not None and expected in message and \
+                        0 <= device_us - event_us <= LATENCY_WINDOW_MS * 1000:
+                    latency = (device_us - event_us) / 1000
+                    break
+            event['latency_ms'] = latency
+            if latency is None:
+                passed = False
+            else:
+                latencies.append(latency)
+        events.append(event)
+    if len(run.events) != len(scenario['events']):
+        passed = False
+
+    return {
+        'name': scenario['name'],
+        'passed': passed,
+        'transitions': [message for _, message in transitions],
+        'events': events,
+        'latency_ms': _stats(latencies),
+        'loop_period_us': _stats(loop_periods),
+        'scheduler': {'jitter_p99_us': max(jitter_p99, default=None), 'jitter_max_us': max(jitter_max, default=None),
+                      'missed_deadlines': missed_deadlines},
+        'heap_free': run.heap_free,
+    }
+
+
+# Reads the serial PTY and the simulator's stderr (event reports) line by line, with host time stamps
+class _Reader:
+    def __init__(self, serial_fd: int, stderr, run: ScenarioRun):
+        self._serial_fd = serial_fd
+        self._run = run
+        self._partial = {serial_fd: b'', stderr.fileno(): b''}
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(serial_fd, selectors.EVENT_READ)
+        self._selector.register(stderr.fileno(), selectors.EVENT_READ)
+
+    @property
+    def prompt(self) -> bool:
+        return self._partial[self._serial_fd].endswith(b'>>> ')
+
+    def read_until(self, condition, timeout_s: float) -> bool:
+        deadline = time.monotonic() + timeout_s
+        while not condition():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._selector.get_map():
+                return False
+            for key, _ in self._selector.select(remaining):
+                try:
+                    data = os.read(key.fd, 4096)
+                except OSError:
+                    data = b''  # PTY closed
+                if not data:
+                    self._selector.unregister(key.fd)
+                    continue
+                host_us = time.monotonic_ns() // 1000
+                *lines, self._partial[key.fd] = (self._partial[key.fd] + data).split(b'\n')
+                for line in lines:
+                    self._line(key.fd, host_us, line.decode('utf-8', 'replace').rstrip('\r'))
+        return True
+
+    def _line(self, fd: int, host_us: int, line: str) -> None:
+        run = self._run
+        if fd == self._serial_fd:
+            run.lines.append((host_us, line))
+            match = _HEAP_FREE.search(line)  # the line may start with the REPL prompt
+            if match:
+                run.heap_free = int(match.group(1))
+        elif line.startswith('rp2040js: event '):
+            run.events.append((host_us, int(line.split()[2])))
+        elif line == 'rp2040js: done':
+            run.done = True
+
+
+def _open_pty(link: str, process, timeout_s: float) -> int:
+    deadline = time.monotonic() + timeout_s
+    while not os.path.exists(link):
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError('simulator did not start')
+        time.sleep(0.1)
+    return os.open(link, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+
+
+def run_scenario(scenario: dict, simulator_dir: str, command: str, boot_timeout_s: float) -> ScenarioRun:
+    run = ScenarioRun()
+    with tempfile.TemporaryDirectory() as tmp:
+        scenario_file = os.path.join(tmp, 'scenario.json')
+        with open(scenario_file, 'w') as fh:
+            json.dump(dict(scenario, start_marker=scenario.get('start_marker', START_MARKER)), fh)
+        link = os.path.join(tmp, 'serialport')
+        process = subprocess.Popen(['socat', 'pty,rawer,link=' + link, 'EXEC:' + command + ',pty,rawer'],
+                                   cwd=simulator_dir, env=dict(os.environ, GRINDER_SCENARIO=scenario_file),
+                                   stderr=subprocess.PIPE, start_new_session=True)
+        try:
+            serial_fd = _open_pty(link, process, boot_timeout_s)
+            try:
+                reader = _Reader(serial_fd, process.stderr, run)
+                if reader.read_until(lambda: run.done, boot_timeout_s + 2 * scenario['duration_ms'] / 1000):
+                    os.write(serial_fd, b'\x03')
+                    if reader.read_until(lambda: reader.prompt, REPL_TIMEOUT_S):
+                        os.write(serial_fd, b"import gc;gc.collect();print('heap_free', gc.mem_free())\r")
+                        reader.read_until(lambda: run.heap_free is not None, REPL_TIMEOUT_S)
+            finally:
+                os.close(serial_fd)
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+    return run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run scenarios against the firmware in the rp2040js simulator')
+    parser.add_argument('scenarios', nargs='?', default=DEFAULT_SCENARIOS, help='scenario file (JSON)')
+    parser.add_argument('--simulator-dir', default='.', help='rp2040js directory to run the command in')
+    parser.add_argument('--command', default=DEFAULT_COMMAND, help='command starting micropython-run.ts')
+    parser.add_argument('--only', action='append', help='run only the named scenario(s)')
+    parser.add_argument('--boot-timeout', type=float, default=BOOT_TIMEOUT_S, help='[s]')
+    parser.add_argument('--report', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    with open(args.scenarios) as fh:
+        scenarios = json.load(fh)['scenarios']
+    results = []
+    for scenario in scenarios:
+        if args.only and scenario['name'] not in args.only:
+            continue
+        result = analyse(scenario, run_scenario(scenario, args.simulator_dir, args.command, args.boot_timeout))
+        results.append(result)
+        print('{:20} {:6} latency [ms]: {}; loop period [us]: {}'.format(
+            result['name'], 'passed' if result['passed'] else 'FAILED', result['latency_ms'],
+            result['loop_period_us']), file=sys.stderr)
+
+    report = json.dumps({'scenarios': results}, indent=1)
+    if args.report:
+        with open(args.report, 'w') as fh:
+            fh.write(report + '\n')
+    else:
+        print(report)
+    sys.exit(0 if all(result['passed'] for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+# Replays recorded voltage traces through the grinder state machine to tune automatic grind stopping.
+#
+# Trace files are CSV with a header line "t_ms,voltage[,button]" (button: 1 = pressed). Without a button column, a short
+# press at the start of the trace is assumed, i.e. an automatic grind. A comment line "# end_ms=<t>" marks the time at
+# which the beans were actually gone – the ideal stop time – which is needed for the over-grind/false stop metrics.
+# Session files recorded on the device (GrinderRecorder, *.grs – copy the "sessions" directory from the device) can be
+# used directly: each session is a trace, with the button presses reconstructed from the recorded transitions. They
+# have no end time, as the device cannot know when the beans were gone.
+#
+# Two engines:
+# - exact: Runs each trace through the unmodified firmware using the host simulation (sim/grinder_sim.py). Slow, but
+#          exactly what the device would do. Parameters are applied by patching the constants in grinder_hardware, so
+#          any stop detector can be evaluated, e.g. the CUSUM parameters via --set CUSUM_THRESHOLD=100,200,400.
+# - numpy: Vectorized model of the threshold stop (VOLTAGE_FILTER_SIZE SMA, AUTOGRIND_STOP_VOLTAGE_FACTOR) on a fixed
+#          loop period grid, which sweeps whole parameter grids over hundreds of traces at once. Use it to narrow down
+#          parameters, then verify the candidates with the exact engine.
+#
+# Example: python3 tools/trace_replay.py traces/*.csv --factors 1.02:1.2:0.01 --filter-sizes 1,4,16 --engine numpy
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'sim'))
+
+DEFAULT_PRESS_MS = (100, 200)  # (start, duration) of the assumed button press for traces without a button column
+
+
+class Trace:
+    def __init__(self, name: str, times_ms, voltages, buttons=None, end_ms=None):
+        self.name = name
+        self.times_ms = list(times_ms)
+        self.voltages = list(voltages)
+        self.buttons = list(buttons) if buttons is not None else None
+        self.end_ms = end_ms
+
+    @property
+    def duration_ms(self) -> int:
+        return self.times_ms[-1] if self.times_ms else 0
+
+    # Button changes as (time in ms, pressed) pairs
+    def button_events(self):
+        if self.buttons is None:
+            start, duration = DEFAULT_PRESS_MS
+            return [(start, True), (start + duration, False)]
+        events = []
+        previous = False
+        for t, pressed in zip(self.times_ms, self.buttons):
+            if bool(pressed) != previous:
+                previous = bool(pressed)
+                events.append((t, previous))
+        return events
+
+
+def load_trace(path: str) -> Trace:
+    end_ms = None
+    rows = []
+    with open(path, newline='') as fh:
+        for line in fh:
+            if line.startswith('#'):
+                key, _, value = line[1:].strip().partition('=')
+                if key.strip() == 'end_ms':
+                    end_ms = int(value)
+            elif line.strip():
+                rows.append(line)
+    reader = csv.DictReader(rows)
+    times, voltages, buttons = [], [], []
+    for row in reader:
+        times.append(int(float(row['t_ms'])))
+        voltages.append(int(float(row['voltage'])))
+        if row.get('button') not in (None, ''):
+            buttons.append(int(row['button']))
+    return Trace(os.path.basename(path), times, voltages, buttons if buttons else None, end_ms)
+
+
+# Traces of the sessions in a file recorded by GrinderRecorder. The trace starts with the button press entering the
+# grind begin state; the button is released one debounce time before automatic grinding was entered, or before idle
+# was entered when grinding manually.
+def load_sessions(path: str) -> list:
+    import grinder_sim
+    grinder_sim.install()
+    import grinder_log
+    import grinder_recorder
+    from grinder_hardware import DEBOUNCE_TIME_MS
+
+    with open(path, 'rb') as fh:
+        sessions = grinder_recorder.read_sessions(fh.read())
+    traces = []
+    for index, session in enumerate(sessions):
+        times = [i * session.interval_ms for i in range(len(session.samples))]
+        presses = []  # (start, end) in ms
+        start_ms = 0
+        for at_ms, event in session.transitions:
+            if start_ms is not None and event in (grinder_log.EVENT_AUTOGRIND, grinder_log.EVENT_IDLE):
+                presses.append((start_ms, at_ms - DEBOUNCE_TIME_MS))
+                start_ms = None
+            elif start_ms is None and event == grinder_log.EVENT_MANUAL_GRIND:
+                start_ms = at_ms - DEBOUNCE_TIME_MS  # pressed again while grinding automatically
+        if start_ms is not None:
+            presses.append((start_ms, times[-1] + 1 if times else 0))
+        buttons = [1 if any(start <= t < end for start, end in presses) else 0 for t in times]
+        name = '{}#{} ({})'.format(os.path.basename(path), index,
+                                   grinder_recorder.STOP_REASONS.get(session.stop_reason, session.stop_reason))
+        traces.append(Trace(name, times, session.samples, buttons))
+    return traces
+
+
+# CSV trace or session file
+def load_traces(path: str) -> list:
+    if path.endswith('.grs'):
+        return load_sessions(path)
+    return [load_trace(path)]
+
+
+# Metrics of a single replayed session. stop_ms is None if the grind was not stopped automatically.
+class ReplayResult:
+    def __init__(self, trace: Trace, stop_ms, reason: str):
+        self.trace = trace.name
+        self.stop_ms = stop_ms
+        self.reason = reason
+        self.end_ms = trace.end_ms
+
+    @property
+    def false_stop(self) -> bool:
+        return self.stop_ms is not None and self.end_ms is not None and self.stop_ms < self.end_ms
+
+    @property
+    def overgrind_ms(self):
+        if self.stop_ms is None or self.end_ms is None or self.false_stop:
+            return None
+        return self.stop_ms - self.end_ms
+
+    def as_dict(self) -> dict:
+        return {'trace': self.trace, 'stop_ms': self.stop_ms, 'reason': self.reason, 'end_ms': self.end_ms,
+                'false_stop': self.false_stop, 'overgrind_ms': self.overgrind_ms}
+
+
+def summarize(params: dict, results) -> dict:
+    overgrinds = [r.overgrind_ms for r in results if r.overgrind_ms is not None]
+    return dict(params,
+                traces=len(results),
+                false_stops=sum(1 for r in results if r.false_stop),
+                not_stopped=sum(1 for r in results if r.stop_ms is None),
+                mean_overgrind_ms=sum(overgrinds) / len(overgrinds) if overgrinds else None,
+                max_overgrind_ms=max(overgrinds) if overgrinds else None)
+
+
+# Exact engine: replays one trace through the firmware in the host simulation. A stop factor selects the threshold
+# detector; overrides patches further grinder_hardware constants by name.
+def replay_exact(trace: Trace, stop_factor=None, filter_size=None, loop_cost_us=1000, overrides=None) -> ReplayResult:
+    import grinder_sim
+    grinder_sim.install()
+    import grinder_hardware as hw
+
+    patched = {}
+    if stop_factor is not None:
+        patched['AUTOGRIND_DETECTOR'] = 'threshold'
+        patched['AUTOGRIND_STOP_VOLTAGE_FACTOR'] = stop_factor
+    if filter_size is not None:
+        patched['VOLTAGE_FILTER_ENABLED'] = filter_size > 1
+        patched['VOLTAGE_FILTER_SIZE'] = max(filter_size, 1)
+    patched.update(overrides or {})
+    for name in patched:
+        if not hasattr(hw, name):
+            raise ValueError('Unknown grinder_hardware constant: {}'.format(name))
+    originals = {name: getattr(hw, name) for name in patched}
+    try:
+        for name, value in patched.items():
+            setattr(hw, name, value)
+        sim = grinder_sim.GrinderSimulation(voltage=trace.voltages[0], loop_cost_us=loop_cost_us)
+        sim.set_voltage_trace(zip(trace.times_ms, trace.voltages))
+        for at_ms, pressed in trace.button_events():
+            sim.set_button(at_ms, pressed)
+        sim.run_until(trace.duration_ms)
+    finally:
+        for name, value in originals.items():
+            setattr(hw, name, value)
+
+    stop_ms = None
+    reason = 'not stopped'
+    for (entered_ms, previous), (at_ms, state) in zip(sim.transitions, sim.transitions[1:]):
+        if previous == 'AutoGrindState':
+            if state != 'IdleState':
+                reason = 'manual'
+            elif at_ms - entered_ms >= hw.AUTOGRIND_SAFETY_STOP_MS:
+                reason = 'timeout'
+            else:
+                stop_ms, reason = at_ms, 'auto'
+            break
+    return ReplayResult(trace, stop_ms, reason)
+
+
+# Factors of None keep the configured detector. grid is a list of override dicts (see replay_exact) to sweep as well.
+def sweep_exact(traces, factors, filter_sizes, loop_cost_us=1000, grid=({},)):
+    summaries = []
+    for overrides in grid:
+        for filter_size in filter_sizes:
+            for factor in factors:
+                results = [replay_exact(t, factor, filter_size, loop_cost_us, overrides) for t in traces]
+                summaries.append(summarize(dict(overrides, stop_factor=factor, filter_size=filter_size), results))
+    return summaries
+
+
+# Integer SMA exactly like GrinderFilter, applied along the last axis of a 2D array (one row per trace)
+def sma_numpy(values, filter_size: int, initial_value: int):
+    import numpy as np
+    import grinder_sim
+    grinder_sim.install()
+    from grinder_filter import sma_fixed_numpy
+    values = np.asarray(values, dtype=np.int64)
+    if filter_size <= 1:
+        return values.copy()
+    return sma_fixed_numpy(values, np.full(filter_size, initial_value), initial_value << 16) >> 16
+
+
+# NumPy engine: Models AutoGrindState with the threshold stop on a loop period grid. All traces are resampled (sample
+# and hold) onto one grid, so each filter size is a single vectorized operation over all traces, and each trace's stop
+# time for all factors is found by a binary search in its running maximum.
+def sweep_numpy(traces, factors, filter_sizes, loop_period_ms=1):
+    import numpy as np
+    import grinder_sim
+    grinder_sim.install()
+    import grinder_hardware as hw
+
+    grid_len = max(t.duration_ms for t in traces) // loop_period_ms + 1
+    grid_ms = np.arange(grid_len) * loop_period_ms
+    voltages = np.empty((len(traces), grid_len), dtype=np.int64)
+    auto_index = np.full(len(traces), -1)
+    for row, trace in enumerate(traces):
+        indices = np.searchsorted(trace.times_ms, grid_ms, side='right') - 1
+        voltages[row] = np.asarray(trace.voltages)[np.clip(indices, 0, None)]
+        events = trace.button_events()
+        # Automatic grinding is entered after a short press once the debounced release has been seen
+        if len(events) >= 2 and events[1][0] - events[0][0] < hw.AUTOGRIND_TIMEOUT_MS:
+            release_ms = events[1][0] + hw.DEBOUNCE_TIME_MS + loop_period_ms
+            auto_index[row] = min(grid_len - 1, -(-release_ms // loop_period_ms))
+    safety_len = hw.AUTOGRIND_SAFETY_STOP_MS // loop_period_ms
+    factors = np.asarray(factors, dtype=float)
+
+    summaries = []
+    for filter_size in filter_sizes:
+        filtered = sma_numpy(voltages, filter_size, hw.VOLTAGE_THRESH_HIGH) if filter_size > 1 else voltages
+        stop_ms = np.full((len(factors), len(traces)), -1, dtype=np.int64)
+        for row in range(len(traces)):
+            start = auto_index[row]
+            if start < 0:
+                continue
+            window = filtered[row, start + 1:start + 1 + safety_len]
+            running_max = np.maximum.accumulate(window)
+            thresholds = filtered[row, start] * factors
+            hit = np.searchsorted(running_max, thresholds, side='left')
+            valid = hit < len(window)
+            stop_ms[valid, row] = grid_ms[start + 1 + hit[valid]]
+        for factor_index, factor in enumerate(factors):
+            results = []
+            for row, trace in enumerate(traces):
+                stop = int(stop_ms[factor_index, row])
+                results.append(ReplayResult(trace, stop, 'auto') if stop >= 0 else
+                               ReplayResult(trace, None, 'not stopped'))
+            summaries.append(summarize({'stop_factor': float(factor), 'filter_size': filter_size}, results))
+    return summaries
+
+
+def _parse_range(text: str):
+    if ':' in text:
+        start, stop, step = (float(v) for v in text.split(':'))
+        count = int(round((stop - start) / step)) + 1
+        return [round(start + i * step, 6) for i in range(count)]
+    return [float(v) for v in text.split(',')]
+
+
+# Cartesian product of "NAME=a,b,c" assignments as list of override dicts
+def _parse_grid(assignments):
+    names, values = [], []
+    for assignment in assignments:
+        name, _, text = assignment.partition('=')
+        names.append(name.strip())
+        values.append([int(v) if v.lstrip('-').isdigit() else v for v in text.split(',')])
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay voltage traces through the grinder state machine')
+    parser.add_argument('traces', nargs='+', help='trace CSV files or recorded session files (.grs)')
+    parser.add_argument('--engine', choices=('exact', 'numpy'), default='exact')
+    parser.add_argument('--detector', choices=('threshold', 'cusum'), default=None,
+                        help='stop detector (default: AUTOGRIND_DETECTOR, or threshold if --factors is given)')
+    parser.add_argument('--factors', default=None, help='stop voltage factors, "a,b,c" or "start:stop:step"')
+    parser.add_argument('--filter-sizes', default=None, help='voltage filter sizes, e.g. "1,4,16" (1 = no filter)')
+    parser.add_argument('--loop-ms', type=int, default=1, help='control loop period to model')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=a,b',
+                        help='exact engine: sweep a grinder_hardware constant, e.g. CUSUM_DRIFT=10,20 (repeatable)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    import grinder_sim
+    grinder_sim.install()
+    import grinder_hardware as hw
+
+    traces = [trace for path in args.traces for trace in load_traces(path)]
+    detector = args.detector or ('threshold' if args.factors else hw.AUTOGRIND_DETECTOR)
+    if detector == 'threshold':
+        factors = _parse_range(args.factors) if args.factors else [hw.AUTOGRIND_STOP_VOLTAGE_FACTOR]
+    elif args.factors or args.engine == 'numpy':
+        parser.error('--factors and the numpy engine only apply to the threshold detector')
+    else:
+        factors = [None]
+    default_size = hw.VOLTAGE_FILTER_SIZE if hw.VOLTAGE_FILTER_ENABLED else 1
+    filter_sizes = [int(v) for v in _parse_range(args.filter_sizes)] if args.filter_sizes else [default_size]
+    grid = [dict(g, AUTOGRIND_DETECTOR=detector) for g in _parse_grid(args.set)]
+
+    if args.engine == 'numpy':
+        summaries = sweep_numpy(traces, factors, filter_sizes, args.loop_ms)
+    else:
+        summaries = sweep_exact(traces, factors, filter_sizes, args.loop_ms * 1000, grid)
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+        return
+    params = [name for name in summaries[0] if name not in ('traces', 'false_stops', 'not_stopped',
+                                                            'mean_overgrind_ms', 'max_overgrind_ms')]
+    print(' '.join('{:>12}'.format(name[-12:]) for name in params) + ' {:>6} {:>6} {:>8} {:>12} {:>11}'.format(
+        'traces', 'false', 'no stop', 'mean over', 'max over'))
+    for s in sorted(summaries, key=lambda s: (s['false_stops'], s['mean_overgrind_ms'] or 0)):
+        print(' '.join('{:>12}'.format('-' if s[name] is None else str(s[name])) for name in params) +
+              ' {:>6} {:>6} {:>8} {:>12} {:>11}'.format(
+                  s['traces'], s['false_stops'], s['not_stopped'],
+                  '-' if s['mean_overgrind_ms'] is None else '{:.1f}ms'.format(s['mean_overgrind_ms']),
+                  '-' if s['max_overgrind_ms'] is None else '{}ms'.format(s['max_overgrind_ms'])))
+
+
+if __name__ == '__main__':
+    main()